@@ -5,8 +5,14 @@ import pathlib
 from dotenv import load_dotenv
 import i18n
 
-from riffbot.bot import bot
+from riffbot import metrics
+from riffbot.audio import cpumeter, player
+from riffbot.bot import bot, get_topic_updater, set_snapshot_store
+from riffbot.cache.diskcache import DiskCache
+from riffbot.endpoints import httppool, texttospeech, youtube
 from riffbot.options import LogLevel, parse_options
+from riffbot.snapshots import SnapshotStore
+from riffbot.utils import converters, profiling
 
 
 class TokenNotFoundError(Exception):
@@ -46,7 +52,37 @@ def main():
 
     # Set options and run the bot
     bot.command_prefix = options.command_prefix
+    youtube.set_download_window(options.download_window)
+    player.set_playback_mode(options.playback_mode)
+    player.set_read_ahead_size(options.read_ahead_size * 2**10)
+    if options.playback_mode == "opus":
+        # YouTube's WebM streams contain Opus, which can be sent without transcoding
+        youtube.set_preferred_format("webm")
+    disk_caches = {}
+    if options.cache_dir:
+        disk_caches["audio"] = DiskCache(os.path.join(options.cache_dir, "audio"), options.audio_cache_size * 2**20)
+        disk_caches["opus"] = DiskCache(os.path.join(options.cache_dir, "opus"), options.opus_cache_size * 2**20)
+        youtube.set_audio_cache(disk_caches["audio"])
+        player.set_opus_cache(disk_caches["opus"])
+    if options.snapshot_dir:
+        set_snapshot_store(SnapshotStore(options.snapshot_dir), options.snapshot_interval)
+    if options.profile_threshold:
+        profiling.set_profile_threshold(options.profile_threshold / 1000)
+    if options.metrics_port:
+        metrics.register_caches([converters.get_search_cache(), youtube.get_metadata_cache(),
+                                 youtube.get_stream_cache(), texttospeech.get_speech_cache()])
+        metrics.register_disk_caches(disk_caches)
+        metrics.start_server(options.metrics_address, options.metrics_port)
     bot.run(token)
+    logger.info(f"Shared HTTP pool: {httppool.get_stats()}")
+    logger.info(f"Playback CPU usage: {cpumeter.get_stats()}")
+    logger.info(f"Search cache: {converters.get_search_cache()}")
+    logger.info(f"Video metadata cache: {youtube.get_metadata_cache()}")
+    logger.info(f"Stream URL cache: {youtube.get_stream_cache()}")
+    logger.info(f"Speech cache: {texttospeech.get_speech_cache()}")
+    for name, cache in disk_caches.items():
+        logger.info(f"{name.capitalize()} file cache: {cache}")
+    logger.info(f"Channel topic updates: {get_topic_updater()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import discord
+
+_logger = logging.getLogger(__name__)
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class CpuUsage:
+    """CPU time used by one stream, split into its ffmpeg process and the voice client's thread (reading packets and,
+    if the source is not Opus, encoding them)"""
+
+    def __init__(self, wall_time: float, ffmpeg_time: float, thread_time: float):
+        self._wall_time = wall_time
+        self._ffmpeg_time = ffmpeg_time
+        self._thread_time = thread_time
+
+    def get_wall_time(self) -> float:
+        return self._wall_time
+
+    def get_ffmpeg_time(self) -> float:
+        return self._ffmpeg_time
+
+    def get_thread_time(self) -> float:
+        return self._thread_time
+
+    def get_load(self) -> float:
+        """Get the fraction of a CPU core that the stream used while it was playing"""
+        return (self._ffmpeg_time + self._thread_time) / self._wall_time if self._wall_time > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.get_load() * 100:.1f}% of a core ({self._ffmpeg_time:.2f}s ffmpeg, "
+                f"{self._thread_time:.2f}s voice thread in {self._wall_time:.1f}s)")
+
+
+class CpuStats:
+    """Sums up the CPU usage of all streams per playback mode"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams: Dict[str, int] = {}
+        self._usage: Dict[str, CpuUsage] = {}
+
+    def record(self, mode: str, usage: CpuUsage):
+        with self._lock:
+            total = self._usage.get(mode, CpuUsage(0.0, 0.0, 0.0))
+            self._usage[mode] = CpuUsage(total.get_wall_time() + usage.get_wall_time(),
+                                         total.get_ffmpeg_time() + usage.get_ffmpeg_time(),
+                                         total.get_thread_time() + usage.get_thread_time())
+            self._streams[mode] = self._streams.get(mode, 0) + 1
+
+    def get_streams(self, mode: str) -> int:
+        return self._streams.get(mode, 0)
+
+    def get_usage(self, mode: str) -> Optional[CpuUsage]:
+        """Get the total usage of all streams played in mode. Its load is the average load per concurrent stream."""
+        return self._usage.get(mode)
+
+    def __str__(self) -> str:
+        return ", ".join(f"{mode}: {self._streams[mode]} streams at {usage.get_load() * 100:.1f}% of a core each"
+                         for mode, usage in self._usage.items()) or "no streams"
+
+
+_stats = CpuStats()
+
+
+def get_stats() -> CpuStats:
+    return _stats
+
+
+class MeasuredAudioSource(discord.AudioSource):
+    """Wraps an ffmpeg audio source and measures the CPU time it costs. The voice client calls read() from its own
+    thread every 20 ms, so everything that thread does between two reads (including Opus encoding) is attributed to
+    the source."""
+
+    def __init__(self, source: discord.FFmpegAudio, mode: str):
+        self._source = source
+        self._mode = mode
+        self._start_time: Optional[float] = None
+        self._last_read: Optional[float] = None
+        self._last_thread_time: Optional[float] = None
+        self._thread_time = 0.0
+        self._ffmpeg_time = 0.0
+        self._done = False
+
+    def read(self) -> bytes:
+        thread_time = time.thread_time()
+        if self._last_thread_time is None:
+            self._start_time = time.perf_counter()
+        else:
+            self._thread_time += thread_time - self._last_thread_time
+        self._last_thread_time = thread_time
+        self._last_read = time.perf_counter()
+        return self._source.read()
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self):
+        if not self._done:
+            self._done = True
+            # Read the CPU time of ffmpeg before the process is killed
+            self._ffmpeg_time = _get_process_time(getattr(self._source, "_process", None))
+            usage = self.get_usage()
+            _stats.record(self._mode, usage)
+            _logger.debug(f"CPU usage of stream ({self._mode}): {usage}")
+        self._source.cleanup()
+
+    def get_usage(self) -> CpuUsage:
+        wall_time = self._last_read - self._start_time if self._start_time is not None else 0.0
+        return CpuUsage(wall_time, self._ffmpeg_time, self._thread_time)
+
+
+def _get_process_time(process) -> float:
+    """Get the CPU time (user and system) used by a running child process so far (only supported on Linux)"""
+    if process is None:
+        return 0.0
+    try:
+        with open(f"/proc/{process.pid}/stat") as stat:
+            # The command name in the second field may contain spaces, so count fields from its end
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return 0.0
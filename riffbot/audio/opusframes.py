@@ -0,0 +1,138 @@
+import logging
+import mmap
+import struct
+import threading
+from typing import Optional
+
+import discord
+
+from riffbot.cache.diskcache import CacheWriter
+
+_logger = logging.getLogger(__name__)
+
+MAGIC = b"RBOP"
+VERSION = 1
+FRAME_LENGTH = 20  # milliseconds, the length of every packet that is sent to Discord
+LENGTH_TOLERANCE = 2.0  # seconds, recordings that are shorter than the song by more than this are incomplete
+
+# File format: a header (magic, version, frame length in ms), followed by the Opus packets of the song, each prefixed
+# with its length as a big-endian 16 bit integer
+_HEADER = struct.Struct(">4sBxH")
+_LENGTH = struct.Struct(">H")
+
+
+class InvalidFrameFileError(Exception):
+    pass
+
+
+class OpusFrameWriter:
+    """Writes Opus packets to a new cache entry"""
+
+    def __init__(self, writer: CacheWriter):
+        self._writer = writer
+        self._frames = 0
+        writer.write(_HEADER.pack(MAGIC, VERSION, FRAME_LENGTH))
+
+    def write(self, packet: bytes):
+        self._writer.write(_LENGTH.pack(len(packet)) + packet)
+        self._frames += 1
+
+    def get_frames(self) -> int:
+        return self._frames
+
+    def commit(self):
+        self._writer.commit()
+
+    def abort(self):
+        self._writer.abort()
+
+
+class OpusFrameSource(discord.AudioSource):
+    """Plays the Opus packets of a frame file, without any ffmpeg process. The file is memory-mapped, so it can be
+    played even if it is evicted from the cache in the meantime."""
+
+    def __init__(self, path: str, *, start: float = 0.0):
+        self._lock = threading.Lock()
+        self._pos = _HEADER.size
+        with open(path, "rb") as file:
+            self._map: Optional[mmap.mmap] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size or _HEADER.unpack_from(self._map) != (MAGIC, VERSION, FRAME_LENGTH):
+            self.cleanup()
+            raise InvalidFrameFileError(f"{path} is not a frame file of version {VERSION}")
+        if start > 0:
+            self.seek(start)
+
+    def read(self) -> bytes:
+        # Called by the voice client's thread every 20 ms
+        with self._lock:
+            if self._map is None or self._pos + _LENGTH.size > len(self._map):
+                return b""
+            length, = _LENGTH.unpack_from(self._map, self._pos)
+            start = self._pos + _LENGTH.size
+            if start + length > len(self._map):
+                return b""
+            self._pos = start + length
+            return self._map[start:self._pos]
+
+    def is_opus(self) -> bool:
+        return True
+
+    def seek(self, position: float) -> float:
+        """Continue playback at the frame containing position (in seconds). Returns the start time of that frame."""
+        target = int(position * 1000) // FRAME_LENGTH
+        with self._lock:
+            if self._map is None:
+                return 0.0
+            pos = _HEADER.size
+            frame = 0
+            while frame < target and pos + _LENGTH.size <= len(self._map):
+                length, = _LENGTH.unpack_from(self._map, pos)
+                pos += _LENGTH.size + length
+                frame += 1
+            self._pos = pos
+        return frame * FRAME_LENGTH / 1000
+
+    def cleanup(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+
+class RecordingAudioSource(discord.AudioSource):
+    """Passes the packets of a source on to the voice client and writes them to a frame file at the same time. If the
+    source produces PCM, it is encoded here instead of in the voice client, so there is no additional encoding cost.
+    The file is only committed if the source is played until its end and (if expected_length is given) the recording
+    is about as long as the song."""
+
+    def __init__(self, source: discord.AudioSource, writer: OpusFrameWriter, *,
+                 expected_length: Optional[float] = None):
+        self._source = source
+        self._writer = writer
+        self._expected_length = expected_length
+        self._encoder = None if source.is_opus() else discord.opus.Encoder()
+
+    def read(self) -> bytes:
+        data = self._source.read()
+        if not data:
+            length = self._writer.get_frames() * FRAME_LENGTH / 1000
+            if self._expected_length is not None and length < self._expected_length - LENGTH_TOLERANCE:
+                # The stream was cut off, e.g. because its download failed
+                _logger.debug(f"Discarding incomplete recording ({length:.1f}s of {self._expected_length}s)")
+                self._writer.abort()
+            else:
+                _logger.debug(f"Recorded {self._writer.get_frames()} frames ({length:.1f}s)")
+                self._writer.commit()
+            return data
+        if self._encoder is not None:
+            data = self._encoder.encode(data, self._encoder.SAMPLES_PER_FRAME)
+        self._writer.write(data)
+        return data
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        # Does nothing if the file was committed already
+        self._writer.abort()
+        self._source.cleanup()
@@ -1,27 +1,72 @@
 import asyncio
+from concurrent.futures import Future
 import logging
 import os
 import threading
-from typing import Optional
+from typing import Callable, Iterable, Optional, Tuple
 
 from blinker import signal
 import discord
 
-from riffbot.endpoints.endpoint import Endpoint
+from riffbot import metrics
+from riffbot.cache.diskcache import DiskCache
+from riffbot.endpoints.endpoint import Endpoint, InvalidSeekPositionError
+from riffbot.options import PLAYBACK_MODES
 from riffbot.utils.duration import Duration
+from .cpumeter import MeasuredAudioSource
+from .opusframes import InvalidFrameFileError, OpusFrameSource, OpusFrameWriter, RecordingAudioSource
+from .prefetcher import PrefetchedStream
+from .readahead import DEFAULT_SIZE as DEFAULT_READ_AHEAD_SIZE, ReadAheadBuffer
 from .songqueue import SongQueue
 
 _logger = logging.getLogger(__name__)
 
+PREFETCH_SECONDS = 10.0
+
+_playback_mode = "pcm"
+_opus_cache: Optional[DiskCache] = None
+_read_ahead_size = DEFAULT_READ_AHEAD_SIZE
+
+
+def set_playback_mode(mode: str):
+    """Set how audio is handed to the voice client. In "pcm" mode, ffmpeg decodes to PCM and the voice client encodes
+    every frame to Opus. In "opus" mode, ffmpeg produces Opus packets that are sent as they are, and sources that
+    already are Opus are not transcoded at all."""
+    global _playback_mode
+    if mode not in PLAYBACK_MODES:
+        raise ValueError(f"Unknown playback mode \"{mode}\"")
+    _playback_mode = mode
+
+
+def set_read_ahead_size(size: int):
+    """Set the maximum number of bytes that are downloaded ahead of ffmpeg per stream"""
+    global _read_ahead_size
+    _read_ahead_size = size
+
+
+def set_opus_cache(cache: Optional[DiskCache]):
+    """Set the cache for encoded Opus frames of songs (None disables caching). Songs that are played completely are
+    recorded, and cached songs are played straight from their frames without downloading or ffmpeg."""
+    global _opus_cache
+    _opus_cache = cache
+
 
 class Player:
-    def __init__(self, voice_client: discord.VoiceClient):
+    def __init__(self, voice_client: discord.VoiceClient, *, prefetch_seconds: float = PREFETCH_SECONDS):
         _logger.debug(f"Initializing")
         self._voice_client = voice_client
         self._song_queue = SongQueue()
         self._current = None
         self._stop_after_current = False
         self._song_timer = Duration()
+        self._prefetch_seconds = prefetch_seconds
+        self._prefetched: Optional[PrefetchedStream] = None
+        self._prefetch_scheduled = False
+        self._seek_position: Optional[float] = None
+        self._seek_paused = False
+        self._audio_source: Optional[discord.AudioSource] = None
+        self._buffer: Optional[ReadAheadBuffer] = None
+        signal("songqueue_changed").connect(self._on_queue_changed, sender=self._song_queue)
 
     def __del__(self):
         _logger.debug("Destroying")
@@ -35,7 +80,7 @@ class Player:
         elif not self._voice_client.is_playing():
             _logger.debug("Starting playback")
             if self._song_queue.size() > 0:
-                self._init_playback(self._song_queue.get_next())
+                self._play_next()
 
     def pause(self):
         if self._voice_client.is_playing():
@@ -46,14 +91,50 @@ class Player:
     def stop(self):
         if self._voice_client.is_playing() or self._voice_client.is_paused():
             _logger.debug("Stopping playback")
+            self._seek_position = None
             self._stop_after_current = True
             self._voice_client.stop()
+        self._discard_prefetched()
 
     def skip(self):
         if self._voice_client.is_playing() or self._voice_client.is_paused():
             _logger.debug("Skipping song")
+            self._seek_position = None
             self._voice_client.stop()
 
+    async def seek(self, position: float) -> float:
+        """Seek to a position (in seconds) in the current song. Returns the position at which playback continues,
+        which may be slightly before the requested one."""
+        endpoint = self._current
+        if endpoint is None:
+            raise InvalidSeekPositionError("No song is playing")
+        length = endpoint.get_length()
+        if position < 0 or (length is not None and position >= length):
+            raise InvalidSeekPositionError(f"Position {position} is out of bounds (song length: {length})")
+
+        audio_source = self._audio_source
+        if isinstance(audio_source, OpusFrameSource):
+            # Cached frames can be skipped right away, without restarting playback
+            actual_position = audio_source.seek(position)
+            _logger.debug(f"Seeking to {actual_position:.2f}s in cached frames")
+            self._song_timer.reset(actual_position)
+            if not self._voice_client.is_paused():
+                self._song_timer.start()
+            return actual_position
+
+        # Looking up the position may need to load the index of the song, so don't block the event loop with it
+        actual_position = await asyncio.get_event_loop().run_in_executor(None, endpoint.seek, position)
+        if endpoint is not self._current:
+            _logger.debug("Song changed while seeking")
+            return actual_position
+
+        # Stopping the current playback restarts it from the new position (see _on_song_over)
+        _logger.debug(f"Seeking to {actual_position:.2f}s")
+        self._seek_position = actual_position
+        self._seek_paused = self._voice_client.is_paused()
+        self._voice_client.stop()
+        return actual_position
+
     def is_playing(self):
         return self._voice_client.is_playing()
 
@@ -69,21 +150,29 @@ class Player:
     def get_queue(self) -> SongQueue:
         return self._song_queue
 
-    def _init_playback(self, endpoint: Endpoint):
-        self._current = endpoint
-
-        # Create pipe for ffmpeg
-        pipe_read, pipe_write = os.pipe()
+    def get_buffer(self) -> Optional[ReadAheadBuffer]:
+        """Get the read-ahead buffer of the current song (None if it is played from cached frames)"""
+        return self._buffer
 
-        # Create and start thread that loads chunks and fills the pipe
-        _logger.debug("Preparing thread for downloader")
-        halt_event = threading.Event()
-        downloader_thread = threading.Thread(target=_downloader, args=(endpoint, pipe_write, halt_event))
-        downloader_thread.start()
+    def _play_next(self):
+        prefetched, self._prefetched = self._prefetched, None
+        endpoint = self._song_queue.get_next()
+        chunks = None
+        if prefetched:
+            if prefetched.get_endpoint() is endpoint and not _is_cached(endpoint):
+                chunks = prefetched.take()
+            else:
+                prefetched.discard()
+        self._init_playback(endpoint, chunks)
 
-        # Set up audio source
-        _logger.debug("Setting up audio source")
-        audio_source = discord.FFmpegPCMAudio(pipe_read, pipe=True)
+    def _init_playback(self, endpoint: Endpoint, chunks: Optional[Iterable[bytes]] = None, *,
+                       position: Optional[float] = None, paused: bool = False):
+        """Start playing endpoint. If position is given, this restarts the current song after seeking (and pauses it
+        again right away if paused is set)."""
+        self._current = endpoint
+        audio_source, buffer, release = _open_audio_source(endpoint, chunks, position)
+        self._audio_source = audio_source
+        self._buffer = buffer
 
         # Set up callback to execute in the Player's thread when playing finishes
         event_loop = asyncio.get_event_loop()
@@ -94,24 +183,45 @@ class Player:
                 _logger.error(f"Error occurred during playback: {error}")
 
             # Clean up resources
-            self._current = None
-            halt_event.set()
-            os.close(pipe_read)
+            if self._seek_position is None:
+                self._current = None
+            release()
+            if buffer is not None:
+                _logger.info(f"Read-ahead of \"{endpoint.get_song_description()}\": {buffer.get_stats()}")
             self._voice_client.stop()
             audio_source.cleanup()
 
             # Dispatch callback in main thread
-            asyncio.run_coroutine_threadsafe(self._on_song_over(), event_loop)
+            asyncio.run_coroutine_threadsafe(self._on_song_over(endpoint), event_loop)
 
-        # Emit event that a song is starting
-        signal("player_song_start").send(self, song=self.get_current())
+        if position is None:
+            # Emit event that a song is starting
+            signal("player_song_start").send(self, song=self.get_current())
+        else:
+            self._song_timer.reset(position)
 
         # Start playing
-        self._voice_client.play(audio_source, after=callback)
-        self._song_timer.start()
+        self._voice_client.play(_NotifyingAudioSource(audio_source, self._on_audio_start), after=callback)
+        if paused:
+            self._voice_client.pause()
+        else:
+            self._song_timer.start()
         _logger.debug("Playback initialized")
 
-    async def _on_song_over(self):
+        # Start buffering the next song while this one plays
+        self._schedule_prefetch()
+
+    def _on_audio_start(self):
+        # Called from the voice client's thread
+        signal("player_audio_start").send(self)
+
+    async def _on_song_over(self, endpoint: Endpoint):
+        if self._seek_position is not None:
+            position, self._seek_position = self._seek_position, None
+            _logger.debug("Restarting song after seeking")
+            self._init_playback(endpoint, position=position, paused=self._seek_paused)
+            return
+
         _logger.debug("Song is over")
 
         # Emit event that a song finished
@@ -125,23 +235,177 @@ class Player:
             self._stop_after_current = False
         elif self._song_queue.size() > 0:
             _logger.debug("Playing next song in queue")
-            self._init_playback(self._song_queue.get_next())
+            self._play_next()
+
+    def _on_queue_changed(self, sender: SongQueue):
+        self._schedule_prefetch()
+
+    def _schedule_prefetch(self):
+        # Defer updating the prefetched song until the current batch of queue operations is done
+        if not self._prefetch_scheduled:
+            self._prefetch_scheduled = True
+            asyncio.get_event_loop().call_soon(self._update_prefetch)
+
+    def _update_prefetch(self):
+        self._prefetch_scheduled = False
+        head = self._song_queue.peek()
+        if self._prefetched and self._prefetched.get_endpoint() is not head:
+            # The queue was reordered, shuffled or cleared
+            self._discard_prefetched()
+        if (not self._prefetched and head is not None and self._current is not None and not self._stop_after_current
+                and self._prefetch_seconds > 0 and not _is_cached(head)):
+            self._prefetched = PrefetchedStream(head, self._prefetch_seconds)
+
+    def _discard_prefetched(self):
+        if self._prefetched:
+            self._prefetched.discard()
+            self._prefetched = None
+
+
+def _is_cached(endpoint: Endpoint) -> bool:
+    key = endpoint.get_cache_key()
+    return _opus_cache is not None and key is not None and _opus_cache.contains(key)
+
 
+class _DeferredOpusAudio(discord.AudioSource):
+    """Starts ffmpeg on the first read (in the voice client's thread), once the downloader thread knows the codec of
+    the stream. Without a codec, ffmpeg encodes to Opus."""
 
-def _downloader(endpoint: Endpoint, pipe_write: int, halt_event: threading.Event):
+    def __init__(self, pipe_read: int, codec: Future):
+        self._pipe_read = pipe_read
+        self._codec = codec
+        self._source: Optional[discord.FFmpegOpusAudio] = None
+
+    @property
+    def _process(self):
+        # Read by MeasuredAudioSource to measure ffmpeg's CPU time
+        return self._source._process if self._source is not None else None
+
+    def read(self) -> bytes:
+        if self._source is None:
+            self._source = discord.FFmpegOpusAudio(self._pipe_read, pipe=True, codec=self._codec.result())
+            metrics.ffmpeg_processes.inc()
+        return self._source.read()
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        source, self._source = self._source, None
+        if source is not None:
+            source.cleanup()
+            metrics.ffmpeg_processes.dec()
+
+
+def _open_audio_source(endpoint: Endpoint, chunks: Optional[Iterable[bytes]],
+                       position: Optional[float]) -> Tuple[discord.AudioSource, Optional[ReadAheadBuffer],
+                                                           Callable[[], None]]:
+    """Create the audio source for endpoint, starting at position if it was seeked to. Returns the source, the
+    read-ahead buffer that feeds it (None for cached frames) and a function that stops the download and releases the
+    pipe once the source is done."""
+    key = endpoint.get_cache_key()
+    path = _opus_cache.get_path(key) if _opus_cache is not None and key is not None else None
+    if path is not None:
+        try:
+            _logger.debug("Playing cached Opus frames")
+            return OpusFrameSource(path, start=position or 0.0), None, lambda: None
+        except InvalidFrameFileError as error:
+            _logger.warning(f"Ignoring cached frames: {error}")
+
+    if chunks is None:
+        chunks = endpoint.stream_chunks()
+
+    # Create pipe for ffmpeg
+    pipe_read, pipe_write = os.pipe()
+
+    # Create and start the threads that download chunks into the buffer and feed them from there to ffmpeg
+    _logger.debug("Preparing threads for downloader and feeder")
+    buffer = ReadAheadBuffer(_read_ahead_size)
+    codec: Optional[Future] = Future() if _playback_mode == "opus" else None
+    threading.Thread(target=_downloader, args=(endpoint, chunks, buffer), kwargs={"codec": codec}).start()
+    threading.Thread(target=_feeder, args=(buffer, pipe_write)).start()
+
+    # Set up audio source
+    _logger.debug("Setting up audio source")
+    if _playback_mode == "opus":
+        # An Opus stream is only repackaged (codec copy), anything else is encoded once by ffmpeg. The process is
+        # counted once it is started.
+        source = _DeferredOpusAudio(pipe_read, codec)
+    else:
+        source = discord.FFmpegPCMAudio(pipe_read, pipe=True)
+        metrics.ffmpeg_processes.inc()
+
+    def release():
+        buffer.close()
+        os.close(pipe_read)
+        if not isinstance(source, _DeferredOpusAudio):
+            metrics.ffmpeg_processes.dec()
+    audio_source = MeasuredAudioSource(source, _playback_mode)
+    if _opus_cache is not None and key is not None and position is None:
+        writer = OpusFrameWriter(_opus_cache.open_writer(key))
+        audio_source = RecordingAudioSource(audio_source, writer, expected_length=endpoint.get_length())
+    return audio_source, buffer, release
+
+
+def _downloader(endpoint: Endpoint, chunks: Iterable[bytes], buffer: ReadAheadBuffer, *,
+                codec: Optional[Future] = None):
+    """Download chunks into the buffer. If codec is given, it is resolved with the codec of the endpoint first."""
     _logger.debug(f"Downloader thread started for \"{endpoint.get_song_description()}\"")
+    metrics.downloader_threads.inc()
     try:
-        for chunk in endpoint.stream_chunks():
-            if halt_event.is_set():
-                _logger.debug("Downloader received halt event")
+        if codec is not None:
+            # May initialize the endpoint, which is blocking network I/O
+            codec.set_result(endpoint.get_codec())
+        for chunk in chunks:
+            if not buffer.put(chunk):
+                _logger.debug("Downloader stopped by closed buffer")
                 break
-            os.write(pipe_write, chunk)
-            if halt_event.is_set():
-                _logger.debug("Downloader received halt event")
+    except Exception as error:
+        _logger.error(f"Download of \"{endpoint.get_song_description()}\" failed: {error}")
+    finally:
+        if codec is not None and not codec.done():
+            codec.set_result(None)
+        buffer.finish()
+        # Stops the requests that are still in flight
+        if hasattr(chunks, "close"):
+            chunks.close()
+        metrics.downloader_threads.dec()
+        _logger.debug(f"Downloader thread finished for \"{endpoint.get_song_description()}\"")
+
+
+def _feeder(buffer: ReadAheadBuffer, pipe_write: int):
+    try:
+        while True:
+            chunk = buffer.get()
+            if chunk is None:
                 break
+            # Blocks while ffmpeg is busy (the pipe is full), which in turn makes the buffer fill up
+            os.write(pipe_write, chunk)
     except BrokenPipeError:
         # The read end may be closed at any point in time, if this happens ignore it and clean up
         pass
     finally:
         os.close(pipe_write)
-        _logger.debug(f"Downloader thread finished for \"{endpoint.get_song_description()}\"")
+        buffer.close()
+
+
+class _NotifyingAudioSource(discord.AudioSource):
+    """Passes the packets of a source on and calls on_start when the first one is read, i.e. when the song becomes
+    audible"""
+
+    def __init__(self, source: discord.AudioSource, on_start: Callable[[], None]):
+        self._source = source
+        self._on_start: Optional[Callable[[], None]] = on_start
+
+    def read(self) -> bytes:
+        data = self._source.read()
+        if data and self._on_start is not None:
+            on_start, self._on_start = self._on_start, None
+            on_start()
+        return data
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self):
+        self._source.cleanup()
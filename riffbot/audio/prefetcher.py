@@ -0,0 +1,86 @@
+import logging
+import threading
+from typing import Iterator, List, Optional
+
+from riffbot.endpoints.endpoint import Endpoint
+
+_logger = logging.getLogger(__name__)
+
+FALLBACK_BUFFER_SIZE = 262144  # 256 KB, used if the bit rate of an endpoint is unknown
+
+
+class PrefetchedStream:
+    """Resolves an endpoint and buffers the first seconds of its stream in a background thread, so that playback of the
+    endpoint can start right away once the previous song is over"""
+
+    def __init__(self, endpoint: Endpoint, seconds: float):
+        _logger.debug(f"Prefetching {seconds} seconds of \"{endpoint.get_song_description()}\"")
+        self._endpoint = endpoint
+        self._seconds = seconds
+        self._chunks: List[bytes] = []
+        self._iterator: Optional[Iterator[bytes]] = None
+        self._failed = False
+        self._done = False
+        self._discarded = False
+        self._lock = threading.Lock()
+        self._halt_event = threading.Event()
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+
+    def get_endpoint(self) -> Endpoint:
+        return self._endpoint
+
+    def take(self) -> Iterator[bytes]:
+        """Stop buffering and hand over the stream, starting with the buffered chunks. The returned iterator waits for
+        the prefetching thread itself, so this does not block the caller."""
+        self._halt_event.set()
+        return self._drain()
+
+    def discard(self):
+        _logger.debug(f"Discarding prefetched stream of \"{self._endpoint.get_song_description()}\"")
+        self._halt_event.set()
+        with self._lock:
+            self._discarded = True
+            if self._done:
+                self._close()
+
+    def _drain(self) -> Iterator[bytes]:
+        self._thread.join()
+        if self._failed or self._iterator is None:
+            # Nothing has been played yet, so simply start over
+            yield from self._endpoint.stream_chunks()
+            return
+        _logger.debug(f"Using {sum(len(chunk) for chunk in self._chunks)} prefetched bytes of "
+                      f"\"{self._endpoint.get_song_description()}\"")
+        yield from self._chunks
+        self._chunks.clear()
+        yield from self._iterator
+
+    def _prefetch(self):
+        try:
+            self._endpoint.initialize()
+            bit_rate = self._endpoint.get_bit_rate()
+            buffer_size = int(bit_rate / 8 * self._seconds) if bit_rate else FALLBACK_BUFFER_SIZE
+            self._iterator = iter(self._endpoint.stream_chunks())
+            buffered = 0
+            while buffered < buffer_size and not self._halt_event.is_set():
+                chunk = next(self._iterator)
+                self._chunks.append(chunk)
+                buffered += len(chunk)
+        except StopIteration:
+            pass
+        except Exception as error:
+            _logger.warning(f"Prefetching \"{self._endpoint.get_song_description()}\" failed: {error}")
+            self._failed = True
+        finally:
+            with self._lock:
+                self._done = True
+                if self._discarded:
+                    self._close()
+
+    def _close(self):
+        # Only called once the prefetching thread is no longer using the iterator
+        self._chunks.clear()
+        if self._iterator is not None and hasattr(self._iterator, "close"):
+            self._iterator.close()
+        self._iterator = None
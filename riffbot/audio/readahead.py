@@ -0,0 +1,137 @@
+import collections
+import threading
+import time
+from typing import Deque, Optional
+
+DEFAULT_SIZE = 2097152  # 2 MB
+
+
+class BufferStats:
+    """Statistics of a read-ahead buffer. Underruns (the buffer ran empty while playing) mean that the download is too
+    slow. The time the download waited on a full buffer is how far it was ahead of playback, which is the normal case
+    for a download that is faster than real time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._underruns = 0
+        self._underrun_time = 0.0
+        self._longest_underrun = 0.0
+        self._full_time = 0.0
+        self._startup_time: Optional[float] = None
+
+    def record_underrun(self, seconds: float):
+        with self._lock:
+            self._underruns += 1
+            self._underrun_time += seconds
+            self._longest_underrun = max(self._longest_underrun, seconds)
+
+    def record_full(self, seconds: float):
+        with self._lock:
+            self._full_time += seconds
+
+    def record_startup(self, seconds: float):
+        self._startup_time = seconds
+
+    def get_underruns(self) -> int:
+        return self._underruns
+
+    def get_underrun_time(self) -> float:
+        return self._underrun_time
+
+    def get_longest_underrun(self) -> float:
+        return self._longest_underrun
+
+    def get_full_time(self) -> float:
+        """Get the time the producer waited because the buffer was full"""
+        return self._full_time
+
+    def get_startup_time(self) -> Optional[float]:
+        """Get the time until the first chunk arrived in the buffer"""
+        return self._startup_time
+
+    def __str__(self) -> str:
+        startup = f"{self._startup_time * 1000:.0f} ms" if self._startup_time is not None else "never"
+        return (f"first chunk after {startup}, {self._underruns} underruns ({self._underrun_time:.2f}s, longest "
+                f"{self._longest_underrun:.2f}s), download waited {self._full_time:.2f}s on a full buffer")
+
+
+class ReadAheadBuffer:
+    """Bounded queue of chunks between a producer thread (the download) and a consumer thread (feeding ffmpeg). The
+    producer blocks while the buffer holds max_bytes or more, so memory usage stays bounded even if the download is
+    much faster than playback. A single chunk is always accepted by an empty buffer, regardless of its size."""
+
+    def __init__(self, max_bytes: int = DEFAULT_SIZE):
+        self._max_bytes = max_bytes
+        self._chunks: Deque[bytes] = collections.deque()
+        self._size = 0
+        self._max_fill = 0
+        self._finished = False
+        self._closed = False
+        self._received = False
+        self._created = time.perf_counter()
+        self._condition = threading.Condition()
+        self._stats = BufferStats()
+
+    def put(self, chunk: bytes) -> bool:
+        """Add a chunk, waiting for space if the buffer is full. Returns False if the consumer has closed the buffer."""
+        with self._condition:
+            if self._size > 0 and self._size + len(chunk) > self._max_bytes and not self._closed:
+                start = time.perf_counter()
+                self._condition.wait_for(lambda: self._size + len(chunk) <= self._max_bytes or self._size == 0
+                                         or self._closed)
+                self._stats.record_full(time.perf_counter() - start)
+            if self._closed:
+                return False
+            if not self._received:
+                self._received = True
+                self._stats.record_startup(time.perf_counter() - self._created)
+            self._chunks.append(chunk)
+            self._size += len(chunk)
+            self._max_fill = max(self._max_fill, self._size)
+            self._condition.notify_all()
+            return True
+
+    def finish(self):
+        """Called by the producer after the last chunk"""
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def get(self) -> Optional[bytes]:
+        """Take the next chunk, waiting for one if the buffer is empty. Returns None after the last chunk or if the
+        buffer was closed."""
+        with self._condition:
+            if not self._chunks and not self._finished and not self._closed:
+                start = time.perf_counter()
+                started = self._received
+                self._condition.wait_for(lambda: self._chunks or self._finished or self._closed)
+                # Waiting for the very first chunk is part of the startup, waiting for the end is not an underrun either
+                if started and self._chunks:
+                    self._stats.record_underrun(time.perf_counter() - start)
+            if not self._chunks or self._closed:
+                return None
+            chunk = self._chunks.popleft()
+            self._size -= len(chunk)
+            self._condition.notify_all()
+            return chunk
+
+    def close(self):
+        """Stop the buffer from either side. Buffered chunks are dropped and both sides return right away."""
+        with self._condition:
+            self._closed = True
+            self._chunks.clear()
+            self._size = 0
+            self._condition.notify_all()
+
+    def get_fill_level(self) -> int:
+        """Get the number of buffered bytes"""
+        return self._size
+
+    def get_max_fill_level(self) -> int:
+        return self._max_fill
+
+    def get_max_size(self) -> int:
+        return self._max_bytes
+
+    def get_stats(self) -> BufferStats:
+        return self._stats
@@ -1,22 +1,34 @@
-import collections
 import logging
 import random
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
+
+from blinker import signal
 
 from riffbot.endpoints.endpoint import Endpoint
-from riffbot.utils import utils
 
 _logger = logging.getLogger(__name__)
 
+_COMPACT_THRESHOLD = 1024  # Number of consumed entries at the head of the list before it is compacted
+
 
 class InvalidPositionError(Exception):
     pass
 
 
 class SongQueue:
+    """Queue of endpoints with positional operations. The total length of the queue is kept up to date with every
+    operation, so it can be read in constant time no matter how long the queue is.
+
+    Entries are stored in a list together with their length at the time they were enqueued. Taking the next song only
+    advances the index of the head, the consumed part of the list is dropped from time to time."""
+
     def __init__(self):
         _logger.debug("Initializing")
-        self._queue = collections.deque()
+        self._entries: List[Optional[Tuple[Endpoint, Optional[int]]]] = []
+        self._head = 0
+        self._total_length = 0
+        self._unknown_lengths = 0
+        self._version = 0
 
     def __del__(self):
         _logger.debug("Destroying")
@@ -25,35 +37,106 @@ class SongQueue:
         if isinstance(endpoints, Endpoint):
             endpoints = [endpoints]
         _logger.debug(f"Enqueueing {len(endpoints)} songs{f' at pos {pos}' if pos is not None else ''}")
+        entries = [(endpoint, endpoint.get_length()) for endpoint in endpoints]
         if pos is not None:
             if pos < 0 or pos > self.size():
                 raise InvalidPositionError(f"Position {pos} is out of bounds (queue size: {self.size()})")
-            for offset, endpoint in enumerate(endpoints):
-                self._queue.insert(pos + offset, endpoint)
+            # Inserts all entries with a single move of the entries behind them
+            self._entries[self._head + pos:self._head + pos] = entries
         else:
-            self._queue.extend(endpoints)
+            self._entries.extend(entries)
+        for _, length in entries:
+            self._add_length(length, 1)
+        self._changed()
+
+    def remove(self, pos: int) -> Endpoint:
+        self._check_position(pos)
+        endpoint, length = self._entries.pop(self._head + pos)
+        _logger.debug(f"Removing song at pos {pos}")
+        self._add_length(length, -1)
+        self._changed()
+        return endpoint
+
+    def move(self, from_pos: int, to_pos: int):
+        """Move the song at from_pos so that it ends up at to_pos"""
+        self._check_position(from_pos)
+        self._check_position(to_pos)
+        _logger.debug(f"Moving song from pos {from_pos} to pos {to_pos}")
+        entry = self._entries.pop(self._head + from_pos)
+        self._entries.insert(self._head + to_pos, entry)
+        self._changed()
 
     def shuffle(self) -> None:
         _logger.debug("Shuffling the queue")
-        elements = self.list()
-        random.shuffle(elements)
-        self.clear()
-        self._queue.extend(elements)
+        self._compact()
+        random.shuffle(self._entries)
+        self._changed()
 
     def get_next(self) -> Optional[Endpoint]:
-        try:
-            return self._queue.popleft()
-        except IndexError:
+        if self.size() == 0:
+            return None
+        endpoint, length = self._entries[self._head]
+        self._entries[self._head] = None
+        self._head += 1
+        if self._head >= _COMPACT_THRESHOLD and self._head * 2 >= len(self._entries):
+            self._compact()
+        self._add_length(length, -1)
+        self._changed()
+        return endpoint
+
+    def peek(self) -> Optional[Endpoint]:
+        if self.size() == 0:
             return None
+        return self._entries[self._head][0]
 
-    def list(self) -> List[Endpoint]:
-        return [endpoint for endpoint in self._queue]
+    def find(self, endpoint: Endpoint) -> Optional[int]:
+        for idx in range(self._head, len(self._entries)):
+            if self._entries[idx][0] is endpoint:
+                return idx - self._head
+        return None
+
+    def list(self, start: int = 0, stop: Optional[int] = None) -> List[Endpoint]:
+        """Get the songs from position start up to (but excluding) position stop, or until the end"""
+        stop = self.size() if stop is None else min(stop, self.size())
+        return [endpoint for endpoint, _ in self._entries[self._head + start:self._head + stop]]
 
     def clear(self):
-        self._queue.clear()
+        self._entries = []
+        self._head = 0
+        self._total_length = 0
+        self._unknown_lengths = 0
+        self._changed()
 
     def size(self) -> int:
-        return len(self._queue)
+        return len(self._entries) - self._head
 
     def get_total_length(self) -> int:
-        return utils.get_total_length(self._queue)
+        """Get the sum of the lengths of all songs (songs of unknown length count as 0)"""
+        return self._total_length
+
+    def get_unknown_lengths(self) -> int:
+        """Get the number of songs whose length is unknown"""
+        return self._unknown_lengths
+
+    def get_version(self) -> int:
+        """Get a number that changes whenever the contents or the order of the queue change"""
+        return self._version
+
+    def _add_length(self, length: Optional[int], sign: int):
+        if length is None:
+            self._unknown_lengths += sign
+        else:
+            self._total_length += sign * length
+
+    def _check_position(self, pos: int):
+        if pos < 0 or pos >= self.size():
+            raise InvalidPositionError(f"Position {pos} is out of bounds (queue size: {self.size()})")
+
+    def _compact(self):
+        del self._entries[:self._head]
+        self._head = 0
+
+    def _changed(self):
+        self._version += 1
+        # Emit event that the contents or the order of the queue changed
+        signal("songqueue_changed").send(self)
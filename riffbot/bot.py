@@ -1,76 +1,179 @@
 import asyncio
 import functools
 import logging
+import time
 import traceback
-from typing import Optional
-import urllib
+from typing import Callable, List, Optional, Tuple
 
-from blinker import signal
 import discord
 from discord.ext import commands
 from i18n import t
 
+from riffbot import metrics
 from riffbot.audio.player import Player
-from riffbot.endpoints.endpoint import Endpoint
+from riffbot.endpoints import resolver
+from riffbot.endpoints.endpoint import Endpoint, InvalidSeekPositionError, SeekNotSupportedError
 from riffbot.endpoints.texttospeech import TextToSpeechEndpoint
 from riffbot.endpoints.youtube import YouTubeEndpoint
-from riffbot.utils import actions, checks, converters, utils
-from riffbot.utils.timer import Timer
+from riffbot.guilds import GuildRegistry
+from riffbot.snapshots import DEFAULT_INTERVAL as DEFAULT_SNAPSHOT_INTERVAL, SnapshotManager, SnapshotStore
+from riffbot.utils import actions, checks, converters, profiling, utils
+from riffbot.utils.topics import TopicUpdater
 
 _logger = logging.getLogger(__name__)
 
-bot: commands.Bot = commands.Bot(command_prefix="!")
 
-_player: Optional[Player] = None
-_leave_timer: Optional[Timer] = None
+class _Bot(commands.Bot):
+    async def close(self):
+        # Save the queues before the voice clients are disconnected, which would end their songs
+        if _snapshots:
+            await _snapshots.save_changes()
+        await super().close()
 
 
-def cancel_leave_timer():
-    global _leave_timer
-    if _leave_timer:
-        _leave_timer.cancel()
-        _leave_timer = None
+bot: commands.Bot = _Bot(command_prefix="!")
 
+_guilds = GuildRegistry()
+_snapshots: Optional[SnapshotManager] = None
+_snapshot_task: Optional[asyncio.Future] = None
+_topics = TopicUpdater()
 
-def reset_leave_timer():
-    if _leave_timer:
-        _leave_timer.reset_timeout()
+metrics.get_registry().callback(
+    "riffbot_queue_depth", "Number of songs in the queue of a guild",
+    lambda: {(str(state.get_guild_id()),): state.get_player().get_queue().size() for state in _guilds.list()},
+    ["guild"])
 
 
-def _on_song_start(ctx: commands.Context, sender: Player, song: Endpoint):
-    _logger.debug("Song start handler called")
+def set_snapshot_store(store: Optional[SnapshotStore], interval: float = DEFAULT_SNAPSHOT_INTERVAL):
+    """Set where the queues of all guilds are saved, so they can be restored after a restart (None disables it)"""
+    global _snapshots
+    _snapshots = SnapshotManager(store, _guilds, interval=interval) if store is not None else None
+
+
+def get_topic_updater() -> TopicUpdater:
+    return _topics
+
+
+def _get_player(ctx: commands.Context) -> Optional[Player]:
+    return _guilds.get_player(ctx.guild.id)
+
+
+def cancel_leave_timer(ctx: commands.Context):
+    state = _guilds.get(ctx.guild.id)
+    if state:
+        state.cancel_leave_timer()
 
-    async def exec():
-        try:
-            await ctx.channel.edit(topic=t("commands.channel_topic_playing", locale=ctx.guild.preferred_locale,
-                                           desc=song.get_song_description()))
-        except discord.Forbidden:
-            _logger.warning("Unable to edit channel description to current song (missing permission)")
 
-    asyncio.ensure_future(exec())
+def reset_leave_timer(ctx: commands.Context):
+    state = _guilds.get(ctx.guild.id)
+    if state:
+        state.reset_leave_timer()
+
+
+async def _on_leave_timeout(ctx: commands.Context):
+    await leave_channel(ctx)
+
+
+def _on_song_start(ctx: commands.Context, sender: Player, song: Endpoint):
+    _logger.debug("Song start handler called")
+    _topics.set_topic(ctx.channel, t("commands.channel_topic_playing", locale=ctx.guild.preferred_locale,
+                                     desc=song.get_song_description()))
 
 
 def _on_song_stop(ctx: commands.Context, sender: Player, is_last: bool):
     _logger.debug("Song stop handler called")
+    if is_last:
+        state = _guilds.get(ctx.guild.id)
+        if state:
+            state.start_leave_timer(120, _on_leave_timeout, ctx)  # 2 minutes until bot leaves the channel
+        _topics.set_topic(ctx.channel, None)
+
+
+async def _resolve_endpoints(args: Tuple[str, ...]) -> Tuple[Optional[List[YouTubeEndpoint]],
+                                                             Optional[resolver.PlaylistResolution]]:
+    """Resolve command arguments to endpoints. Of a playlist, only the first entry is resolved right away, the playlist
+    resolution is returned as well so that the remaining entries can be loaded afterwards."""
+    playlist = resolver.open_youtube_playlist(list(args))
+    if playlist is None:
+        return await resolver.resolve_youtube(list(args)), None
+    try:
+        endpoints = await playlist.next_batch(1)
+    except converters.PlaylistNotFoundError:
+        return None, None
+    return (endpoints if len(endpoints) > 0 else None), playlist
+
+
+async def _reply_and_load_playlist(ctx: commands.Context, player: Player,
+                                   playlist: Optional[resolver.PlaylistResolution], endpoints: List[Endpoint],
+                                   make_reply: Callable[[List[Endpoint]], str], *, at_front: bool = False):
+    """Send the reply for enqueued endpoints. If they are the first entries of a playlist, load the remaining entries
+    in the background and update the reply once the whole playlist is enqueued."""
+    if playlist is None or playlist.is_exhausted():
+        await ctx.send(make_reply(endpoints))
+        return
+    message = await ctx.send("\n".join([make_reply(endpoints),
+                                        t("commands.playlist_loading", locale=ctx.guild.preferred_locale)]))
+    state = _guilds.get(ctx.guild.id)
+    if state:
+        state.start_task(_load_playlist(player, playlist, endpoints, message, make_reply, ctx.guild.preferred_locale,
+                                        at_front=at_front))
+
+
+async def _load_playlist(player: Player, playlist: resolver.PlaylistResolution, endpoints: List[Endpoint],
+                         message: discord.Message, make_reply: Callable[[List[Endpoint]], str], locale: str, *,
+                         at_front: bool):
+    endpoints = list(endpoints)
+    try:
+        await playlist.enqueue_remaining(player.get_queue(), endpoints, at_front=at_front)
+    except asyncio.CancelledError:
+        # The queue was cleared or the bot left the channel
+        _logger.debug(f"Cancelled loading playlist after {len(endpoints)} entries")
+        await message.edit(content="\n".join([make_reply(endpoints),
+                                              t("commands.playlist_cancelled", locale=locale)]))
+        raise
+    except Exception as e:
+        if isinstance(e, resolver.ResolutionTimeoutError):
+            _logger.warning(f"Stopped loading playlist after {len(endpoints)} entries")
+        else:
+            _logger.exception(f"Unable to load playlist after {len(endpoints)} entries")
+        await message.edit(content="\n".join([make_reply(endpoints), t("commands.playlist_failed", locale=locale)]))
+        return
+    _logger.debug(f"Loaded playlist with {len(endpoints)} entries")
+    await message.edit(content=make_reply(endpoints))
 
-    async def exec():
-        global _leave_timer
-        if is_last:
-            if _leave_timer:
-                _leave_timer.reset_timeout()
-            else:
-                _leave_timer = Timer(120, leave_channel, ctx)  # 2 minutes until bot leaves the channel
-            try:
-                await ctx.channel.edit(topic=None)
-            except discord.Forbidden:
-                _logger.warning("Unable to clear channel topic (missing permission)")
 
-    asyncio.ensure_future(exec())
+async def _restore_queue(ctx: commands.Context, player: Player):
+    """Continue where the guild left off before the bot was restarted, if its queue was saved"""
+    restored = await _snapshots.restore(ctx.guild.id) if _snapshots else None
+    if restored is None:
+        return
+    endpoints, position = restored
+    song_queue = player.get_queue()
+    song_queue.enqueue(endpoints)
+    player.play()
+    if position is not None and position >= 1:
+        state = _guilds.get(ctx.guild.id)
+        if state:
+            state.start_task(_seek_restored(player, endpoints[0], position))
+    length = utils.to_human_readable_position(utils.get_total_length(endpoints), ctx.guild.preferred_locale)
+    await ctx.send(t("commands.queue_restored", locale=ctx.guild.preferred_locale, num=len(endpoints), total=length))
+
+
+async def _seek_restored(player: Player, endpoint: Endpoint, position: float):
+    if player.get_current() is endpoint:
+        try:
+            await player.seek(position)
+        except (SeekNotSupportedError, InvalidSeekPositionError):
+            _logger.debug("Unable to continue restored song at its saved position")
 
 
 @bot.event
 async def on_ready():
+    global _snapshot_task
     _logger.info(f"Logged on as {bot.user} :)")
+    # on_ready is called again after reconnecting, but one writer is enough
+    if _snapshots and _snapshot_task is None:
+        _snapshot_task = asyncio.ensure_future(_snapshots.run())
 
 
 @bot.command(help="Search YouTube for a song and play/enqueue it", aliases=["p"])
@@ -78,20 +181,19 @@ async def on_ready():
 @checks.is_in_voice_channel()
 @actions.log_command(_logger)
 async def play(ctx: commands.Context, *args):
-    reset_leave_timer()
+    received = time.perf_counter()
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
     if len(args) == 0:
         # Resume paused song if one is currently playing
-        if _player and _player.is_paused():
-            _player.play()
-            endpoint = _player.get_current()
+        if player and player.is_paused():
+            player.play()
+            endpoint = player.get_current()
             if endpoint:
-                cancel_leave_timer()
+                cancel_leave_timer(ctx)
                 await ctx.send(t("commands.resume", locale=ctx.guild.preferred_locale))
-                try:
-                    await ctx.channel.edit(topic=t("commands.channel_topic_playing", locale=ctx.guild.preferred_locale,
-                                                   desc=endpoint.get_song_description()))
-                except discord.Forbidden:
-                    _logger.warning("Unable to edit channel description to current song (missing permission)")
+                _topics.set_topic(ctx.channel, t("commands.channel_topic_playing", locale=ctx.guild.preferred_locale,
+                                                 desc=endpoint.get_song_description()))
     else:
         # Show in channel that the bot is typing (fetching the video(s) may take up to a few seconds)
         # Not using "with ctx.typing()" because the typing indicator sometimes lingered too long after the reply was
@@ -99,36 +201,48 @@ async def play(ctx: commands.Context, *args):
         await ctx.trigger_typing()
         reply = t("commands.play_no_results", locale=ctx.guild.preferred_locale)
         # Can't specify a converter directly for a variable number of arguments unfortunately
-        videos = converters.to_youtube_videos(args)
+        try:
+            with profiling.phase("resolve"):
+                endpoints, playlist = await _resolve_endpoints(args)
+        except resolver.ResolutionTimeoutError:
+            await ctx.send(t("commands.play_timeout", locale=ctx.guild.preferred_locale))
+            return
         if ctx.voice_client is None:
-            await join_channel(ctx)
-        if videos is not None:
-            cancel_leave_timer()
-            endpoints = [YouTubeEndpoint(video) for video in videos]
-            song_queue = _player.get_queue()
-            song_queue.enqueue(endpoints)
-            if not _player.get_current():
-                # No song is currently playing, so start playback and reply with appropriate message
-                _player.play()
-                length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
-                if len(endpoints) > 1:
-                    reply = t("commands.playnow_multiple", locale=ctx.guild.preferred_locale,
-                              desc=endpoints[0].get_song_description(), len=length, more=len(endpoints)-1)
-                else:
-                    reply = t("commands.play_single", locale=ctx.guild.preferred_locale,
-                              desc=endpoints[0].get_song_description(), len=length)
-            else:
-                # A song is already playing, reply with a different message in this case
+            with profiling.phase("join"):
+                await join_channel(ctx)
+        player = _get_player(ctx)
+        if endpoints is not None:
+            cancel_leave_timer(ctx)
+            song_queue = player.get_queue()
+            with profiling.phase("enqueue"):
+                song_queue.enqueue(endpoints)
+                started = not player.get_current()
                 position = song_queue.size() - len(endpoints) + 1
+                if started:
+                    # No song is currently playing, so start playback
+                    metrics.expect_first_audio(player, "play", received)
+                    player.play()
+
+            def make_reply(endpoints: List[Endpoint]) -> str:
+                if started:
+                    length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
+                    if len(endpoints) > 1:
+                        return t("commands.playnow_multiple", locale=ctx.guild.preferred_locale,
+                                 desc=endpoints[0].get_song_description(), len=length, more=len(endpoints)-1)
+                    return t("commands.play_single", locale=ctx.guild.preferred_locale,
+                             desc=endpoints[0].get_song_description(), len=length)
+                # A song is already playing, reply with a different message in this case
                 if len(endpoints) > 1:
                     length = utils.to_human_readable_position(
                         utils.get_total_length(endpoints), ctx.guild.preferred_locale)
-                    reply = t("commands.enqueued_multiple", locale=ctx.guild.preferred_locale,
-                              num=len(endpoints), total=length, pos=position)
-                else:
-                    length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
-                    reply = t("commands.enqueued_single", locale=ctx.guild.preferred_locale,
-                              desc=endpoints[0].get_song_description(), len=length, pos=position)
+                    return t("commands.enqueued_multiple", locale=ctx.guild.preferred_locale,
+                             num=len(endpoints), total=length, pos=position)
+                length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
+                return t("commands.enqueued_single", locale=ctx.guild.preferred_locale,
+                         desc=endpoints[0].get_song_description(), len=length, pos=position)
+
+            await _reply_and_load_playlist(ctx, player, playlist, endpoints, make_reply)
+            return
         # Send the reply (also clearing the typing status from the channel)
         await ctx.send(reply)
 
@@ -137,7 +251,8 @@ async def play(ctx: commands.Context, *args):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def playnow(ctx: commands.Context, *args):
-    reset_leave_timer()
+    received = time.perf_counter()
+    reset_leave_timer(ctx)
     if len(args) > 0:
         # Show in channel that the bot is typing (fetching the video(s) may take up to a few seconds)
         # Not using "with ctx.typing()" because the typing indicator sometimes lingered too long after the reply was
@@ -145,27 +260,39 @@ async def playnow(ctx: commands.Context, *args):
         await ctx.trigger_typing()
         reply = t("commands.play_no_results", locale=ctx.guild.preferred_locale)
         # Can't specify a converter directly for a variable number of arguments unfortunately
-        videos = converters.to_youtube_videos(args)
+        try:
+            with profiling.phase("resolve"):
+                endpoints, playlist = await _resolve_endpoints(args)
+        except resolver.ResolutionTimeoutError:
+            await ctx.send(t("commands.play_timeout", locale=ctx.guild.preferred_locale))
+            return
         if ctx.voice_client is None:
-            await join_channel(ctx)
-        if videos is not None:
-            cancel_leave_timer()
-            endpoints = [YouTubeEndpoint(video) for video in videos]
-            song_queue = _player.get_queue()
-            song_queue.enqueue(endpoints, pos=0)
-            if _player.get_current():
-                # A song is currently playing, so skip it
-                _player.skip()
-            else:
-                # No song is playing, so start playback now
-                _player.play()
-            length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
-            if len(endpoints) > 1:
-                reply = t("commands.playnow_multiple", locale=ctx.guild.preferred_locale,
-                          desc=endpoints[0].get_song_description(), len=length, more=len(endpoints)-1)
-            else:
-                reply = t("commands.play_single", locale=ctx.guild.preferred_locale,
-                          desc=endpoints[0].get_song_description(), len=length)
+            with profiling.phase("join"):
+                await join_channel(ctx)
+        player = _get_player(ctx)
+        if endpoints is not None:
+            cancel_leave_timer(ctx)
+            song_queue = player.get_queue()
+            with profiling.phase("enqueue"):
+                song_queue.enqueue(endpoints, pos=0)
+                metrics.expect_first_audio(player, "playnow", received)
+                if player.get_current():
+                    # A song is currently playing, so skip it
+                    player.skip()
+                else:
+                    # No song is playing, so start playback now
+                    player.play()
+
+            def make_reply(endpoints: List[Endpoint]) -> str:
+                length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
+                if len(endpoints) > 1:
+                    return t("commands.playnow_multiple", locale=ctx.guild.preferred_locale,
+                             desc=endpoints[0].get_song_description(), len=length, more=len(endpoints)-1)
+                return t("commands.play_single", locale=ctx.guild.preferred_locale,
+                         desc=endpoints[0].get_song_description(), len=length)
+
+            await _reply_and_load_playlist(ctx, player, playlist, endpoints, make_reply, at_front=True)
+            return
         # Send the reply (also clearing the typing status from the channel)
         await ctx.send(reply)
 
@@ -174,7 +301,8 @@ async def playnow(ctx: commands.Context, *args):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def playnext(ctx: commands.Context, *args):
-    reset_leave_timer()
+    received = time.perf_counter()
+    reset_leave_timer(ctx)
     if len(args) > 0:
         # Show in channel that the bot is typing (fetching the video(s) may take up to a few seconds)
         # Not using "with ctx.typing()" because the typing indicator sometimes lingered too long after the reply was
@@ -182,34 +310,46 @@ async def playnext(ctx: commands.Context, *args):
         await ctx.trigger_typing()
         reply = t("commands.play_no_results", locale=ctx.guild.preferred_locale)
         # Can't specify a converter directly for a variable number of arguments unfortunately
-        videos = converters.to_youtube_videos(args)
+        try:
+            with profiling.phase("resolve"):
+                endpoints, playlist = await _resolve_endpoints(args)
+        except resolver.ResolutionTimeoutError:
+            await ctx.send(t("commands.play_timeout", locale=ctx.guild.preferred_locale))
+            return
         if ctx.voice_client is None:
-            await join_channel(ctx)
-        if videos is not None:
-            cancel_leave_timer()
-            endpoints = [YouTubeEndpoint(video) for video in videos]
-            song_queue = _player.get_queue()
-            song_queue.enqueue(endpoints, pos=0)
-            if not _player.get_current():
-                # No song is playing, so start playback now
-                _player.play()
-                length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
-                if len(endpoints) > 1:
-                    reply = t("commands.play_multiple", locale=ctx.guild.preferred_locale,
-                              desc=endpoints[0].get_song_description(), len=length, more=len(endpoints)-1)
-                else:
-                    reply = t("commands.play_single", locale=ctx.guild.preferred_locale,
-                              desc=endpoints[0].get_song_description(), len=length)
-            else:
+            with profiling.phase("join"):
+                await join_channel(ctx)
+        player = _get_player(ctx)
+        if endpoints is not None:
+            cancel_leave_timer(ctx)
+            song_queue = player.get_queue()
+            with profiling.phase("enqueue"):
+                song_queue.enqueue(endpoints, pos=0)
+                started = not player.get_current()
+                if started:
+                    # No song is playing, so start playback now
+                    metrics.expect_first_audio(player, "playnext", received)
+                    player.play()
+
+            def make_reply(endpoints: List[Endpoint]) -> str:
+                if started:
+                    length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
+                    if len(endpoints) > 1:
+                        return t("commands.play_multiple", locale=ctx.guild.preferred_locale,
+                                 desc=endpoints[0].get_song_description(), len=length, more=len(endpoints)-1)
+                    return t("commands.play_single", locale=ctx.guild.preferred_locale,
+                             desc=endpoints[0].get_song_description(), len=length)
                 if len(endpoints) > 1:
                     length = utils.to_human_readable_position(
                         utils.get_total_length(endpoints), ctx.guild.preferred_locale)
-                    reply = t("commands.enqueued_multiple", locale=ctx.guild.preferred_locale,
-                              num=len(endpoints), total=length, pos=1)
-                else:
-                    length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
-                    reply = t("commands.enqueued_single", locale=ctx.guild.preferred_locale,
-                              desc=endpoints[0].get_song_description(), len=length, pos=1)
+                    return t("commands.enqueued_multiple", locale=ctx.guild.preferred_locale,
+                             num=len(endpoints), total=length, pos=1)
+                length = utils.to_human_readable_position(endpoints[0].get_length(), ctx.guild.preferred_locale)
+                return t("commands.enqueued_single", locale=ctx.guild.preferred_locale,
+                         desc=endpoints[0].get_song_description(), len=length, pos=1)
+
+            await _reply_and_load_playlist(ctx, player, playlist, endpoints, make_reply, at_front=True)
+            return
         # Send the reply (also clearing the typing status from the channel)
         await ctx.send(reply)
 
@@ -218,20 +358,22 @@ async def playnext(ctx: commands.Context, *args):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def say(ctx: commands.Context, *args: str):
-    reset_leave_timer()
+    reset_leave_timer(ctx)
     if len(args) > 0:
         await ctx.trigger_typing()
         reply = t("commands.say_no_results", locale=ctx.guild.preferred_locale)
         if ctx.voice_client is None:
-            await join_channel(ctx)
-        cancel_leave_timer()
+            with profiling.phase("join"):
+                await join_channel(ctx)
+        player = _get_player(ctx)
+        cancel_leave_timer(ctx)
         text = " ".join(args)
         text_abbrev = f"{text[:50]}…" if len(text) > 52 else text
         endpoint = TextToSpeechEndpoint(text)
-        song_queue = _player.get_queue()
+        song_queue = player.get_queue()
         song_queue.enqueue(endpoint)
-        if not _player.get_current():
-            _player.play()
+        if not player.get_current():
+            player.play()
             reply = t("commands.say_now", locale=ctx.guild.preferred_locale, text=text_abbrev)
         else:
             reply = t("commands.say_enqueued", locale=ctx.guild.preferred_locale,
@@ -243,44 +385,45 @@ async def say(ctx: commands.Context, *args: str):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def pause(ctx):
-    reset_leave_timer()
-    if _player and _player.is_playing():
-        _player.pause()
-        endpoint = _player.get_current()
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
+    if player and player.is_playing():
+        player.pause()
+        endpoint = player.get_current()
         if endpoint:
             await ctx.send(t("commands.pause", locale=ctx.guild.preferred_locale))
-            try:
-                await ctx.channel.edit(topic=t("commands.channel_topic_paused", locale=ctx.guild.preferred_locale,
-                                               desc=endpoint.get_song_description()))
-            except discord.Forbidden:
-                _logger.warning("Unable to edit channel description to current song (missing permission)")
+            _topics.set_topic(ctx.channel, t("commands.channel_topic_paused", locale=ctx.guild.preferred_locale,
+                                             desc=endpoint.get_song_description()))
 
 
 @bot.command(help="Enqueue a mix of songs similar to the current one (YouTube only).", aliases=["r"])
 @commands.guild_only()
 @actions.log_command(_logger)
 async def radio(ctx: commands.Context):
-    reset_leave_timer()
-    if _player:
-        current_endpoint = _player.get_current()
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
+    if player:
+        current_endpoint = player.get_current()
         if current_endpoint:
             if isinstance(current_endpoint, YouTubeEndpoint):
                 try:
                     current_id = current_endpoint.get_youtube_id()
                     mix_url = f"https://www.youtube.com/watch?v={current_id}&list=RD{current_id}"
                     # If the current song itself is part of the radio, filter it out
-                    radio_endpoints = [YouTubeEndpoint(video) for video in converters.to_youtube_videos([mix_url])
-                                       if video.videoid != current_id]
-                    _player.get_queue().enqueue(radio_endpoints)
-                    length = utils.to_human_readable_position(
-                        utils.get_total_length(radio_endpoints), ctx.guild.preferred_locale)
-                    await ctx.send(t("commands.radio", locale=ctx.guild.preferred_locale,
-                                     num=len(radio_endpoints), total=length))
-                except urllib.error.HTTPError as error:
-                    if error.code == 400:
-                        await ctx.send(t("commands.radio_not_found", locale=ctx.guild.preferred_locale))
-                    else:
-                        raise error
+                    playlist = resolver.open_youtube_playlist([mix_url], exclude_id=current_id)
+                    radio_endpoints = await playlist.next_batch()
+                    player.get_queue().enqueue(radio_endpoints)
+
+                    def make_reply(endpoints: List[Endpoint]) -> str:
+                        length = utils.to_human_readable_position(
+                            utils.get_total_length(endpoints), ctx.guild.preferred_locale)
+                        return t("commands.radio", locale=ctx.guild.preferred_locale, num=len(endpoints), total=length)
+
+                    await _reply_and_load_playlist(ctx, player, playlist, radio_endpoints, make_reply)
+                except resolver.ResolutionTimeoutError:
+                    await ctx.send(t("commands.play_timeout", locale=ctx.guild.preferred_locale))
+                except converters.PlaylistNotFoundError:
+                    await ctx.send(t("commands.radio_not_found", locale=ctx.guild.preferred_locale))
             else:
                 await ctx.send(t("commands.radio_not_supported", locale=ctx.guild.preferred_locale))
 
@@ -289,32 +432,36 @@ async def radio(ctx: commands.Context):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def seek(ctx, position: converters.to_position):
-    reset_leave_timer()
-    # Seeking is not yet supported in the player/endpoints, so cancel early
-    await ctx.send(t("commands.seek_not_supported", locale=ctx.guild.preferred_locale))
-    return
-
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
     if not position:
-        await ctx.send(f"Invalid position, use syntax 2:01 or 1:05:42 or similar.")
+        await ctx.send(t("commands.seek_invalid", locale=ctx.guild.preferred_locale))
         return
-    if _player:
-        await ctx.send("Seeking…")
+    if player and player.get_current():
         (h, m, s) = position
         try:
-            _player.seek(h * 3600 + m * 60 + s)
-        except Exception:  # TODO: replace with specific exception
-            await ctx.send("Position is out of bounds!")
+            actual_position = await player.seek(h * 3600 + m * 60 + s)
+        except SeekNotSupportedError:
+            await ctx.send(t("commands.seek_not_supported", locale=ctx.guild.preferred_locale))
+        except InvalidSeekPositionError:
+            await ctx.send(t("commands.seek_out_of_bounds", locale=ctx.guild.preferred_locale))
+        else:
+            await ctx.send(t("commands.seek", locale=ctx.guild.preferred_locale,
+                             pos=utils.to_human_readable_position(actual_position, ctx.guild.preferred_locale)))
+    else:
+        await ctx.send(t("commands.current_no_song", locale=ctx.guild.preferred_locale))
 
 
 @bot.command(help="Display information on the currently playing song", aliases=["c"])
 @commands.guild_only()
 @actions.log_command(_logger)
 async def current(ctx: commands.Context):
-    reset_leave_timer()
-    if _player:
-        song = _player.get_current()
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
+    if player:
+        song = player.get_current()
         if song:
-            playtime = utils.to_human_readable_position(_player.get_playtime(), ctx.guild.preferred_locale)
+            playtime = utils.to_human_readable_position(player.get_playtime(), ctx.guild.preferred_locale)
             length = utils.to_human_readable_position(song.get_length(), ctx.guild.preferred_locale)
             await ctx.send(t("commands.current", locale=ctx.guild.preferred_locale,
                              desc=song.get_song_description(), pos=playtime, len=length))
@@ -326,17 +473,19 @@ async def current(ctx: commands.Context):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def queue(ctx):
-    reset_leave_timer()
-    if not _player or not _player.get_current():
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
+    if not player or not player.get_current():
         # Queue empty and nothing playing
         await ctx.send(t("commands.queue_empty", locale=ctx.guild.preferred_locale, cmd_prefix="!"))
         return
-    current = _player.get_current()
+    current = player.get_current()
     current_length = utils.to_human_readable_position(current.get_length(), ctx.guild.preferred_locale)
     current_string = t("commands.queue_helper_entry", locale=ctx.guild.preferred_locale,
                        pos=utils.to_keycap_emojis(0), desc=current.get_song_description(), len=current_length)
-    songs = _player.get_queue().list()
-    if len(songs) == 0:
+    song_queue = player.get_queue()
+    num_songs = song_queue.size()
+    if num_songs == 0:
         # Queue empty but something's playing
         await ctx.send(t("commands.queue_single", locale=ctx.guild.preferred_locale,
                          len=current_length, current=current_string))
@@ -344,27 +493,30 @@ async def queue(ctx):
 
     # Queue not empty and something's playing
     total_length = utils.to_human_readable_position(
-        utils.get_total_length([current, *songs]), ctx.guild.preferred_locale)
+        utils.get_total_length([current]) + song_queue.get_total_length(), ctx.guild.preferred_locale)
     next_string = "\n".join(
         [t("commands.queue_helper_entry", locale=ctx.guild.preferred_locale, pos=utils.to_keycap_emojis(idx+1),
            desc=song.get_song_description(),
            len=utils.to_human_readable_position(song.get_length(), ctx.guild.preferred_locale))
-         for idx, song in enumerate(songs[:9])])
-    if len(songs) <= 9:
-        await ctx.send(t("commands.queue_multiple", locale=ctx.guild.preferred_locale, num=1+len(songs),
+         for idx, song in enumerate(song_queue.list(stop=9))])
+    if num_songs <= 9:
+        await ctx.send(t("commands.queue_multiple", locale=ctx.guild.preferred_locale, num=1+num_songs,
                          total=total_length, current=current_string, next=next_string))
     else:
-        await ctx.send(t("commands.queue_many", locale=ctx.guild.preferred_locale, num=1+len(songs),
-                         total=total_length, current=current_string, next=next_string, remaining=len(songs)-9))
+        await ctx.send(t("commands.queue_many", locale=ctx.guild.preferred_locale, num=1+num_songs,
+                         total=total_length, current=current_string, next=next_string, remaining=num_songs-9))
 
 
 @bot.command(help="Clear the song queue of its current contents.", aliases=["cl"])
 @commands.guild_only()
 @actions.log_command(_logger)
 async def clear(ctx):
-    reset_leave_timer()
-    if _player:
-        queue = _player.get_queue()
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
+    if player:
+        # Stop loading playlists into the queue, too
+        _guilds.get(ctx.guild.id).cancel_tasks()
+        queue = player.get_queue()
         num_songs = queue.size()
         total_length = utils.to_human_readable_position(queue.get_total_length(), ctx.guild.preferred_locale)
         queue.clear()
@@ -375,12 +527,13 @@ async def clear(ctx):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def skip(ctx, number_of_songs: Optional[int]):
-    reset_leave_timer()
-    if _player:
-        current = _player.get_current()
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
+    if player:
+        current = player.get_current()
         if current:
-            _player.skip()
-        queue = _player.get_queue()
+            player.skip()
+        queue = player.get_queue()
         if number_of_songs is not None and number_of_songs > 1:
             # Remove the first (number_of_songs - 1) songs from the queue
             for i in range(number_of_songs - 1):
@@ -396,9 +549,10 @@ async def skip(ctx, number_of_songs: Optional[int]):
 @checks.bot_is_in_voice_channel()
 @actions.log_command(_logger)
 async def shuffle(ctx: commands.Context):
-    reset_leave_timer()
-    if _player:
-        _player.get_queue().shuffle()
+    reset_leave_timer(ctx)
+    player = _get_player(ctx)
+    if player:
+        player.get_queue().shuffle()
         await ctx.send(t("commands.shuffle", locale=ctx.guild.preferred_locale))
 
 
@@ -406,7 +560,7 @@ async def shuffle(ctx: commands.Context):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def purge(ctx: commands.Context):
-    reset_leave_timer()
+    reset_leave_timer(ctx)
     try:
         deleted = await ctx.channel.purge(
             check=lambda m: m.content.startswith(bot.command_prefix) or m.author == bot.user)
@@ -421,7 +575,7 @@ async def purge(ctx: commands.Context):
 @checks.bot_is_in_voice_channel()
 @actions.log_command(_logger)
 async def follow(ctx: commands.Context):
-    reset_leave_timer()
+    reset_leave_timer(ctx)
     await join_channel(ctx, send_info=True)
 
 
@@ -429,7 +583,7 @@ async def follow(ctx: commands.Context):
 @commands.guild_only()
 @actions.log_command(_logger)
 async def leave(ctx):
-    cancel_leave_timer()
+    cancel_leave_timer(ctx)
     await leave_channel(ctx, send_info=True)
 
 
@@ -437,16 +591,19 @@ async def leave(ctx):
 @commands.is_owner()
 @actions.log_command(_logger)
 async def shutdown(ctx):
-    cancel_leave_timer()
+    cancel_leave_timer(ctx)
     await ctx.send(t("commands.shutdown", locale=ctx.guild.preferred_locale))
-    await leave_channel(ctx)
+    # Keep the queue, so it can be restored after the bot is started again
+    if _snapshots:
+        await _snapshots.save_changes()
+    await leave_channel(ctx, discard_snapshot=False)
     await bot.close()
 
 
 @bot.command(help="Get youtube stream link (debugging only)")
 @commands.guild_only()
 async def streamlink(ctx: commands.Context):
-    await ctx.send(f"Current song link: {_player.get_current()._stream.url_https}")
+    await ctx.send(f"Current song link: {_get_player(ctx).get_current()._stream.url_https}")
 
 
 @bot.event
@@ -459,16 +616,17 @@ async def on_command_error(ctx, error: BaseException):
 
 
 async def join_channel(ctx, *, send_info=False):
-    global _player
     voice_channel = ctx.author.voice.channel
     reply = ""
     if ctx.voice_client is None:
         _logger.debug(f"Joining channel {voice_channel.name}")
         voice_client = await voice_channel.connect()
-        _player = Player(voice_client)
-        signal("player_song_start").connect(functools.partial(_on_song_start, ctx), sender=_player, weak=False)
-        signal("player_song_stop").connect(functools.partial(_on_song_stop, ctx), sender=_player, weak=False)
+        state = _guilds.create(ctx.guild.id, voice_client)
+        player = state.get_player()
+        state.connect_player_signal("player_song_start", functools.partial(_on_song_start, ctx))
+        state.connect_player_signal("player_song_stop", functools.partial(_on_song_stop, ctx))
         reply = t("commands.channel_join", locale=ctx.guild.preferred_locale, name=voice_channel.name)
+        await _restore_queue(ctx, player)
     elif voice_channel != ctx.voice_client.channel:
         _logger.debug(f"Moving to channel {voice_channel.name}")
         await ctx.voice_client.move_to(voice_channel)
@@ -479,17 +637,14 @@ async def join_channel(ctx, *, send_info=False):
         await ctx.send(reply)
 
 
-async def leave_channel(ctx, *, send_info=False):
-    global _player
+async def leave_channel(ctx, *, send_info=False, discard_snapshot=True):
     if ctx.voice_client and ctx.voice_client.is_connected():
         voice_channel = ctx.voice_client.channel.name
         _logger.debug(f"Leaving channel {voice_channel}")
-        _player.stop()
-        _player = None
+        _guilds.remove(ctx.guild.id)
+        if _snapshots and discard_snapshot:
+            await _snapshots.discard(ctx.guild.id)
         await ctx.voice_client.disconnect()
-        try:
-            await ctx.channel.edit(topic=None)
-        except discord.Forbidden:
-            _logger.warning("Unable to clear channel topic (missing permission)")
+        _topics.set_topic(ctx.channel, None)
         if send_info:
             await ctx.send(t("commands.channel_leave", locale=ctx.guild.preferred_locale, name=voice_channel))
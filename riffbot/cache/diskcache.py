@@ -0,0 +1,177 @@
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Generator, Optional
+
+_logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 262144  # 256 KB
+_TEMP_SUFFIX = ".tmp"
+
+
+class DiskCache:
+    """Persistent cache of files in a directory with a byte budget and least recently used eviction.
+
+    Entries are written to a temporary file first and atomically moved into place on commit, so a crash or an aborted
+    download never leaves a partial entry behind. Existing entries are picked up again when the cache is created, in
+    the order in which they were last used."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[str, int]" = collections.OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Get the path of the file stored for key, or None if there is none. Counts as a use of the entry."""
+        name = _file_name(key)
+        with self._lock:
+            if name not in self._entries:
+                self._misses += 1
+                _logger.debug(f"Miss for \"{key}\" in {self._directory}")
+                return None
+            self._hits += 1
+            self._entries.move_to_end(name)
+        path = os.path.join(self._directory, name)
+        try:
+            # Persist the recency of the entry, so it survives restarts
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._remove_entry(name)
+            return None
+        _logger.debug(f"Hit for \"{key}\" in {self._directory}")
+        return path
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return _file_name(key) in self._entries
+
+    def open_writer(self, key: str) -> "CacheWriter":
+        return CacheWriter(self, key)
+
+    def get_hits(self) -> int:
+        return self._hits
+
+    def get_misses(self) -> int:
+        return self._misses
+
+    def get_evictions(self) -> int:
+        return self._evictions
+
+    def get_hit_ratio(self) -> float:
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups > 0 else 0.0
+
+    def get_size(self) -> int:
+        return self._size
+
+    def get_max_size(self) -> int:
+        return self._max_bytes
+
+    def get_directory(self) -> str:
+        return self._directory
+
+    def __str__(self) -> str:
+        return (f"{self._hits} hits, {self._misses} misses (hit ratio {self.get_hit_ratio():.2f}), "
+                f"{self._evictions} evicted, {len(self._entries)} entries "
+                f"({self._size / 2**20:.1f} of {self._max_bytes / 2**20:.0f} MiB)")
+
+    def _commit(self, key: str, temp_path: str, size: int):
+        name = _file_name(key)
+        if size > self._max_bytes:
+            _logger.debug(f"Not caching \"{key}\" ({size} bytes exceed the budget of {self._max_bytes} bytes)")
+            os.remove(temp_path)
+            return
+        os.replace(temp_path, os.path.join(self._directory, name))
+        with self._lock:
+            self._remove_entry(name)
+            self._entries[name] = size
+            self._size += size
+            while self._size > self._max_bytes:
+                evicted, _ = next(iter(self._entries.items()))
+                self._remove_entry(evicted)
+                self._evictions += 1
+                try:
+                    # Readers that still have the file open can continue to read it
+                    os.remove(os.path.join(self._directory, evicted))
+                except FileNotFoundError:
+                    pass
+                _logger.debug(f"Evicted {evicted} from {self._directory}")
+        _logger.debug(f"Stored \"{key}\" ({size} bytes) in {self._directory}")
+
+    def _remove_entry(self, name: str):
+        size = self._entries.pop(name, None)
+        if size is not None:
+            self._size -= size
+
+    def _load(self):
+        files = []
+        for entry in os.scandir(self._directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(_TEMP_SUFFIX):
+                # Left over from an interrupted write
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        _logger.debug(f"Loaded {len(self._entries)} entries ({self._size} bytes) from {self._directory}")
+
+
+class CacheWriter:
+    """Writes a new cache entry to a temporary file. The entry only becomes visible after commit()."""
+
+    def __init__(self, cache: DiskCache, key: str):
+        self._cache = cache
+        self._key = key
+        fd, self._temp_path = tempfile.mkstemp(suffix=_TEMP_SUFFIX, dir=cache.get_directory())
+        self._file: Optional[BinaryIO] = os.fdopen(fd, "wb")
+        self._size = 0
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._size += len(data)
+
+    def get_size(self) -> int:
+        return self._size
+
+    def commit(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._cache._commit(self._key, self._temp_path, self._size)
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._temp_path)
+
+
+def read_chunks(path: str, chunk_size: int = READ_CHUNK_SIZE, *, start: int = 0) -> Generator[bytes, None, None]:
+    with open(path, "rb") as file:
+        file.seek(start)
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _file_name(key: str) -> str:
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
@@ -0,0 +1,120 @@
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+_logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """In-memory cache with a maximum number of entries and a time to live per entry. Expired entries are dropped when
+    they are accessed, least recently used entries are evicted when the cache is full.
+
+    Each entry remembers how long it took to produce its value, so the cache can tell how much time its hits saved."""
+
+    def __init__(self, name: str, max_entries: int, ttl: float, *, clock: Callable[[], float] = time.monotonic):
+        self._name = name
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Maps keys to (value, expiry time, cost in seconds)
+        self._entries: "collections.OrderedDict[K, Tuple[V, float, float]]" = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+        self._time_saved = 0.0
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, expiry, cost = entry
+            if expiry <= self._clock():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            self._time_saved += cost
+        _logger.debug(f"Hit for {key!r} in {self._name} cache (saved {cost * 1000:.0f} ms)")
+        return value
+
+    def put(self, key: K, value: V, *, ttl: Optional[float] = None, cost: float = 0.0):
+        """Store value for key. ttl overrides the default time to live, cost is the time (in seconds) it took to
+        produce the value."""
+        expiry = self._clock() + (self._ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expiry, cost)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def replace(self, key: K, value: V) -> bool:
+        """Replace the value of an existing entry, keeping its expiry time and cost. Returns False if there is no such
+        entry. Does not count as a use of the entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self._clock():
+                return False
+            self._entries[key] = (value, entry[1], entry[2])
+            return True
+
+    def get_or_load(self, key: K, loader: Callable[[], Optional[V]]) -> Optional[V]:
+        """Get the value for key, calling loader to produce it on a miss. None is returned but not cached."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        start = time.perf_counter()
+        value = loader()
+        if value is not None:
+            self.put(key, value, cost=time.perf_counter() - start)
+        return value
+
+    def remove(self, key: K):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    def get_name(self) -> str:
+        return self._name
+
+    def get_hits(self) -> int:
+        return self._hits
+
+    def get_misses(self) -> int:
+        return self._misses
+
+    def get_expirations(self) -> int:
+        return self._expirations
+
+    def get_evictions(self) -> int:
+        return self._evictions
+
+    def get_hit_ratio(self) -> float:
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups > 0 else 0.0
+
+    def get_time_saved(self) -> float:
+        """Get the total time in seconds that would have been spent producing the values of all hits"""
+        return self._time_saved
+
+    def __str__(self) -> str:
+        return (f"{self._hits} hits, {self._misses} misses (hit ratio {self.get_hit_ratio():.2f}, "
+                f"{self._time_saved:.1f}s saved), {self._expirations} expired, {self._evictions} evicted, "
+                f"{len(self._entries)} entries")
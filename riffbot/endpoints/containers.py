@@ -0,0 +1,198 @@
+import bisect
+import struct
+from typing import Generator, List, Optional, Tuple
+
+# IDs of the Matroska/WebM elements needed to find the cues
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_CUES = 0x1C53BB6B
+_CUE_POINT = 0xBB
+_CUE_TIME = 0xB3
+_CUE_TRACK_POSITIONS = 0xB7
+_CUE_CLUSTER_POSITION = 0xF1
+_CLUSTER = 0x1F43B675
+_DEFAULT_TIMECODE_SCALE = 1000000  # nanoseconds
+
+
+class IncompleteIndexError(Exception):
+    """The data ends before the index is complete, required_size bytes from the start of the file are needed"""
+
+    def __init__(self, required_size: int):
+        super().__init__(f"At least {required_size} bytes are required to read the index")
+        self.required_size = required_size
+
+
+class SeekIndex:
+    """Maps time positions to the byte offsets of independently decodable segments of a media file. A decoder can start
+    at any segment if it is fed the header (the initialization data of the file) first."""
+
+    def __init__(self, header: bytes, segments: List[Tuple[float, int]]):
+        self._header = header
+        self._times = [time for time, _ in segments]
+        self._offsets = [offset for _, offset in segments]
+
+    def get_header(self) -> bytes:
+        return self._header
+
+    def lookup(self, position: float) -> Tuple[float, int]:
+        """Find the segment containing position (in seconds). Returns its start time and byte offset."""
+        idx = max(bisect.bisect_right(self._times, position) - 1, 0)
+        return self._times[idx], self._offsets[idx]
+
+
+def parse_mp4_index(data: bytes) -> Optional[SeekIndex]:
+    """Read the segment index (sidx box) of a fragmented MP4 file, given the first bytes of the file. Returns None if
+    the file has no usable index."""
+    pos = 0
+    has_moov = False
+    while True:
+        if pos + 8 > len(data):
+            raise IncompleteIndexError(pos + 16)
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if size == 1:
+            if pos + 16 > len(data):
+                raise IncompleteIndexError(pos + 16)
+            size, = struct.unpack_from(">Q", data, pos + 8)
+            header_size = 16
+        elif size == 0:
+            # Box extends to the end of the file
+            return None
+        if size < header_size:
+            return None
+        if box_type == b"sidx":
+            if not has_moov:
+                return None
+            if pos + size > len(data):
+                raise IncompleteIndexError(pos + size)
+            return _parse_sidx(data, pos, header_size, size)
+        if box_type in (b"moof", b"mdat"):
+            # Media data starts without an index in front of it
+            return None
+        if box_type == b"moov":
+            has_moov = True
+        pos += size
+
+
+def _parse_sidx(data: bytes, pos: int, header_size: int, size: int) -> Optional[SeekIndex]:
+    body = pos + header_size
+    version = data[body]
+    timescale, = struct.unpack_from(">I", data, body + 8)
+    if version == 0:
+        earliest_time, first_offset = struct.unpack_from(">II", data, body + 12)
+        body += 20
+    else:
+        earliest_time, first_offset = struct.unpack_from(">QQ", data, body + 12)
+        body += 28
+    reference_count, = struct.unpack_from(">H", data, body + 2)
+    body += 4
+    if timescale == 0 or reference_count == 0:
+        return None
+
+    segments = []
+    time = earliest_time
+    offset = pos + size + first_offset
+    for i in range(reference_count):
+        reference, duration = struct.unpack_from(">II", data, body + 12 * i)
+        if reference & 0x80000000:
+            # Hierarchical indexes (references to other sidx boxes) are not supported
+            return None
+        segments.append((time / timescale, offset))
+        time += duration
+        offset += reference & 0x7FFFFFFF
+    return SeekIndex(data[:pos], segments)
+
+
+def parse_webm_index(data: bytes) -> Optional[SeekIndex]:
+    """Read the cues of a WebM file, given the first bytes of the file. Returns None if the file has no usable cues in
+    front of its first cluster."""
+    element_id, size, pos = _read_element_header(data, 0)
+    if element_id != _EBML or size is None:
+        return None
+    element_id, _, pos = _read_element_header(data, pos + size)
+    if element_id != _SEGMENT:
+        return None
+    # Positions in the cues are relative to the start of the segment's data
+    segment_start = pos
+    timecode_scale = _DEFAULT_TIMECODE_SCALE
+    cues: Optional[List[Tuple[int, int]]] = None
+    while True:
+        element_start = pos
+        element_id, size, pos = _read_element_header(data, pos)
+        if element_id == _CLUSTER:
+            if not cues:
+                return None
+            segments = [(time * timecode_scale / 1e9, segment_start + offset) for time, offset in sorted(cues)]
+            return SeekIndex(data[:element_start], segments)
+        if size is None:
+            return None
+        if element_id in (_INFO, _CUES) and pos + size > len(data):
+            raise IncompleteIndexError(pos + size)
+        if element_id == _INFO:
+            for child_id, start, end in _iter_elements(data, pos, pos + size):
+                if child_id == _TIMECODE_SCALE:
+                    timecode_scale = _read_uint(data, start, end)
+        elif element_id == _CUES:
+            cues = _parse_cues(data, pos, pos + size)
+        pos += size
+
+
+def _parse_cues(data: bytes, start: int, end: int) -> List[Tuple[int, int]]:
+    cues = []
+    for element_id, point_start, point_end in _iter_elements(data, start, end):
+        if element_id != _CUE_POINT:
+            continue
+        time = None
+        offset = None
+        for child_id, child_start, child_end in _iter_elements(data, point_start, point_end):
+            if child_id == _CUE_TIME:
+                time = _read_uint(data, child_start, child_end)
+            elif child_id == _CUE_TRACK_POSITIONS and offset is None:
+                for position_id, position_start, position_end in _iter_elements(data, child_start, child_end):
+                    if position_id == _CUE_CLUSTER_POSITION:
+                        offset = _read_uint(data, position_start, position_end)
+        if time is not None and offset is not None:
+            cues.append((time, offset))
+    return cues
+
+
+def _iter_elements(data: bytes, start: int, end: int) -> Generator[Tuple[int, int, int], None, None]:
+    """Yield the ID, start and end of the data of each element between start and end"""
+    pos = start
+    while pos < end:
+        element_id, size, pos = _read_element_header(data, pos)
+        if size is None:
+            return
+        yield element_id, pos, min(pos + size, end)
+        pos += size
+
+
+def _read_element_header(data: bytes, pos: int) -> Tuple[int, Optional[int], int]:
+    """Read the ID and data size (None if unknown) of an EBML element. Returns them and the position of the data."""
+    element_id, length = _read_vint(data, pos, max_length=4)
+    element_id |= 1 << (7 * length)  # IDs keep their length marker
+    size, size_length = _read_vint(data, pos + length, max_length=8)
+    if size == (1 << (7 * size_length)) - 1:
+        size = None
+    return element_id, size, pos + length + size_length
+
+
+def _read_vint(data: bytes, pos: int, *, max_length: int) -> Tuple[int, int]:
+    if pos >= len(data):
+        raise IncompleteIndexError(pos + max_length)
+    first = data[pos]
+    length = 9 - first.bit_length()
+    if length > max_length:
+        raise ValueError(f"Invalid EBML variable size integer at byte {pos}")
+    if pos + length > len(data):
+        raise IncompleteIndexError(pos + length)
+    value = first & ((1 << (8 - length)) - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+
+def _read_uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], "big")
@@ -6,6 +6,14 @@ class InvalidEndpointError(Exception):
     pass
 
 
+class SeekNotSupportedError(Exception):
+    pass
+
+
+class InvalidSeekPositionError(Exception):
+    pass
+
+
 class Endpoint(ABC):
     @abstractmethod
     def initialize(self):
@@ -19,6 +27,11 @@ class Endpoint(ABC):
     def stream_chunks(self) -> Generator[bytes, None, None]:
         pass
 
+    def seek(self, position: float) -> float:
+        """Make the next stream start at (or shortly before) the given position in seconds. Returns the position at
+        which the stream will actually start."""
+        raise SeekNotSupportedError()
+
     @abstractmethod
     def get_song_description(self) -> str:
         pass
@@ -27,6 +40,15 @@ class Endpoint(ABC):
     def get_bit_rate(self) -> Optional[int]:
         pass
 
+    def get_cache_key(self) -> Optional[str]:
+        """Get a key that identifies the audio of the endpoint across instances and restarts, or None if the audio
+        must not be cached"""
+        return None
+
+    def get_codec(self) -> Optional[str]:
+        """Get the name of the audio codec of the stream (as used by ffmpeg), if it is known"""
+        return None
+
     @abstractmethod
     def get_length(self) -> Optional[int]:
         """Get the length of the song in seconds"""
@@ -0,0 +1,105 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import requests
+    from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+MAX_HOSTS = 16  # Number of hosts for which connections are kept alive
+MAX_CONNECTIONS_PER_HOST = 16
+REQUEST_TIMEOUT = 10.0  # seconds, used for requests that don't set their own timeout
+
+
+class PoolStats:
+    """Counts requests and newly opened connections of the shared HTTP pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self._requests += 1
+
+    def record_connection(self):
+        with self._lock:
+            self._connections += 1
+
+    def get_requests(self) -> int:
+        return self._requests
+
+    def get_connections(self) -> int:
+        return self._connections
+
+    def get_handshakes_avoided(self) -> int:
+        """Number of requests that reused a kept-alive connection instead of opening a new one (TCP + TLS handshake)"""
+        return max(self._requests - self._connections, 0)
+
+    def get_reuse_ratio(self) -> float:
+        return self.get_handshakes_avoided() / self._requests if self._requests > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self._requests} requests over {self._connections} connections "
+                f"({self.get_handshakes_avoided()} handshakes avoided, reuse ratio {self.get_reuse_ratio():.2f})")
+
+
+_stats = PoolStats()
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+
+
+def _new_adapter() -> "HTTPAdapter":
+    # requests is only imported once the first request is made
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class _CountingHTTPConnectionPool(HTTPConnectionPool):
+        def _new_conn(self):
+            _stats.record_connection()
+            return super()._new_conn()
+
+    class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        def _new_conn(self):
+            _stats.record_connection()
+            return super()._new_conn()
+
+    class _PoolAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _CountingHTTPConnectionPool,
+                "https": _CountingHTTPSConnectionPool
+            }
+
+        def send(self, request, timeout=None, **kwargs):
+            _stats.record_request()
+            # A hung connection must not hold one of the pool's slots forever, as other requests wait for it
+            return super().send(request, timeout=timeout if timeout is not None else REQUEST_TIMEOUT, **kwargs)
+
+    return _PoolAdapter(pool_connections=MAX_HOSTS, pool_maxsize=MAX_CONNECTIONS_PER_HOST, pool_block=True)
+
+
+def get_session() -> "requests.Session":
+    """Get the process-wide HTTP session. Connections are kept alive and reused across streams, endpoints and guilds.
+    Requests block while all MAX_CONNECTIONS_PER_HOST connections to a host are in use, so every request times out
+    after REQUEST_TIMEOUT seconds unless it sets a timeout itself."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _logger.debug(f"Creating shared HTTP session ({MAX_CONNECTIONS_PER_HOST} connections per host)")
+            import requests
+
+            session = requests.Session()
+            adapter = _new_adapter()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def get_stats() -> PoolStats:
+    return _stats
@@ -0,0 +1,238 @@
+import logging
+import re
+import threading
+import time
+from typing import Callable, Generator, Optional, Tuple
+
+import requests
+
+from riffbot.utils.concurrency import imap_ordered
+
+_logger = logging.getLogger(__name__)
+
+MIN_CHUNK_SIZE = 65536  # 64 KB, small first requests keep the time to first audio low
+MAX_CHUNK_SIZE = 4194304  # 4 MB
+TARGET_REQUEST_TIME = 1.0  # Chunk sizes are adapted so that a single request takes about this many seconds
+DEFAULT_WINDOW = 4
+EXPIRED_STATUS_CODES = (403, 410)
+REQUEST_TIMEOUT = 10.0  # seconds
+MAX_RETRIES = 5
+RETRY_DELAY = 0.5  # seconds, doubled after every failed attempt
+MAX_RETRY_DELAY = 8.0  # seconds
+
+_content_range_regex = re.compile("^bytes (?P<start>\\d+)-(?P<end>\\d+)/(\\d+|\\*)$")
+
+
+class StreamExpiredError(Exception):
+    """The server refused a range request because the URL is no longer valid"""
+    pass
+
+
+class InvalidRangeError(Exception):
+    """A range request failed in a way that may not happen again (e.g. server error or truncated response)"""
+    pass
+
+
+class RangeRequestError(Exception):
+    """A range request failed for good (e.g. the file does not exist)"""
+    pass
+
+
+class DownloadStats:
+    """Request statistics of a single stream"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._bytes = 0
+        self._seconds = 0.0
+        self._first_start: Optional[float] = None
+        self._last_end: Optional[float] = None
+        self._refreshes = 0
+        self._retries = 0
+
+    def record(self, num_bytes: int, start_time: float, end_time: float):
+        """Record a request that started and finished at the given time.perf_counter() values"""
+        with self._lock:
+            self._requests += 1
+            self._bytes += num_bytes
+            self._seconds += end_time - start_time
+            if self._first_start is None or start_time < self._first_start:
+                self._first_start = start_time
+            if self._last_end is None or end_time > self._last_end:
+                self._last_end = end_time
+
+    def record_refresh(self):
+        with self._lock:
+            self._refreshes += 1
+
+    def record_retry(self):
+        with self._lock:
+            self._retries += 1
+
+    def get_requests(self) -> int:
+        return self._requests
+
+    def get_bytes(self) -> int:
+        return self._bytes
+
+    def get_seconds(self) -> float:
+        """Get the time that all requests took together"""
+        return self._seconds
+
+    def get_wall_time(self) -> float:
+        """Get the time from the start of the first request until the last byte was received"""
+        if self._first_start is None or self._last_end is None:
+            return 0.0
+        return self._last_end - self._first_start
+
+    def get_throughput(self) -> float:
+        """Get the number of bytes per second of the whole stream, with requests running concurrently"""
+        wall_time = self.get_wall_time()
+        return self._bytes / wall_time if wall_time > 0 else 0.0
+
+    def get_bytes_per_request(self) -> float:
+        return self._bytes / self._requests if self._requests > 0 else 0.0
+
+    def get_refreshes(self) -> int:
+        return self._refreshes
+
+    def get_retries(self) -> int:
+        return self._retries
+
+    def __str__(self) -> str:
+        return (f"{self._bytes} bytes in {self._requests} requests ({self.get_bytes_per_request():.0f} bytes/request, "
+                f"{self._retries} retries, {self._refreshes} URL refreshes)")
+
+
+class RangeFetcher:
+    """Downloads a file in consecutive byte ranges, keeping up to window range requests in flight at the same time.
+    Chunks are yielded strictly in order and memory usage is bounded by window * max_chunk_size.
+
+    The size of the ranges adapts to the measured latency: it starts at min_chunk_size and doubles whenever a request
+    finishes in less than half of TARGET_REQUEST_TIME, and it is halved whenever a request is slower than twice that
+    time or fails.
+
+    Every response is checked against the requested range (status, Content-Range and length). Failed requests are
+    retried up to max_retries times with exponential backoff, and truncated responses are continued from the exact
+    byte at which they ended, so the stream stays continuous. If the server rejects a request because the URL has
+    expired, refresh is called to get a new URL and template (for the same file) before retrying."""
+
+    def __init__(self, session: requests.Session, url: str, template: str, file_size: int, *, start: int = 0,
+                 window: int = DEFAULT_WINDOW, min_chunk_size: int = MIN_CHUNK_SIZE,
+                 max_chunk_size: int = MAX_CHUNK_SIZE, refresh: Optional[Callable[[], Tuple[str, str]]] = None,
+                 max_retries: int = MAX_RETRIES, retry_delay: float = RETRY_DELAY):
+        self._session = session
+        self._url = url
+        self._template = template
+        self._refresh = refresh
+        self._refresh_lock = threading.Lock()
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._file_size = file_size
+        self._start = start
+        self._window = window
+        self._min_chunk_size = min_chunk_size
+        self._max_chunk_size = max_chunk_size
+        self._chunk_size = min_chunk_size
+        self._lock = threading.Lock()
+        self._stats = DownloadStats()
+
+    def get_stats(self) -> DownloadStats:
+        return self._stats
+
+    def stream_chunks(self) -> Generator[bytes, None, None]:
+        _logger.debug(f"Fetching {self._file_size - self._start} bytes with a window of {self._window} requests")
+        yield from imap_ordered(self._fetch, self._ranges(), self._window)
+        _logger.debug(f"Fetched {self._stats}")
+
+    def _ranges(self) -> Generator[Tuple[int, int], None, None]:
+        # Pulled lazily whenever a request slot becomes free, so each range uses the chunk size at that time
+        start = self._start
+        while start < self._file_size:
+            end = min(start + self._chunk_size, self._file_size)
+            yield start, end - 1
+            start = end
+
+    def _fetch(self, byte_range: Tuple[int, int]) -> bytes:
+        start_time = time.perf_counter()
+        try:
+            content = self._request(byte_range)
+        except Exception:
+            self._adapt_chunk_size(shrink=True)
+            raise
+        end_time = time.perf_counter()
+        elapsed = end_time - start_time
+        self._stats.record(len(content), start_time, end_time)
+        if elapsed < TARGET_REQUEST_TIME / 2:
+            self._adapt_chunk_size(shrink=False)
+        elif elapsed > TARGET_REQUEST_TIME * 2:
+            self._adapt_chunk_size(shrink=True)
+        return content
+
+    def _request(self, byte_range: Tuple[int, int]) -> bytes:
+        start, end = byte_range
+        content = b""
+        retries = 0
+        while True:
+            url, template = self._url, self._template
+            offset = start + len(content)
+            try:
+                response = self._session.get(url + template.format(offset, end), timeout=REQUEST_TIMEOUT)
+                content += _validate_response(response, offset, end)
+                if len(content) == end - start + 1:
+                    return content
+                raise InvalidRangeError(f"Response ended after {len(content)} of {end - start + 1} bytes")
+            except StreamExpiredError as error:
+                if self._refresh is None or retries >= self._max_retries:
+                    raise
+                _logger.info(f"URL expired ({error}), resuming at byte {offset} on a new URL")
+                self._refresh_url(url)
+            except (requests.RequestException, InvalidRangeError) as error:
+                if start + len(content) > offset:
+                    # The connection broke off after some data, continue right away and with a fresh retry budget
+                    _logger.info(f"Request for bytes {offset}-{end} was cut off ({error}), resuming")
+                    retries = -1
+                elif retries >= self._max_retries:
+                    raise
+                else:
+                    delay = min(self._retry_delay * 2 ** retries, MAX_RETRY_DELAY)
+                    _logger.warning(f"Request for bytes {offset}-{end} failed ({error}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+            retries += 1
+            self._stats.record_retry()
+
+    def _refresh_url(self, expired_url: str) -> Tuple[str, str]:
+        # All requests in flight fail at about the same time, but only the first one needs to get a new URL
+        with self._refresh_lock:
+            if self._url == expired_url:
+                self._url, self._template = self._refresh()
+                self._stats.record_refresh()
+            return self._url, self._template
+
+    def _adapt_chunk_size(self, *, shrink: bool):
+        with self._lock:
+            if shrink:
+                self._chunk_size = max(self._chunk_size // 2, self._min_chunk_size)
+            else:
+                self._chunk_size = min(self._chunk_size * 2, self._max_chunk_size)
+
+
+def _validate_response(response: requests.Response, start: int, end: int) -> bytes:
+    """Check that the response contains (the beginning of) the range from start to end and return its content"""
+    if response.status_code in EXPIRED_STATUS_CODES:
+        raise StreamExpiredError(f"Status {response.status_code} for bytes {start}-{end}")
+    if response.status_code >= 500 or response.status_code == 429:
+        raise InvalidRangeError(f"Status {response.status_code}")
+    if response.status_code not in (200, 206):
+        raise RangeRequestError(f"Status {response.status_code} for bytes {start}-{end}")
+    # The range is part of the URL, so the server may answer with 200 and without Content-Range
+    content_range = response.headers.get("Content-Range")
+    if content_range is not None:
+        match = _content_range_regex.match(content_range)
+        if match is None or int(match.group("start")) != start or int(match.group("end")) > end:
+            raise InvalidRangeError(f"Content-Range \"{content_range}\" does not match bytes {start}-{end}")
+    content = response.content
+    if len(content) > end - start + 1:
+        raise InvalidRangeError(f"Received {len(content)} bytes for a range of {end - start + 1} bytes")
+    return content
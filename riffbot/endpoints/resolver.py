@@ -0,0 +1,102 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+from typing import Any, Callable, List, Optional, TypeVar
+
+from riffbot.audio.songqueue import SongQueue
+from riffbot.utils import converters
+from .endpoint import Endpoint
+from .youtube import YouTubeEndpoint
+
+_logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 4
+RESOLVE_TIMEOUT = 30.0  # seconds
+BATCH_SIZE = 25  # Number of playlist entries that are resolved at once
+
+T = TypeVar("T")
+
+# Searching and fetching video metadata is blocking network I/O, so it runs in a small pool of worker threads instead of
+# on the event loop. The pool size bounds how many resolutions run at the same time across all guilds.
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="resolver")
+
+
+class ResolutionTimeoutError(Exception):
+    pass
+
+
+async def resolve_youtube(args: List[str], *, timeout: float = RESOLVE_TIMEOUT) -> Optional[List[YouTubeEndpoint]]:
+    """Turn command arguments (video URL, playlist URL or search terms) into YouTube endpoints without blocking the
+    event loop. Returns None if nothing was found."""
+    return await _run_in_executor(_resolve_youtube, args, timeout=timeout)
+
+
+def open_youtube_playlist(args: List[str], *, exclude_id: Optional[str] = None) -> Optional["PlaylistResolution"]:
+    """Start an incremental resolution if the arguments are a playlist URL, otherwise return None"""
+    playlist_id = converters.to_youtube_playlist_id(args)
+    if playlist_id is None:
+        return None
+    return PlaylistResolution(playlist_id, exclude_id=exclude_id)
+
+
+class PlaylistResolution:
+    """Resolves the entries of a playlist batch by batch, so the first entries can be played before the whole playlist
+    is known. Batches must be requested one after another."""
+
+    def __init__(self, playlist_id: str, *, exclude_id: Optional[str] = None):
+        _logger.debug(f"Opening playlist {playlist_id}")
+        self._videos = converters.iter_youtube_playlist(playlist_id)
+        self._exclude_id = exclude_id
+        self._exhausted = False
+
+    def is_exhausted(self) -> bool:
+        return self._exhausted
+
+    async def next_batch(self, size: int = BATCH_SIZE, *, timeout: float = RESOLVE_TIMEOUT) -> List[YouTubeEndpoint]:
+        return await _run_in_executor(self._resolve_batch, size, timeout=timeout)
+
+    async def enqueue_remaining(self, song_queue: SongQueue, endpoints: List[Endpoint], *, at_front: bool = False):
+        """Enqueue the rest of the playlist batch by batch. endpoints holds the entries enqueued so far and is extended
+        with every batch, so it is up to date even if loading fails or is cancelled partway through."""
+        while not self.is_exhausted():
+            batch = await self.next_batch()
+            if at_front:
+                # Keep the playlist in one piece, right behind the entries that were enqueued so far
+                last_pos = song_queue.find(endpoints[-1])
+                song_queue.enqueue(batch, pos=0 if last_pos is None else last_pos + 1)
+            else:
+                song_queue.enqueue(batch)
+            endpoints.extend(batch)
+
+    def _resolve_batch(self, size: int) -> List[YouTubeEndpoint]:
+        videos = list(itertools.islice(self._videos, size))
+        if len(videos) < size:
+            self._exhausted = True
+        endpoints = []
+        for video in videos:
+            if video.videoid == self._exclude_id:
+                continue
+            endpoint = YouTubeEndpoint(video)
+            # Fetch metadata that was missing from the playlist here rather than later on the event loop
+            endpoint.get_length()
+            endpoints.append(endpoint)
+        return endpoints
+
+
+def _resolve_youtube(args: List[str]) -> Optional[List[YouTubeEndpoint]]:
+    videos = converters.to_youtube_videos(args)
+    if videos is None:
+        return None
+    return [YouTubeEndpoint(video) for video in videos]
+
+
+async def _run_in_executor(function: Callable[..., T], *args: Any, timeout: float) -> T:
+    # If the awaiting command is cancelled or times out, a job that has not started yet is dropped from the pool. A job
+    # that is already running cannot be interrupted, but its result is discarded.
+    future = asyncio.get_event_loop().run_in_executor(_executor, function, *args)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        _logger.warning(f"Resolution timed out after {timeout} seconds")
+        raise ResolutionTimeoutError(f"Resolution took longer than {timeout} seconds")
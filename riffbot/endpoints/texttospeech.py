@@ -1,35 +1,79 @@
 import logging
-from typing import Generator, Optional
-
-from gtts import gTTS
-import requests
+import time
+from typing import Generator, List, Optional
+import unicodedata
 
+from riffbot.cache.ttlcache import TTLCache
+from riffbot.utils.concurrency import imap_ordered
+from . import httppool
 from .endpoint import Endpoint
 
 _logger = logging.getLogger(__name__)
 
+DEFAULT_LANGUAGE = "en"
+FETCH_WINDOW = 4  # Number of speech segments that are fetched concurrently
+SPEECH_CACHE_SIZE = 128  # Number of synthesized texts that are kept in memory
+SPEECH_CACHE_TTL = 86400.0  # seconds
+MAX_CACHED_SPEECH_SIZE = 262144  # 256 KB (about a minute of speech), longer texts are not kept in memory
+
+# Maps cache keys of texts to their synthesized audio (MP3)
+_speech_cache: TTLCache[str, bytes] = TTLCache("synthesized speech", SPEECH_CACHE_SIZE, SPEECH_CACHE_TTL)
+
+
+def get_speech_cache() -> TTLCache[str, bytes]:
+    return _speech_cache
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
 
 class TextToSpeechEndpoint(Endpoint):
-    def __init__(self, text: str):
+    def __init__(self, text: str, *, lang: str = DEFAULT_LANGUAGE):
         _logger.debug("Initializing")
         self._text = text
+        self._lang = lang
         self._initialized = False
 
     def initialize(self):
         if not self._initialized:
             self._initialized = True
-            self._gtts = gTTS(self._text, lang_check=False)
+            from gtts import gTTS
+            self._gtts = gTTS(self._text, lang=self._lang, lang_check=False)
 
     def is_initialized(self):
         return self._initialized
 
     def stream_chunks(self) -> Generator[bytes, None, None]:
+        key = self.get_cache_key()
+        audio = _speech_cache.get(key)
+        if audio is not None:
+            yield audio
+            return
+
         if not self.is_initialized():
             self.initialize()
 
-        with requests.Session() as session:
-            for chunk_url in self._gtts.get_urls():
-                yield session.get(chunk_url).content
+        session = httppool.get_session()
+        chunks: Optional[List[bytes]] = []
+        size = 0
+        start = time.perf_counter()
+        consumer_time = 0.0
+        # Long texts are split into many short segments, fetch several of them at once but play them in order
+        for chunk in imap_ordered(lambda url: session.get(url, timeout=httppool.REQUEST_TIMEOUT).content,
+                                  self._gtts.get_urls(), FETCH_WINDOW):
+            if chunks is not None:
+                size += len(chunk)
+                if size <= MAX_CACHED_SPEECH_SIZE:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+            yielded = time.perf_counter()
+            yield chunk
+            consumer_time += time.perf_counter() - yielded
+        # Only reached if all segments were fetched
+        if chunks is not None:
+            _speech_cache.put(key, b"".join(chunks), cost=time.perf_counter() - start - consumer_time)
 
     def get_song_description(self) -> str:
         return f"Text to speech: \"{f'{self._text[:35]}…' if len(self._text) > 37 else self._text}\""
@@ -37,5 +81,12 @@ class TextToSpeechEndpoint(Endpoint):
     def get_bit_rate(self) -> Optional[int]:
         return None
 
+    def get_cache_key(self) -> Optional[str]:
+        # The same text in the same language always sounds the same, no matter how it was spaced
+        return f"tts/{self._lang}/{_normalize_text(self._text)}"
+
+    def get_codec(self) -> Optional[str]:
+        return "mp3"
+
     def get_length(self) -> Optional[int]:
         return None
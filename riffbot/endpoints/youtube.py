@@ -1,11 +1,19 @@
 import logging
 import re
-from typing import Generator, Optional, Union
+import time
+from typing import TYPE_CHECKING, Generator, NamedTuple, Optional, Tuple, Union
 
-import pafy
-import requests
+from riffbot import metrics
+from riffbot.cache.diskcache import DiskCache, read_chunks
+from riffbot.cache.ttlcache import TTLCache
+from . import httppool
+from .containers import IncompleteIndexError, SeekIndex, parse_mp4_index, parse_webm_index
+from .endpoint import Endpoint, InvalidEndpointError, SeekNotSupportedError
 
-from .endpoint import Endpoint, InvalidEndpointError
+if TYPE_CHECKING:
+    import pafy
+
+    from .rangefetcher import DownloadStats
 
 _logger = logging.getLogger(__name__)
 
@@ -13,20 +21,129 @@ _range_variants = {
     "&range={}-{}": re.compile("^https://.*\\.googlevideo\\.com/videoplayback\\?([^/]+=[^/]*&)*[^/]+=[^/]*$"),
     "range/{}-{}/": re.compile("^https://.*\\.googlevideo\\.com/videoplayback/([^&=?]+/)+$")
 }
+_codecs = {
+    "m4a": "aac",
+    "webm": "opus"
+}
+_index_parsers = {
+    "m4a": parse_mp4_index,
+    "webm": parse_webm_index
+}
+_expire_regex = re.compile("[?&/]expire[=/](?P<expire>\\d+)")
+
+INDEX_PROBE_SIZE = 65536  # 64 KB, enough for the header and index of most files
+MAX_INDEX_SIZE = 4194304  # 4 MB
+METADATA_CACHE_SIZE = 4096  # Number of videos whose metadata is remembered
+METADATA_CACHE_TTL = 86400.0  # seconds
+STREAM_CACHE_SIZE = 1024  # Number of videos whose stream URL is remembered
+STREAM_CACHE_TTL = 3600.0  # seconds, only used for URLs without an expiry time
+EXPIRY_MARGIN = 600.0  # Stream URLs are no longer used this many seconds before they expire
+
+_download_window: Optional[int] = None  # None uses the default window of RangeFetcher
+_preferred_format = "m4a"
+_audio_cache: Optional[DiskCache] = None
+
+
+class VideoMetadata(NamedTuple):
+    title: str
+    length: int
+    bit_rate: Optional[int] = None
+
+
+_metadata_cache: TTLCache[str, VideoMetadata] = TTLCache("video metadata", METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+# Maps video IDs to their best audio stream (including its URL and file size)
+_stream_cache: TTLCache[str, "pafy.backend_shared.BaseStream"] = TTLCache("stream URL", STREAM_CACHE_SIZE,
+                                                                          STREAM_CACHE_TTL)
+
+
+def set_download_window(window: int):
+    """Set the number of range requests that are kept in flight concurrently per stream"""
+    global _download_window
+    _download_window = window
+
+
+def set_preferred_format(extension: str):
+    """Set the file format (m4a or webm) that is preferred if a video has audio streams of the same quality in
+    several formats"""
+    global _preferred_format
+    _preferred_format = extension
+
+
+def set_audio_cache(cache: Optional[DiskCache]):
+    """Set the cache for downloaded audio files (None disables caching)"""
+    global _audio_cache
+    _audio_cache = cache
+
+
+def get_metadata_cache() -> TTLCache[str, VideoMetadata]:
+    return _metadata_cache
+
+
+def get_stream_cache() -> TTLCache[str, "pafy.backend_shared.BaseStream"]:
+    return _stream_cache
+
+
+def _new_video(url: str) -> "pafy.pafy.Pafy":
+    """Create a video from a URL or ID. Only fetches the basic video info if its metadata is not cached."""
+    import pafy
+
+    video_id = pafy.backend_shared.extract_video_id(url)
+    metadata = _metadata_cache.get(video_id)
+    if metadata is None:
+        start = time.perf_counter()
+        video = pafy.new(video_id)
+        _metadata_cache.put(video_id, VideoMetadata(video.title, video.length), cost=time.perf_counter() - start)
+        return video
+    return _populated_video(video_id, metadata.title, metadata.length)
+
+
+def _populated_video(video_id: str, title: str, length: Optional[int]) -> "pafy.pafy.Pafy":
+    import pafy
+
+    # The video will fetch its info once streams are requested from it
+    video = pafy.new(video_id, basic=False)
+    video.populate_from_playlist({"title": title, "length_seconds": length or 0})
+    return video
+
+
+def restore_endpoint(video_id: str, title: str, length: Optional[int]) -> "YouTubeEndpoint":
+    """Create an endpoint from known metadata, without any requests to YouTube"""
+    return YouTubeEndpoint(_populated_video(video_id, title, length))
 
-CHUNK_SIZE = 65536  # 64 KB
+
+def _get_best_audio(video: "pafy.pafy.Pafy") -> "pafy.backend_shared.BaseStream":
+    stream = _stream_cache.get(video.videoid)
+    if stream is None:
+        start = time.perf_counter()
+        stream = video.getbestaudio(preftype=_preferred_format)
+        _cache_stream(video.videoid, stream, cost=time.perf_counter() - start)
+    return stream
+
+
+def _cache_stream(video_id: str, stream: "pafy.backend_shared.BaseStream", *, cost: float = 0.0):
+    # Stream URLs are signed and only valid until the time in their expire parameter (usually a few hours)
+    match = _expire_regex.search(stream.url)
+    ttl = int(match.group("expire")) - time.time() - EXPIRY_MARGIN if match else STREAM_CACHE_TTL
+    if ttl > 0:
+        _stream_cache.put(video_id, stream, ttl=ttl, cost=cost)
 
 
 class YouTubeEndpoint(Endpoint):
-    def __init__(self, url_or_pafy: Union[str, pafy.pafy.Pafy]):
-        self._video = pafy.new(url_or_pafy) if type(url_or_pafy) is str else url_or_pafy
+    def __init__(self, url_or_pafy: Union[str, "pafy.pafy.Pafy"]):
+        self._video = _new_video(url_or_pafy) if type(url_or_pafy) is str else url_or_pafy
         _logger.debug(f"Constructing: {self._video.title}")
         self._initialized = False
+        self._download_stats: Optional["DownloadStats"] = None
+        self._seek_index: Optional[SeekIndex] = None
+        self._start_offset = 0
 
     def initialize(self):
         if not self._initialized:
             self._initialized = True
-            self._stream = self._video.getbestaudio(preftype="m4a")
+            self._stream = _get_best_audio(self._video)
+            metadata = VideoMetadata(self._video.title, self._video.length, self._stream.rawbitrate)
+            if not _metadata_cache.replace(self.get_youtube_id(), metadata):
+                _metadata_cache.put(self.get_youtube_id(), metadata)
 
     def is_initialized(self):
         return self._initialized
@@ -35,29 +152,151 @@ class YouTubeEndpoint(Endpoint):
         if not self.is_initialized():
             self.initialize()
 
+        start_offset, self._start_offset = self._start_offset, 0
+        if start_offset > 0:
+            yield from self._stream_chunks_from(start_offset)
+            return
+
+        cache = _audio_cache
+        if cache is None:
+            yield from self._download_chunks()
+            return
+
+        key = self._get_file_cache_key()
+        path = cache.get_path(key)
+        if path is not None:
+            yield from read_chunks(path)
+            return
+
+        # Populate the cache while streaming, but only keep the file if the download was complete
+        writer = cache.open_writer(key)
+        complete = False
+        try:
+            for chunk in self._download_chunks():
+                writer.write(chunk)
+                yield chunk
+            complete = writer.get_size() == self._stream.get_filesize()
+        finally:
+            if complete:
+                writer.commit()
+            else:
+                writer.abort()
+
+    def seek(self, position: float) -> float:
+        if not self.is_initialized():
+            self.initialize()
+
+        if self._seek_index is None:
+            self._seek_index = self._read_seek_index()
+            if self._seek_index is None:
+                raise SeekNotSupportedError()
+        start_time, self._start_offset = self._seek_index.lookup(position)
+        _logger.debug(f"Seeking to {start_time:.2f}s (byte {self._start_offset}) for requested position {position}s")
+        return start_time
+
+    def _stream_chunks_from(self, start_offset: int) -> Generator[bytes, None, None]:
+        # The decoder needs the header of the file before it can decode any segment
+        yield self._seek_index.get_header()
+        cache = _audio_cache
+        path = cache.get_path(self._get_file_cache_key()) if cache else None
+        if path is not None:
+            yield from read_chunks(path, start=start_offset)
+        else:
+            yield from self._download_chunks(start=start_offset)
+
+    def _read_seek_index(self) -> Optional[SeekIndex]:
+        parse_index = _index_parsers.get(self._stream.extension)
+        if parse_index is None:
+            return None
+        size = INDEX_PROBE_SIZE
+        while True:
+            data = self._read_head(size)
+            try:
+                return parse_index(data)
+            except IncompleteIndexError as error:
+                if len(data) < size or error.required_size > MAX_INDEX_SIZE:
+                    return None
+                size = max(error.required_size, size * 2)
+            except ValueError as error:
+                _logger.warning(f"Could not read the index of \"{self._video.title}\": {error}")
+                return None
+
+    def _read_head(self, size: int) -> bytes:
+        """Read the first size bytes of the stream (from the cache if possible)"""
+        cache = _audio_cache
+        path = cache.get_path(self._get_file_cache_key()) if cache else None
+        if path is not None:
+            with open(path, "rb") as file:
+                return file.read(size)
+        url = self._stream.url_https
+        file_size = self._stream.get_filesize()
+        byte_range = self._get_url_variant(url).format(0, min(size, file_size) - 1)
+        return httppool.get_session().get(url + byte_range, timeout=httppool.REQUEST_TIMEOUT).content
+
+    def _download_chunks(self, *, start: int = 0) -> Generator[bytes, None, None]:
+        # Imported here, so requests is only loaded once the first song is downloaded
+        from .rangefetcher import DEFAULT_WINDOW, RangeFetcher
+
         url = self._stream.url_https
         template = self._get_url_variant(url)
         file_size = self._stream.get_filesize()
-        with requests.Session() as session:
-            for i in range(0, file_size, CHUNK_SIZE):
-                chunk_url = url + template.format(i, min(i + CHUNK_SIZE - 1, file_size - 1))
-                yield session.get(chunk_url).content
+        fetcher = RangeFetcher(httppool.get_session(), url, template, file_size, start=start,
+                               window=_download_window or DEFAULT_WINDOW, refresh=self._refresh_stream)
+        self._download_stats = stats = fetcher.get_stats()
+        try:
+            yield from fetcher.stream_chunks()
+        finally:
+            metrics.record_download(stats.get_bytes(), stats.get_throughput(), self._stream.rawbitrate)
+
+    def _refresh_stream(self) -> Tuple[str, str]:
+        """Resolve a new URL for the current stream after the old one has expired. Returns the URL and its template."""
+        import pafy
+
+        _stream_cache.remove(self.get_youtube_id())
+        video = pafy.new(self.get_youtube_id())
+        # Resuming only works with exactly the same file
+        stream = next((stream for stream in video.audiostreams if stream.itag == self._stream.itag), None)
+        if stream is None or stream.get_filesize() != self._stream.get_filesize():
+            raise InvalidEndpointError()
+        _logger.debug(f"Refreshed stream URL of \"{self._video.title}\"")
+        self._stream = stream
+        _cache_stream(self.get_youtube_id(), stream)
+        return stream.url_https, self._get_url_variant(stream.url_https)
 
     def get_song_description(self) -> str:
         return self._video.title
 
     def get_bit_rate(self) -> Optional[int]:
         if not self.is_initialized():
+            metadata = _metadata_cache.get(self.get_youtube_id())
+            if metadata is not None and metadata.bit_rate is not None:
+                return metadata.bit_rate
             self.initialize()
 
         return self._stream.rawbitrate
 
+    def get_cache_key(self) -> Optional[str]:
+        return f"youtube/{self.get_youtube_id()}"
+
+    def get_codec(self) -> Optional[str]:
+        if not self.is_initialized():
+            self.initialize()
+
+        return _codecs.get(self._stream.extension)
+
     def get_length(self) -> Optional[int]:
         return self._video.length
 
+    def get_download_stats(self) -> Optional["DownloadStats"]:
+        """Get the request statistics of the most recent stream of this endpoint"""
+        return self._download_stats
+
     def get_youtube_id(self) -> str:
         return self._video.videoid
 
+    def _get_file_cache_key(self) -> str:
+        return f"youtube/{self.get_youtube_id()}/{self._stream.itag}.{self._stream.extension}"
+
     def _get_url_variant(self, url: str) -> str:
         for template, regex in _range_variants.items():
             if regex.match(url) is not None:
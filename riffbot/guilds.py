@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from blinker import signal
+import discord
+
+from riffbot.audio.player import Player
+from riffbot.utils.scheduler import Deadline, DeadlineScheduler, get_scheduler
+
+_logger = logging.getLogger(__name__)
+
+
+class GuildState:
+    """Everything the bot keeps per guild while it is connected to one of the guild's voice channels"""
+
+    def __init__(self, guild_id: int, voice_client: discord.VoiceClient, scheduler: Optional[DeadlineScheduler] = None):
+        _logger.debug(f"Initializing for guild {guild_id}")
+        self._guild_id = guild_id
+        self._player = Player(voice_client)
+        self._scheduler = scheduler or get_scheduler()
+        self._leave_timer: Optional[Deadline] = None
+        self._tasks: Set[asyncio.Future] = set()
+        self._receivers: List[Tuple[str, Callable[..., Any]]] = []
+
+    def get_guild_id(self) -> int:
+        return self._guild_id
+
+    def get_player(self) -> Player:
+        return self._player
+
+    def start_leave_timer(self, timeout: float, callback: Callable[..., Awaitable[None]], *args: Any, **kwargs: Any):
+        if self._leave_timer:
+            self._leave_timer.reset()
+        else:
+            self._leave_timer = self._scheduler.create(timeout, callback, *args, **kwargs)
+
+    def reset_leave_timer(self):
+        if self._leave_timer:
+            self._leave_timer.reset()
+
+    def cancel_leave_timer(self):
+        if self._leave_timer:
+            self._leave_timer.cancel()
+            self._leave_timer = None
+
+    def connect_player_signal(self, name: str, receiver: Callable[..., Any]):
+        """Connect a receiver to a signal sent by the player. It stays connected until the state is closed."""
+        signal(name).connect(receiver, sender=self._player, weak=False)
+        self._receivers.append((name, receiver))
+
+    def start_task(self, coroutine: Awaitable[None]) -> asyncio.Future:
+        """Run a background job (e.g. loading a playlist) that is cancelled when the state is closed"""
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def cancel_tasks(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def close(self):
+        _logger.debug(f"Closing state of guild {self._guild_id}")
+        self.cancel_leave_timer()
+        self.cancel_tasks()
+        for name, receiver in self._receivers:
+            # Disconnecting from only this sender would still keep a reference to the receiver
+            signal(name).disconnect(receiver)
+        self._receivers = []
+        self._player.stop()
+
+
+class GuildRegistry:
+    """Maps guild IDs to their state, so one bot process can serve any number of guilds at the same time"""
+
+    def __init__(self, scheduler: Optional[DeadlineScheduler] = None):
+        self._states: Dict[int, GuildState] = {}
+        self._scheduler = scheduler
+
+    def create(self, guild_id: int, voice_client: discord.VoiceClient) -> GuildState:
+        if guild_id in self._states:
+            _logger.warning(f"Replacing existing state of guild {guild_id}")
+            self._states.pop(guild_id).close()
+        state = GuildState(guild_id, voice_client, self._scheduler)
+        self._states[guild_id] = state
+        return state
+
+    def get(self, guild_id: int) -> Optional[GuildState]:
+        return self._states.get(guild_id)
+
+    def get_player(self, guild_id: int) -> Optional[Player]:
+        state = self._states.get(guild_id)
+        return state.get_player() if state else None
+
+    def remove(self, guild_id: int) -> Optional[GuildState]:
+        state = self._states.pop(guild_id, None)
+        if state:
+            state.close()
+        return state
+
+    def list(self) -> List[GuildState]:
+        return list(self._states.values())
+
+    def size(self) -> int:
+        return len(self._states)
@@ -0,0 +1,334 @@
+import bisect
+import http.server
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import weakref
+
+from blinker import signal
+
+from riffbot.cache.diskcache import DiskCache
+from riffbot.cache.ttlcache import TTLCache
+
+_logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+RATIO_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f"{name}=\"{_escape(value)}\"" for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    def __init__(self, name: str, help_text: str, kind: str, labels: Sequence[str]):
+        self._name = name
+        self._help = help_text
+        self._kind = kind
+        self._labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def get_name(self) -> str:
+        return self._name
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self._name} {self._help}", f"# TYPE {self._name} {self._kind}", *self._render_samples()]
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    """Value that only goes up, e.g. a number of events"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, "counter", labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self._name}{_format_labels(self._labels, labels)} {_format_value(value)}"
+                for labels, value in values]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. a number of running threads"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, "gauge", labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self._name}{_format_labels(self._labels, labels)} {_format_value(value)}"
+                for labels, value in values]
+
+
+class CallbackGauge(_Metric):
+    """Gauge whose values are read from a callback whenever the metrics are collected. The callback returns the value
+    for every combination of labels."""
+
+    def __init__(self, name: str, help_text: str, callback: Callable[[], Dict[Labels, float]],
+                 labels: Sequence[str] = (), *, kind: str = "gauge"):
+        super().__init__(name, help_text, kind, labels)
+        self._callback = callback
+
+    def _render_samples(self) -> List[str]:
+        return [f"{self._name}{_format_labels(self._labels, labels)} {_format_value(value)}"
+                for labels, value in self._callback().items()]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, "histogram", labels)
+        self._buckets = tuple(sorted(buckets))
+        # Maps labels to (count per bucket (the last one is +Inf), sum of all values)
+        self._values: Dict[Labels, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            counts, total = self._values.get(labels) or ([0] * (len(self._buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self._buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def get_count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def get_sum(self, *labels: str) -> float:
+        entry = self._values.get(labels)
+        return entry[1] if entry else 0.0
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip([*map(_format_value, self._buckets), "+Inf"], counts):
+                cumulative += count
+                bucket_labels = _format_labels(self._labels, labels, f"le=\"{bound}\"")
+                lines.append(f"{self._name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self._name}_sum{_format_labels(self._labels, labels)} {_format_value(total)}")
+            lines.append(f"{self._name}_count{_format_labels(self._labels, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collects metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.get_name() in self._metrics:
+                raise ValueError(f"Metric {metric.get_name()} is registered already")
+            self._metrics[metric.get_name()] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name: str, help_text: str, callback: Callable[[], Dict[Labels, float]],
+                 labels: Sequence[str] = (), *, kind: str = "gauge") -> CallbackGauge:
+        return self.register(CallbackGauge(name, help_text, callback, labels, kind=kind))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                _logger.warning(f"Unable to collect metric {metric.get_name()}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+# Metrics of the playback pipeline, updated by the player and the command decorator
+time_to_first_audio = _registry.histogram("riffbot_time_to_first_audio_seconds",
+                                          "Time from a play command until its song is audible", ["command"])
+inter_song_gap = _registry.histogram("riffbot_inter_song_gap_seconds",
+                                     "Time from the end of a song until the next song in the queue is audible")
+download_speed_ratio = _registry.histogram("riffbot_download_speed_ratio",
+                                           "Download throughput of a stream divided by its bit rate",
+                                           buckets=RATIO_BUCKETS)
+downloaded_bytes = _registry.counter("riffbot_downloaded_bytes_total", "Bytes downloaded for streams")
+buffer_underruns = _registry.counter("riffbot_buffer_underruns_total",
+                                     "Number of times a read-ahead buffer ran empty while playing")
+buffer_underrun_seconds = _registry.counter("riffbot_buffer_underrun_seconds_total",
+                                            "Time spent waiting on empty read-ahead buffers")
+ffmpeg_processes = _registry.gauge("riffbot_ffmpeg_processes", "Number of running ffmpeg processes")
+downloader_threads = _registry.gauge("riffbot_downloader_threads", "Number of running downloader threads")
+command_latency = _registry.histogram("riffbot_command_latency_seconds", "Time to handle a command", ["command"])
+songs_played = _registry.counter("riffbot_songs_played_total", "Number of songs that started playing")
+
+
+class _PlayerState:
+    def __init__(self):
+        self.song_started: Optional[float] = None
+        self.song_stopped: Optional[float] = None
+        self.pending_command: Optional[Tuple[str, float]] = None
+
+
+# Per player timing state, dropped together with the player
+_players: "weakref.WeakKeyDictionary[object, _PlayerState]" = weakref.WeakKeyDictionary()
+_players_lock = threading.Lock()
+
+
+def _get_player_state(player: object) -> _PlayerState:
+    with _players_lock:
+        state = _players.get(player)
+        if state is None:
+            state = _PlayerState()
+            _players[player] = state
+        return state
+
+
+def expect_first_audio(player: object, command: str, received: float):
+    """Measure the time to first audio of the next song that player starts, for a command received at the given time
+    (of time.perf_counter)"""
+    _get_player_state(player).pending_command = (command, received)
+
+
+def _on_song_start(sender: object, song: object):
+    songs_played.inc()
+
+
+def _on_audio_start(sender: object):
+    # Called from the voice client's thread when the first packet of a song is read
+    now = time.perf_counter()
+    state = _get_player_state(sender)
+    if state.pending_command is not None:
+        command, received = state.pending_command
+        state.pending_command = None
+        time_to_first_audio.observe(now - received, command)
+    elif state.song_stopped is not None:
+        inter_song_gap.observe(now - state.song_stopped)
+    state.song_stopped = None
+    state.song_started = now
+
+
+def _on_song_stop(sender: object, is_last: bool):
+    state = _get_player_state(sender)
+    state.song_stopped = None if is_last else time.perf_counter()
+    buffer = sender.get_buffer()
+    if buffer is not None:
+        stats = buffer.get_stats()
+        buffer_underruns.inc(amount=stats.get_underruns())
+        buffer_underrun_seconds.inc(amount=stats.get_underrun_time())
+
+
+def record_download(num_bytes: int, throughput: float, bit_rate: Optional[int]):
+    """Record a finished download of num_bytes, which arrived at throughput bytes per second"""
+    downloaded_bytes.inc(amount=num_bytes)
+    if bit_rate and throughput > 0:
+        download_speed_ratio.observe(throughput * 8 / bit_rate)
+
+
+def register_caches(caches: Sequence[TTLCache]):
+    """Report the hits and misses of in-memory caches"""
+    _registry.callback("riffbot_cache_hits_total", "Number of cache hits",
+                       lambda: {(cache.get_name(),): cache.get_hits() for cache in caches}, ["cache"], kind="counter")
+    _registry.callback("riffbot_cache_misses_total", "Number of cache misses",
+                       lambda: {(cache.get_name(),): cache.get_misses() for cache in caches}, ["cache"],
+                       kind="counter")
+
+
+def register_disk_caches(caches: Dict[str, DiskCache]):
+    """Report the hits, misses and evictions of file caches by their name"""
+    _registry.callback("riffbot_disk_cache_hits_total", "Number of file cache hits",
+                       lambda: {(name,): cache.get_hits() for name, cache in caches.items()}, ["cache"], kind="counter")
+    _registry.callback("riffbot_disk_cache_misses_total", "Number of file cache misses",
+                       lambda: {(name,): cache.get_misses() for name, cache in caches.items()}, ["cache"],
+                       kind="counter")
+    _registry.callback("riffbot_disk_cache_evictions_total", "Number of files evicted from a file cache",
+                       lambda: {(name,): cache.get_evictions() for name, cache in caches.items()}, ["cache"],
+                       kind="counter")
+
+
+signal("player_song_start").connect(_on_song_start)
+signal("player_audio_start").connect(_on_audio_start)
+signal("player_song_stop").connect(_on_song_stop)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        _logger.debug(f"{self.address_string()} {format % args}")
+
+
+def start_server(address: str, port: int) -> http.server.ThreadingHTTPServer:
+    """Serve the metrics at http://address:port/metrics from a background thread"""
+    server = http.server.ThreadingHTTPServer((address, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    _logger.info(f"Serving metrics on http://{address}:{server.server_address[1]}/metrics")
+    return server
@@ -3,6 +3,8 @@ from configparser import SafeConfigParser
 from enum import Enum
 import logging
 
+PLAYBACK_MODES = ("pcm", "opus")
+
 
 class LogLevel(Enum):
     DEBUG = logging.DEBUG
@@ -18,6 +20,36 @@ def _command_prefix(arg: str) -> str:
     return arg
 
 
+def _positive_int(arg: str) -> int:
+    try:
+        value = int(arg)
+    except ValueError:
+        raise ArgumentTypeError(f"\"{arg}\" is not an integer")
+    if value < 1:
+        raise ArgumentTypeError(f"Value must be at least 1 (got {value})")
+    return value
+
+
+def _non_negative_int(arg: str) -> int:
+    try:
+        value = int(arg)
+    except ValueError:
+        raise ArgumentTypeError(f"\"{arg}\" is not an integer")
+    if value < 0:
+        raise ArgumentTypeError(f"Value must not be negative (got {value})")
+    return value
+
+
+def _port(arg: str) -> int:
+    try:
+        value = int(arg)
+    except ValueError:
+        raise ArgumentTypeError(f"\"{arg}\" is not an integer")
+    if value < 0 or value > 65535:
+        raise ArgumentTypeError(f"Port must be between 0 and 65535 (got {value})")
+    return value
+
+
 def parse_options() -> Namespace:
     conf_parser = ArgumentParser(add_help=False)
     conf_parser.add_argument("-c", "--config-file", help="Specify a config file (ini format)",
@@ -25,7 +57,18 @@ def parse_options() -> Namespace:
     args, remaining_argv = conf_parser.parse_known_args()
     defaults = {
         "command_prefix": "!",
-        "log_level": LogLevel.WARNING.name
+        "log_level": LogLevel.WARNING.name,
+        "download_window": "4",
+        "playback_mode": "pcm",
+        "read_ahead_size": "2048",
+        "cache_dir": "",
+        "audio_cache_size": "1024",
+        "opus_cache_size": "256",
+        "snapshot_dir": "",
+        "snapshot_interval": "30",
+        "metrics_address": "127.0.0.1",
+        "metrics_port": "0",
+        "profile_threshold": "0"
     }
     if args.config_file:
         config = SafeConfigParser()
@@ -41,5 +84,30 @@ def parse_options() -> Namespace:
     parser.add_argument("-p", "--command-prefix", type=str, help="Set the command prefix", metavar="prefix")
     parser.add_argument("-l", "--log-level", type=str.upper, choices=[level.name for level in list(LogLevel)],
                         help="Set the log level", metavar="level")
+    parser.add_argument("-w", "--download-window", type=_positive_int,
+                        help="Set the number of concurrent range requests per YouTube stream", metavar="requests")
+    parser.add_argument("--playback-mode", type=str.lower, choices=PLAYBACK_MODES,
+                        help="Set whether ffmpeg produces PCM (encoded to Opus by the bot) or Opus directly",
+                        metavar="mode")
+    parser.add_argument("--read-ahead-size", type=_positive_int,
+                        help="Set the maximum size of the read-ahead buffer per stream in KiB", metavar="KiB")
+    parser.add_argument("--cache-dir", type=str, help="Enable caching and store cached files in this directory",
+                        metavar="directory")
+    parser.add_argument("--audio-cache-size", type=_positive_int,
+                        help="Set the maximum size of the downloaded audio cache in MiB", metavar="MiB")
+    parser.add_argument("--opus-cache-size", type=_positive_int,
+                        help="Set the maximum size of the encoded Opus frame cache in MiB", metavar="MiB")
+    parser.add_argument("--snapshot-dir", type=str,
+                        help="Save the song queues in this directory and restore them after a restart",
+                        metavar="directory")
+    parser.add_argument("--snapshot-interval", type=_positive_int,
+                        help="Set the number of seconds between two saves of changed song queues", metavar="seconds")
+    parser.add_argument("--metrics-address", type=str, help="Set the address on which metrics are served",
+                        metavar="address")
+    parser.add_argument("--metrics-port", type=_port, help="Serve metrics on this port (0 disables metrics)",
+                        metavar="port")
+    parser.add_argument("--profile-threshold", type=_non_negative_int,
+                        help="Log commands that take longer than this many milliseconds, with a cProfile report for a "
+                             "sample of them (0 disables profiling)", metavar="ms")
     args = parser.parse_args(remaining_argv)
     return args
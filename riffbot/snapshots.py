@@ -0,0 +1,251 @@
+import asyncio
+import functools
+import logging
+import os
+import struct
+import tempfile
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+import weakref
+
+from riffbot.endpoints import youtube
+from riffbot.endpoints.endpoint import Endpoint
+from riffbot.guilds import GuildRegistry, GuildState
+
+_logger = logging.getLogger(__name__)
+
+MAGIC = b"RBQS"
+VERSION = 1
+DEFAULT_INTERVAL = 30.0  # seconds between two checks for changed queues
+POSITION_TOLERANCE = 5.0  # seconds, the saved position of the current song may be off by this much
+
+# File format: a header (magic, version, flags, position of the current song in seconds, number of entries), followed
+# by the entries, each consisting of a fixed-size part (lengths of video ID and title, song length in seconds or 0 if
+# unknown) and the UTF-8 encoded video ID and title. If the "current" flag is set, the first entry is the song that was
+# playing at the saved position. The position is at a fixed offset, so it can be updated without rewriting the file.
+_HEADER = struct.Struct(">4sBBxxdI")
+_ENTRY = struct.Struct(">BHI")
+_POSITION = struct.Struct(">d")
+_POSITION_OFFSET = 8
+_FLAG_CURRENT = 0x01
+_SUFFIX = ".queue"
+
+
+class InvalidSnapshotError(Exception):
+    pass
+
+
+class SnapshotEntry(NamedTuple):
+    video_id: str
+    title: str
+    length: Optional[int]
+
+
+class QueueSnapshot(NamedTuple):
+    entries: List[SnapshotEntry]
+    # Position in the first entry if it was playing, None if no song was playing
+    position: Optional[float] = None
+
+
+def encode_entry(entry: SnapshotEntry) -> bytes:
+    video_id = entry.video_id.encode("ascii")
+    title = entry.title.encode("utf-8")[:0xFFFF]
+    return _ENTRY.pack(len(video_id), len(title), entry.length or 0) + video_id + title
+
+
+def encode_snapshot(entries: List[bytes], position: Optional[float] = None) -> bytes:
+    """Assemble a snapshot from encoded entries (see encode_entry)"""
+    flags = _FLAG_CURRENT if position is not None else 0
+    return b"".join([_HEADER.pack(MAGIC, VERSION, flags, position or 0.0, len(entries)), *entries])
+
+
+def decode_snapshot(data: bytes) -> QueueSnapshot:
+    if len(data) < _HEADER.size:
+        raise InvalidSnapshotError("Snapshot is truncated")
+    magic, version, flags, position, count = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise InvalidSnapshotError(f"Not a queue snapshot of version {VERSION}")
+    entries = []
+    offset = _HEADER.size
+    try:
+        for _ in range(count):
+            id_length, title_length, length = _ENTRY.unpack_from(data, offset)
+            offset += _ENTRY.size
+            video_id = data[offset:offset + id_length].decode("ascii")
+            offset += id_length
+            title = data[offset:offset + title_length].decode("utf-8", errors="replace")
+            offset += title_length
+            if offset > len(data):
+                raise InvalidSnapshotError("Snapshot is truncated")
+            entries.append(SnapshotEntry(video_id, title, length or None))
+    except (struct.error, UnicodeDecodeError) as e:
+        raise InvalidSnapshotError(f"Snapshot is corrupted: {e}")
+    has_current = flags & _FLAG_CURRENT and len(entries) > 0
+    return QueueSnapshot(entries, position if has_current else None)
+
+
+class SnapshotStore:
+    """Stores one snapshot file per guild in a directory. Files are only read when a guild's snapshot is requested, so
+    opening the store is cheap no matter how many guilds have one."""
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._guild_ids: Set[int] = set()
+        for name in os.listdir(directory):
+            stem, suffix = os.path.splitext(name)
+            if suffix == _SUFFIX and stem.isdigit():
+                self._guild_ids.add(int(stem))
+        _logger.debug(f"Found queue snapshots of {len(self._guild_ids)} guilds in {directory}")
+
+    def has(self, guild_id: int) -> bool:
+        return guild_id in self._guild_ids
+
+    def read(self, guild_id: int) -> Optional[QueueSnapshot]:
+        if guild_id not in self._guild_ids:
+            return None
+        try:
+            with open(self._get_path(guild_id), "rb") as file:
+                return decode_snapshot(file.read())
+        except (OSError, InvalidSnapshotError) as e:
+            _logger.warning(f"Unable to read queue snapshot of guild {guild_id}: {e}")
+            return None
+
+    def write(self, guild_id: int, data: bytes):
+        # Write to a temporary file first, so a crash never leaves a partially written snapshot behind
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, self._get_path(guild_id))
+        except OSError:
+            os.unlink(temp_path)
+            raise
+        self._guild_ids.add(guild_id)
+
+    def write_position(self, guild_id: int, position: float):
+        """Update the position of the current song in an existing snapshot"""
+        fd = os.open(self._get_path(guild_id), os.O_WRONLY)
+        try:
+            os.pwrite(fd, _POSITION.pack(position), _POSITION_OFFSET)
+        finally:
+            os.close(fd)
+
+    def remove(self, guild_id: int):
+        self._guild_ids.discard(guild_id)
+        try:
+            os.unlink(self._get_path(guild_id))
+        except FileNotFoundError:
+            pass
+
+    def get_guild_ids(self) -> List[int]:
+        return list(self._guild_ids)
+
+    def _get_path(self, guild_id: int) -> str:
+        return os.path.join(self._directory, f"{guild_id}{_SUFFIX}")
+
+
+class _Written(NamedTuple):
+    version: int
+    current: Optional[Endpoint]
+    position: Optional[float]
+
+
+class SnapshotManager:
+    """Saves the queues of all guilds periodically. A snapshot is only rewritten if its queue or current song changed,
+    otherwise just the position of the current song is updated in place. Every entry is encoded once and remembered
+    for as long as its endpoint exists, so rewriting a long queue mostly means joining bytes. All file accesses happen
+    in an executor."""
+
+    def __init__(self, store: SnapshotStore, guilds: GuildRegistry, *, interval: float = DEFAULT_INTERVAL):
+        self._store = store
+        self._guilds = guilds
+        self._interval = interval
+        # Keyed by state, so the entries of guilds the bot has left go away with their state
+        self._written: "weakref.WeakKeyDictionary[GuildState, _Written]" = weakref.WeakKeyDictionary()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._entries: "weakref.WeakKeyDictionary[Endpoint, bytes]" = weakref.WeakKeyDictionary()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.save_changes()
+
+    async def save_changes(self):
+        loop = asyncio.get_event_loop()
+        for state in self._guilds.list():
+            guild_id = state.get_guild_id()
+            if self._guilds.get(guild_id) is not state:
+                # Left (and possibly discarded) while earlier snapshots were written
+                continue
+            job = self._prepare(state)
+            if job is not None:
+                future = loop.run_in_executor(None, job)
+                self._pending[guild_id] = future
+                try:
+                    await future
+                except OSError as e:
+                    _logger.warning(f"Unable to save queue snapshot of guild {guild_id}: {e}")
+                    self._written.pop(state, None)
+                finally:
+                    if self._pending.get(guild_id) is future:
+                        del self._pending[guild_id]
+
+    async def restore(self, guild_id: int) -> Optional[Tuple[List[Endpoint], Optional[float]]]:
+        """Get the endpoints of a guild's saved queue (its current song first) and the position in the current song.
+        No requests are sent to YouTube, the endpoints are created from the saved metadata."""
+        if not self._store.has(guild_id):
+            return None
+        return await asyncio.get_event_loop().run_in_executor(None, self._read_endpoints, guild_id)
+
+    async def discard(self, guild_id: int):
+        """Remove the snapshot of a guild whose queue was given up on purpose"""
+        pending = self._pending.get(guild_id)
+        if pending is not None:
+            # A write that is already running can't be stopped, so remove the file after it is done
+            await asyncio.wait([pending])
+        for state in [state for state in self._written if state.get_guild_id() == guild_id]:
+            del self._written[state]
+        if self._store.has(guild_id):
+            await asyncio.get_event_loop().run_in_executor(None, self._store.remove, guild_id)
+
+    def _read_endpoints(self, guild_id: int) -> Optional[Tuple[List[Endpoint], Optional[float]]]:
+        # Runs in an executor: creating the first endpoint imports pafy, which would block the event loop for a while
+        snapshot = self._store.read(guild_id)
+        if snapshot is None or len(snapshot.entries) == 0:
+            return None
+        endpoints = [youtube.restore_endpoint(*entry) for entry in snapshot.entries]
+        _logger.debug(f"Restored {len(endpoints)} songs of guild {guild_id}")
+        return endpoints, snapshot.position
+
+    def _prepare(self, state: GuildState) -> Optional[Callable[[], None]]:
+        """Collect what needs to be written for a guild (on the event loop, so the queue can't change meanwhile) and
+        return a job that writes it, or None if the snapshot is up to date"""
+        guild_id = state.get_guild_id()
+        player = state.get_player()
+        song_queue = player.get_queue()
+        current = player.get_current()
+        position = player.get_playtime() if self._encode(current) is not None else None
+        written = self._written.get(state)
+        if written is not None and written.version == song_queue.get_version() and written.current is current:
+            if position is None or written.position is None or abs(position - written.position) < POSITION_TOLERANCE:
+                return None
+            self._written[state] = written._replace(position=position)
+            return functools.partial(self._store.write_position, guild_id, position)
+
+        self._written[state] = _Written(song_queue.get_version(), current, position)
+        endpoints = [current, *song_queue.list()] if position is not None else song_queue.list()
+        entries = [entry for entry in map(self._encode, endpoints) if entry is not None]
+        if len(entries) == 0:
+            return functools.partial(self._store.remove, guild_id)
+        return functools.partial(self._store.write, guild_id, encode_snapshot(entries, position))
+
+    def _encode(self, endpoint: Optional[Endpoint]) -> Optional[bytes]:
+        # Only YouTube songs can be restored from their metadata
+        if not isinstance(endpoint, youtube.YouTubeEndpoint):
+            return None
+        entry = self._entries.get(endpoint)
+        if entry is None:
+            entry = encode_entry(SnapshotEntry(endpoint.get_youtube_id(), endpoint.get_song_description(),
+                                               endpoint.get_length()))
+            self._entries[endpoint] = entry
+        return entry
@@ -1,18 +1,23 @@
-from functools import reduce, wraps
-from logging import Logger
+from functools import wraps
+import logging
 from typing import Any, Awaitable, Callable
 
 from discord.ext.commands import Context
 
+from . import profiling
 
-def log_command(logger: Logger):
+
+def log_command(logger: logging.Logger):
     def decorator(command: Callable[..., Awaitable[None]]):
         @wraps(command)
         async def with_logging(ctx: Context, *args: Any, **kwargs: Any):
-            sanitized_args = map(lambda arg: str(arg), filter(lambda arg: arg is not None, args))
-            kwargs_string = reduce(lambda acc, val: f"{acc} {val[0]}={val[1]}", kwargs.items(), "")[1:]
-            logger.info(f"Received command \"{' '.join([command.__name__, *sanitized_args, kwargs_string]).strip()}\""
-                        f" from {ctx.author.name}")
-            return await command(ctx, *args, **kwargs)
+            def describe() -> str:
+                sanitized_args = [str(arg) for arg in args if arg is not None]
+                kwargs_string = " ".join(f"{key}={value}" for key, value in kwargs.items())
+                return " ".join([command.__name__, *sanitized_args, kwargs_string]).strip()
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"Received command \"{describe()}\" from {ctx.author.name}")
+            return await profiling.run_profiled(command.__name__, command(ctx, *args, **kwargs), describe, logger)
         return with_logging
     return decorator
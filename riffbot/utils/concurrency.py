@@ -0,0 +1,29 @@
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+from typing import Callable, Deque, Generator, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def imap_ordered(function: Callable[[T], R], items: Iterable[T], window: int) -> Generator[R, None, None]:
+    """Like map(), but calls the function for up to window items concurrently in worker threads. Results are yielded
+    in the order of the items, and at most window results are held at any time. Items are only taken from the iterable
+    when a slot in the window becomes free, so they may be generated lazily."""
+    if window < 1:
+        raise ValueError(f"Window must be at least 1 (got {window})")
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=window)
+    pending: Deque[Future] = collections.deque()
+    try:
+        for item in itertools.islice(items, window):
+            pending.append(executor.submit(function, item))
+        while pending:
+            result = pending.popleft().result()
+            # Refill the window before handing out the result, so requests stay in flight while it is being consumed
+            for item in itertools.islice(items, 1):
+                pending.append(executor.submit(function, item))
+            yield result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,9 +1,17 @@
 import logging
 import re
-from typing import List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Generator, List, Optional, Tuple, Union
 
-import pafy
-from youtube_search import YoutubeSearch
+from riffbot.cache.ttlcache import TTLCache
+
+if TYPE_CHECKING:
+    import pafy
+
+_logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_SIZE = 1024  # Number of search queries whose results are remembered
+SEARCH_CACHE_TTL = 3600.0  # seconds
+MAX_PLAYLIST_REDIRECTS = 3  # Number of URL results that are followed to get to the actual playlist
 
 _youtube_video_regex = re.compile(
     "^(https?://)?((www\\.)?youtube\\.com/watch\\?v=|youtu\\.be/)(?P<id>[\\w\\-]{11})([?&]\\S+)?$")
@@ -12,23 +20,56 @@ _youtube_playlist_regex = re.compile(
     "(?P<list>(PL|RD)[\\w\\-]{11,43})([?&]\\S+)?$")
 _position_regex = re.compile("^(?P<hm>\\d\\d?)(:(?P<m>\\d\\d))?(:(?P<s>\\d\\d))$")
 
+# Maps normalized search queries to the ID of the first result
+_search_cache: TTLCache[str, str] = TTLCache("search", SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
 
-def to_youtube_videos(args: List[str]) -> Optional[List[Union[str, pafy.pafy.Pafy]]]:
-    if len(args) == 0:
-        return None
+
+class PlaylistNotFoundError(Exception):
+    pass
+
+
+def to_youtube_playlist_id(args: List[str]) -> Optional[str]:
     if len(args) == 1:
-        # First try playlist match
         match = _youtube_playlist_regex.match(args[0])
         if match:
-            playlist = pafy.get_playlist(match.group("list"))
-            # For some reason unbeknownst to be, pafy.get_playlist attaches a handler to the root logger, causing all
-            # subsequent log calls to be run through this handler in addition to the intended ones (effectively
-            # duplicating all log entries on the console). Thus, we clear all root handlers here.
-            root_logger = logging.getLogger()
-            for root_handler in root_logger.handlers:
-                root_logger.removeHandler(root_handler)
+            return match.group("list")
+    return None
+
+
+def iter_youtube_playlist(playlist_id: str) -> Generator["pafy.pafy.Pafy", None, None]:
+    """Lazily yield the videos of a playlist. The playlist is fetched page by page while it is iterated, and the videos
+    are only populated with the title and length contained in the playlist (no further request per video)."""
+    import pafy
+    import youtube_dl
+
+    options = {"extract_flat": "in_playlist", "quiet": True, "logger": _logger}
+    with youtube_dl.YoutubeDL(options) as ydl:
+        url, ie_key = f"https://www.youtube.com/playlist?list={playlist_id}", None
+        for _ in range(MAX_PLAYLIST_REDIRECTS + 1):
+            try:
+                info = ydl.extract_info(url, download=False, ie_key=ie_key, process=False)
+            except youtube_dl.utils.DownloadError as error:
+                raise PlaylistNotFoundError(str(error))
+            # Some playlists (e.g. mixes) are only a reference to another URL
+            if info.get("_type") not in ("url", "url_transparent"):
+                break
+            url, ie_key = info["url"], info.get("ie_key")
+        if info.get("_type") != "playlist":
+            raise PlaylistNotFoundError(f"Playlist {playlist_id} resolved to {info.get('_type') or 'a video'}")
+        for entry in info.get("entries") or []:
+            video = pafy.new(entry["id"], basic=False)
+            video.populate_from_playlist({"title": entry.get("title"), "length_seconds": entry.get("duration") or 0})
+            yield video
 
-            return list(map(lambda entry: entry["pafy"], playlist["items"]))
+
+def to_youtube_videos(args: List[str]) -> Optional[List[Union[str, "pafy.pafy.Pafy"]]]:
+    if len(args) == 0:
+        return None
+    if len(args) == 1:
+        # First try playlist match
+        playlist_id = to_youtube_playlist_id(args)
+        if playlist_id:
+            return list(iter_youtube_playlist(playlist_id))
 
         # If it's not a playlist, try single video
         match = _youtube_video_regex.match(args[0])
@@ -36,12 +77,27 @@ def to_youtube_videos(args: List[str]) -> Optional[List[Union[str, pafy.pafy.Paf
             return [match.group("id")]
 
     # Multiple arguments, use as search input
-    search_results = YoutubeSearch(" ".join(args), max_results=1).to_dict()
+    video_id = _search_cache.get_or_load(_normalize_query(args), lambda: _search_youtube(" ".join(args)))
+    return [video_id] if video_id is not None else None
+
+
+def get_search_cache() -> TTLCache[str, str]:
+    return _search_cache
+
+
+def _search_youtube(query: str) -> Optional[str]:
+    from youtube_search import YoutubeSearch
+
+    search_results = YoutubeSearch(query, max_results=1).to_dict()
     if len(search_results) > 0:
-        return [search_results[0]["id"]]
+        return search_results[0]["id"]
     return None
 
 
+def _normalize_query(args: List[str]) -> str:
+    return " ".join(" ".join(args).casefold().split())
+
+
 def to_position(arg: str) -> Optional[Tuple[int, int, int]]:
     match = _position_regex.match(arg)
     if match:
@@ -5,8 +5,8 @@ class Duration:
     def __init__(self):
         self.reset()
 
-    def reset(self):
-        self._seconds_until_pause = 0.0
+    def reset(self, seconds: float = 0.0):
+        self._seconds_until_pause = seconds
         self._running = False
 
     def start(self):
@@ -0,0 +1,195 @@
+import contextlib
+import contextvars
+import cProfile
+import heapq
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+from typing import Any, Callable, Coroutine, Dict, Generator, List, Optional, Tuple
+
+from riffbot import metrics
+
+_logger = logging.getLogger(__name__)
+
+SUMMARY_INTERVAL = 600.0  # seconds between two summaries of the slowest commands
+SUMMARY_SIZE = 5  # Number of commands listed in a summary
+PROFILE_SAMPLE_RATE = 0.1  # Fraction of commands that run under cProfile (if a threshold is set)
+PROFILE_LINES = 20  # Number of functions listed for a slow command
+
+_threshold: Optional[float] = None
+_profiler_lock = threading.Lock()
+_profiler_active = False
+_current: "contextvars.ContextVar[Optional[CommandProfile]]" = contextvars.ContextVar("command_profile",
+                                                                                      default=None)
+
+
+def set_profile_threshold(seconds: Optional[float]):
+    """Set the time after which a command counts as slow and is logged with its profile, if it was sampled (None
+    disables profiling)"""
+    global _threshold
+    _threshold = seconds
+
+
+class CommandProfile:
+    """Timings of a single command invocation. The blocked time is the time the command itself kept the event loop busy,
+    the rest of its wall time it was waiting (for Discord, YouTube, executors or other tasks)."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._start = time.perf_counter()
+        self._wall_time = 0.0
+        self._blocked_time = 0.0
+        self._phases: Dict[str, float] = {}
+
+    def add_phase(self, name: str, seconds: float):
+        self._phases[name] = self._phases.get(name, 0.0) + seconds
+
+    def finish(self, blocked_time: float):
+        self._wall_time = time.perf_counter() - self._start
+        self._blocked_time = blocked_time
+
+    def get_name(self) -> str:
+        return self._name
+
+    def get_wall_time(self) -> float:
+        return self._wall_time
+
+    def get_blocked_time(self) -> float:
+        return self._blocked_time
+
+    def get_phases(self) -> Dict[str, float]:
+        return self._phases
+
+    def __str__(self) -> str:
+        phases = "".join(f", {name} {seconds * 1000:.0f} ms" for name, seconds in self._phases.items())
+        return f"{self._wall_time * 1000:.0f} ms ({self._blocked_time * 1000:.1f} ms blocking the event loop{phases})"
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Generator[None, None, None]:
+    """Attribute the time spent in the block to a phase (e.g. "resolve") of the running command"""
+    profile = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.add_phase(name, time.perf_counter() - start)
+
+
+class _BlockingTimer:
+    """Awaits a coroutine and measures how long each of its steps runs before it suspends again. If a profiler is
+    given, it is only enabled during these steps, so other tasks that run while the coroutine waits are not
+    included."""
+
+    def __init__(self, coroutine: Coroutine, profiler: Optional[cProfile.Profile] = None):
+        self._coroutine = coroutine
+        self._profiler = profiler
+        self._busy_time = 0.0
+
+    def get_busy_time(self) -> float:
+        return self._busy_time
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            start = time.perf_counter()
+            if self._profiler is not None:
+                self._profiler.enable()
+            try:
+                if error is not None:
+                    suspended = self._coroutine.throw(error)
+                else:
+                    suspended = self._coroutine.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                if self._profiler is not None:
+                    self._profiler.disable()
+                self._busy_time += time.perf_counter() - start
+            try:
+                value, error = (yield suspended), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class SlowestCommands:
+    """Keeps the slowest commands since the last summary. Their descriptions are only built for commands that make it
+    into the list."""
+
+    def __init__(self, size: int = SUMMARY_SIZE, interval: float = SUMMARY_INTERVAL):
+        self._size = size
+        self._interval = interval
+        self._last_summary = time.monotonic()
+        self._count = 0
+        # Min-heap of (wall time, sequence number, description, profile)
+        self._slowest: List[Tuple[float, int, str, CommandProfile]] = []
+
+    def record(self, profile: CommandProfile, describe: Callable[[], str]):
+        self._count += 1
+        entry = (profile.get_wall_time(), self._count)
+        if len(self._slowest) < self._size:
+            heapq.heappush(self._slowest, (*entry, describe(), profile))
+        elif entry > self._slowest[0][:2]:
+            heapq.heapreplace(self._slowest, (*entry, describe(), profile))
+
+    def get_slowest(self) -> List[Tuple[str, CommandProfile]]:
+        return [(description, profile) for _, _, description, profile in sorted(self._slowest, reverse=True)]
+
+    def is_due(self) -> bool:
+        return time.monotonic() - self._last_summary >= self._interval
+
+    def take_summary(self) -> str:
+        lines = [f"Slowest of {self._count} commands in the last {time.monotonic() - self._last_summary:.0f}s:",
+                 *(f"  \"{description}\": {profile}" for description, profile in self.get_slowest())]
+        self._slowest = []
+        self._count = 0
+        self._last_summary = time.monotonic()
+        return "\n".join(lines)
+
+
+_slowest = SlowestCommands()
+
+
+def get_slowest_commands() -> SlowestCommands:
+    return _slowest
+
+
+async def run_profiled(name: str, coroutine: Coroutine, describe: Callable[[], str], logger: logging.Logger) -> Any:
+    """Run the coroutine of a command and record its timings. describe is called to get the full command (with its
+    arguments) only if it needs to be logged."""
+    global _profiler_active
+    profile = CommandProfile(name)
+    token = _current.set(profile)
+    profiler = None
+    if _threshold is not None and random.random() < PROFILE_SAMPLE_RATE:
+        # cProfile can only profile one command at a time
+        with _profiler_lock:
+            if not _profiler_active:
+                _profiler_active = True
+                profiler = cProfile.Profile()
+    timer = _BlockingTimer(coroutine, profiler)
+    try:
+        return await timer
+    finally:
+        if profiler is not None:
+            _profiler_active = False
+        _current.reset(token)
+        profile.finish(timer.get_busy_time())
+        metrics.command_latency.observe(profile.get_wall_time(), name)
+        if _threshold is not None and profile.get_wall_time() >= _threshold:
+            logger.warning(f"Slow command \"{describe()}\": {profile}{_format_profile(profiler)}")
+        _slowest.record(profile, describe)
+        if _slowest.is_due():
+            logger.info(_slowest.take_summary())
+
+
+def _format_profile(profiler: Optional[cProfile.Profile]) -> str:
+    if profiler is None:
+        return ""
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    return f"\n{output.getvalue()}"
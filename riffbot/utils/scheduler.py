@@ -0,0 +1,126 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+_logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """A job that runs its callback once, timeout seconds after it was last (re)set. Resetting only updates the time,
+    it does not create a task."""
+
+    def __init__(self, scheduler: "DeadlineScheduler", timeout: float, callback: Callable[..., Awaitable[None]],
+                 args: Tuple[Any, ...], kwargs: Any):
+        self._scheduler = scheduler
+        self._timeout = timeout
+        self._callback = callback
+        self._args = args
+        self._kwargs = kwargs
+        self._when: Optional[float] = None  # None if the job is not pending
+        self._queued_when: Optional[float] = None  # Time of the heap entry that belongs to this deadline
+
+    def reset(self, timeout: Optional[float] = None):
+        """Run the job timeout seconds from now (by default the timeout it was created with), even if it has already
+        run or was cancelled"""
+        if timeout is not None:
+            self._timeout = timeout
+        self._scheduler._schedule(self, self._scheduler.get_time() + self._timeout)
+
+    def cancel(self):
+        self._when = None
+
+    def is_pending(self) -> bool:
+        return self._when is not None
+
+    def get_remaining(self) -> Optional[float]:
+        return max(self._when - self._scheduler.get_time(), 0.0) if self._when is not None else None
+
+
+class DeadlineScheduler:
+    """Runs the jobs of many deadlines from a single heap and a single event loop handle, which is armed for the
+    earliest entry. A deadline that is moved later keeps its heap entry, which is only moved once it comes due. Must be
+    used from the event loop's thread."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        # Min-heap of (time, sequence number, deadline), entries of cancelled or moved deadlines are skipped
+        self._heap: List[Tuple[float, int, Deadline]] = []
+        self._sequence = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._handle_when: Optional[float] = None
+        self._fired = 0
+
+    def get_time(self) -> float:
+        return self._clock()
+
+    def create(self, timeout: float, callback: Callable[..., Awaitable[None]], *args: Any, **kwargs: Any) -> Deadline:
+        """Schedule a job that awaits callback(*args, **kwargs) in timeout seconds"""
+        deadline = Deadline(self, timeout, callback, args, kwargs)
+        deadline.reset()
+        return deadline
+
+    def get_pending(self) -> int:
+        return sum(1 for when, _, deadline in self._heap if deadline._queued_when == when and deadline.is_pending())
+
+    def get_fired(self) -> int:
+        return self._fired
+
+    def _schedule(self, deadline: Deadline, when: float):
+        deadline._when = when
+        if deadline._queued_when is not None and deadline._queued_when <= when:
+            # The existing entry comes up first and is moved then
+            return
+        self._push(deadline, when)
+        if self._handle_when is None or when < self._handle_when or self._loop is not asyncio.get_event_loop():
+            self._arm(min(when, self._heap[0][0]))
+
+    def _push(self, deadline: Deadline, when: float):
+        deadline._queued_when = when
+        self._sequence += 1
+        heapq.heappush(self._heap, (when, self._sequence, deadline))
+
+    def _arm(self, when: float):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._loop = asyncio.get_event_loop()
+        self._handle = self._loop.call_later(max(when - self.get_time(), 0.0), self._run_due)
+        self._handle_when = when
+
+    def _run_due(self):
+        self._handle = None
+        self._handle_when = None
+        now = self.get_time()
+        while self._heap and self._heap[0][0] <= now:
+            when, _, deadline = heapq.heappop(self._heap)
+            if deadline._queued_when != when:
+                continue  # Replaced by an earlier entry
+            deadline._queued_when = None
+            if deadline._when is None:
+                continue  # Cancelled
+            if deadline._when > now:
+                self._push(deadline, deadline._when)
+                continue
+            deadline._when = None
+            self._fired += 1
+            asyncio.ensure_future(self._run_job(deadline))
+        if self._heap:
+            self._arm(self._heap[0][0])
+
+    async def _run_job(self, deadline: Deadline):
+        try:
+            await deadline._callback(*deadline._args, **deadline._kwargs)
+        except Exception:
+            _logger.exception("Scheduled job failed")
+
+    def __str__(self) -> str:
+        return f"{self.get_pending()} pending deadlines, {self._fired} fired"
+
+
+_scheduler = DeadlineScheduler()
+
+
+def get_scheduler() -> DeadlineScheduler:
+    return _scheduler
@@ -0,0 +1,99 @@
+import asyncio
+import collections
+import logging
+import time
+from typing import Callable, Deque, Dict, Optional
+
+import discord
+
+_logger = logging.getLogger(__name__)
+
+DEBOUNCE_DELAY = 2.0  # seconds to wait for further changes before a topic is sent
+EDITS_PER_WINDOW = 2  # Discord allows two topic (or name) edits per channel every ten minutes
+RATE_LIMIT_WINDOW = 600.0  # seconds
+
+
+class TopicUpdater:
+    """Updates channel topics without running into Discord's rate limit. Only the latest topic that was requested for
+    a channel is sent, after a short delay and once the channel's rate limit window allows another edit. Requests that
+    arrive while an update is pending are merged into it, and requests for the topic a channel already has are
+    dropped."""
+
+    def __init__(self, *, delay: float = DEBOUNCE_DELAY, edits_per_window: int = EDITS_PER_WINDOW,
+                 window: float = RATE_LIMIT_WINDOW, clock: Callable[[], float] = time.monotonic):
+        self._delay = delay
+        self._edits_per_window = edits_per_window
+        self._window = window
+        self._clock = clock
+        self._desired: Dict[int, Optional[str]] = {}
+        self._current: Dict[int, Optional[str]] = {}
+        self._edits: Dict[int, Deque[float]] = {}
+        self._tasks: Dict[int, asyncio.Future] = {}
+        self._sent = 0
+        self._merged = 0
+        self._dropped = 0
+
+    def set_topic(self, channel: discord.TextChannel, topic: Optional[str]):
+        """Request a new topic for channel (None clears it). Returns right away, the edit is sent in the background."""
+        topic = topic or None
+        self._desired[channel.id] = topic
+        if channel.id in self._tasks:
+            self._merged += 1
+        elif topic == self._get_current(channel):
+            self._dropped += 1
+        else:
+            self._tasks[channel.id] = asyncio.ensure_future(self._update(channel))
+
+    def get_sent(self) -> int:
+        return self._sent
+
+    def get_merged(self) -> int:
+        """Get the number of requests that replaced a pending one"""
+        return self._merged
+
+    def get_dropped(self) -> int:
+        """Get the number of requests that were not sent because the channel had the requested topic already"""
+        return self._dropped
+
+    def __str__(self) -> str:
+        return f"{self._sent} edits sent, {self._merged} merged, {self._dropped} dropped"
+
+    async def _update(self, channel: discord.TextChannel):
+        try:
+            while True:
+                await asyncio.sleep(max(self._delay, self._get_wait(channel.id)))
+                topic = self._desired[channel.id]
+                if topic == self._get_current(channel):
+                    # E.g. a song was paused and resumed before its topic changed
+                    self._dropped += 1
+                    return
+                self._edits.setdefault(channel.id, collections.deque()).append(self._clock())
+                self._current[channel.id] = topic
+                try:
+                    await channel.edit(topic=topic)
+                    self._sent += 1
+                except discord.Forbidden:
+                    _logger.warning("Unable to edit channel topic (missing permission)")
+                except discord.HTTPException as e:
+                    _logger.warning(f"Unable to edit channel topic: {e}")
+                    self._current.pop(channel.id, None)
+                # Topics requested while the edit was sent are handled right here
+                if self._desired[channel.id] == topic:
+                    return
+        finally:
+            del self._tasks[channel.id]
+
+    def _get_current(self, channel: discord.TextChannel) -> Optional[str]:
+        return self._current[channel.id] if channel.id in self._current else channel.topic or None
+
+    def _get_wait(self, channel_id: int) -> float:
+        """Get the time until another edit of the channel is allowed"""
+        edits = self._edits.get(channel_id)
+        if not edits:
+            return 0.0
+        now = self._clock()
+        while edits and edits[0] <= now - self._window:
+            edits.popleft()
+        if len(edits) < self._edits_per_window:
+            return 0.0
+        return edits[0] + self._window - now
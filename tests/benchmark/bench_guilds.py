@@ -0,0 +1,51 @@
+import asyncio
+import gc
+import time
+import tracemalloc
+import unittest
+
+from riffbot.guilds import GuildRegistry
+from tests.helpers import FakeVoiceClient, measure_loop_lag, noop
+
+GUILD_COUNTS = [1, 10, 100, 1000]
+
+
+class BenchmarkGuildRegistry(unittest.TestCase):
+    """Load test showing the memory and event loop cost of every additional guild served by one process"""
+
+    def test_cost_per_guild(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        baseline_lag = await measure_loop_lag()
+        print(f"\nbaseline loop lag: {baseline_lag * 1000:.3f} ms")
+        for count in GUILD_COUNTS:
+            registry = GuildRegistry()
+            gc.collect()
+            tracemalloc.start()
+            before, _ = tracemalloc.get_traced_memory()
+            for guild_id in range(count):
+                registry.create(guild_id, FakeVoiceClient()).start_leave_timer(3600, noop)
+            after, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            # Every command resets the leave timer of its guild, so reset all of them once
+            start = time.perf_counter()
+            for state in registry.list():
+                state.reset_leave_timer()
+            reset_time = time.perf_counter() - start
+
+            lag = await measure_loop_lag()
+            memory_per_guild = (after - before) / count
+            print(f"{count:5d} guilds: {memory_per_guild / 1024:6.2f} KiB/guild, "
+                  f"timer reset {reset_time / count * 1e6:6.2f} µs/guild, "
+                  f"loop lag {lag * 1000:.3f} ms")
+
+            for guild_id in range(count):
+                registry.remove(guild_id)
+            self.assertEqual(registry.size(), 0)
+            self.assertLess(memory_per_guild, 64 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import discord
+
+from riffbot.audio.cpumeter import MeasuredAudioSource
+
+STREAM_COUNTS = [1, 4, 8]
+SECONDS = 10  # Length of the test tone that every stream plays
+
+
+def _opus_available() -> bool:
+    if not discord.opus.is_loaded():
+        try:
+            discord.opus._load_default()
+        except Exception:
+            pass
+    return discord.opus.is_loaded()
+
+
+def _play(source: MeasuredAudioSource):
+    """Read and, if necessary, encode packets every 20 ms like the voice client's thread does"""
+    encoder = None if source.is_opus() else discord.opus.Encoder()
+    next_frame = time.perf_counter()
+    while True:
+        data = source.read()
+        if not data:
+            break
+        if encoder is not None:
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        next_frame += discord.opus.Encoder.FRAME_LENGTH / 1000
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+    source.cleanup()
+
+
+@unittest.skipUnless(shutil.which("ffmpeg") and _opus_available(), "requires ffmpeg and libopus")
+class BenchmarkPlaybackCpu(unittest.TestCase):
+    """Compares the CPU time per concurrent stream of PCM playback (decode and re-encode) and Opus passthrough"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, "tone.webm")
+        subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={SECONDS}",
+                        "-ac", "2", "-ar", "48000", "-c:a", "libopus", cls.path], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_cpu_per_stream(self):
+        print()
+        for count in STREAM_COUNTS:
+            loads = {}
+            for mode in ("pcm", "opus"):
+                sources = [MeasuredAudioSource(self._create_source(mode), mode) for _ in range(count)]
+                threads = [threading.Thread(target=_play, args=(source,)) for source in sources]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                loads[mode] = sum(source.get_usage().get_load() for source in sources) / count
+            print(f"{count:2d} concurrent streams: pcm {loads['pcm'] * 100:5.1f}% of a core per stream, "
+                  f"opus {loads['opus'] * 100:5.1f}% of a core per stream")
+            self.assertGreater(loads["pcm"], 0.0)
+
+    def _create_source(self, mode: str) -> discord.FFmpegAudio:
+        if mode == "opus":
+            return discord.FFmpegOpusAudio(self.path, codec="opus")
+        return discord.FFmpegPCMAudio(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
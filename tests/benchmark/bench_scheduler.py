@@ -0,0 +1,75 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+import unittest
+
+from riffbot.utils.scheduler import DeadlineScheduler
+from tests.helpers import measure_loop_lag, noop
+
+DEADLINE_COUNTS = [100, 1000, 10000]
+RESETS = 10  # Resets per deadline, like commands in a busy channel
+TIMEOUT = 3600.0
+
+
+class _TaskTimer:
+    """The idle timer the guilds used before the scheduler: every reset cancels its task and starts a new one"""
+
+    def __init__(self, timeout: float, callback: Callable[..., Awaitable[None]], *args: Any, **kwargs: Any):
+        self._timeout = timeout
+        self._callback = callback
+        self._args = args
+        self._kwargs = kwargs
+        self._task = asyncio.ensure_future(self._job())
+
+    async def _job(self):
+        await asyncio.sleep(self._timeout)
+        await self._callback(*self._args, **self._kwargs)
+
+    def cancel(self):
+        self._task.cancel()
+
+    def reset_timeout(self):
+        self._task.cancel()
+        self._task = asyncio.ensure_future(self._job())
+
+
+class BenchmarkScheduler(unittest.TestCase):
+    """Compares resetting many idle timers with one task per timer against the central deadline scheduler"""
+
+    def test_reset(self):
+        print()
+        for count in DEADLINE_COUNTS:
+            timer_reset, timer_lag = asyncio.run(self._run_timers(count))
+            deadline_reset, deadline_lag = asyncio.run(self._run_deadlines(count))
+            print(f"{count:5d} timers: reset {timer_reset * 1e6:6.2f} µs with tasks, {deadline_reset * 1e6:6.2f} µs "
+                  f"with the scheduler; loop lag {timer_lag * 1000:.3f} ms / {deadline_lag * 1000:.3f} ms")
+            self.assertLess(deadline_reset, timer_reset)
+
+    async def _run_timers(self, count: int):
+        timers = [_TaskTimer(TIMEOUT, noop) for _ in range(count)]
+        start = time.perf_counter()
+        for _ in range(RESETS):
+            for timer in timers:
+                timer.reset_timeout()
+        reset_time = (time.perf_counter() - start) / (count * RESETS)
+        lag = await measure_loop_lag()
+        for timer in timers:
+            timer.cancel()
+        return reset_time, lag
+
+    async def _run_deadlines(self, count: int):
+        scheduler = DeadlineScheduler()
+        deadlines = [scheduler.create(TIMEOUT, noop) for _ in range(count)]
+        start = time.perf_counter()
+        for _ in range(RESETS):
+            for deadline in deadlines:
+                deadline.reset()
+        reset_time = (time.perf_counter() - start) / (count * RESETS)
+        lag = await measure_loop_lag()
+        for deadline in deadlines:
+            deadline.cancel()
+        return reset_time, lag
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import time
+import unittest
+
+from riffbot.audio.songqueue import SongQueue
+from riffbot.utils import utils
+from tests.helpers import FakeEndpoint
+
+QUEUE_SIZES = [1000, 10000, 100000]
+
+
+def _measure(function, repeat: int = 20) -> float:
+    """Average time of a call to function in microseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+class BenchmarkSongQueue(unittest.TestCase):
+    """Shows how the costs of the queue operations used by the commands scale with the size of the queue"""
+
+    def test_operations(self):
+        print()
+        for size in QUEUE_SIZES:
+            endpoints = [FakeEndpoint(length=180) for _ in range(size)]
+            queue = SongQueue()
+            enqueue = _measure(lambda: queue.enqueue(endpoints), repeat=1)
+            songs = queue.list()
+            results = {
+                "enqueue": enqueue,
+                "insert 25 at front": _measure(lambda: queue.enqueue(endpoints[:25], pos=0)),
+                "total length": _measure(queue.get_total_length),
+                "total length (walk)": _measure(lambda: utils.get_total_length(songs), repeat=3),
+                "first 9": _measure(lambda: queue.list(stop=9)),
+                "remove middle": _measure(lambda: queue.remove(queue.size() // 2)),
+                "move to front": _measure(lambda: queue.move(queue.size() - 1, 0)),
+                "get next": _measure(queue.get_next, repeat=1000),
+                "shuffle": _measure(queue.shuffle, repeat=1),
+            }
+            print(f"{size:6d} songs: " + ", ".join(f"{name} {value:.1f} µs" for name, value in results.items()))
+            self.assertEqual(queue.get_total_length(), queue.size() * 180)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,15 @@
+import unittest
+
+from tests.unit.test_startup import measure_startup
+
+IMPORT_BUDGET = 0.25  # seconds for importing riffbot itself
+RUNS = 5
+
+
+class BenchmarkStartup(unittest.TestCase):
+    """Measures how long importing riffbot takes before the bot can connect (with discord.py etc. already imported)"""
+
+    def test_import_time(self):
+        seconds = min(measure_startup()["seconds"] for _ in range(RUNS))
+        print(f"\nImporting riffbot took {seconds * 1000:.0f} ms (best of {RUNS})")
+        self.assertLess(seconds, IMPORT_BUDGET)
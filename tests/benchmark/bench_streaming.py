@@ -0,0 +1,309 @@
+import asyncio
+import datetime
+import http.server
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+import unittest
+import urllib.parse
+
+from blinker import signal
+import discord
+import requests
+
+from riffbot.audio import cpumeter, player
+from riffbot.audio.player import Player
+from riffbot.audio.readahead import ReadAheadBuffer
+from riffbot.endpoints import httppool
+from riffbot.endpoints.youtube import YouTubeEndpoint
+
+HOST = "rr1---bench.googlevideo.com"
+DOWNLOAD_SIZE = 8388608  # 8 MB
+DOWNLOAD_RUNS = 3
+SONG_SECONDS = 3  # Length of the test tones played through the player
+RESULTS_PATH = os.environ.get("RIFFBOT_BENCHMARK_RESULTS", os.path.join("benchmark-results", "streaming.jsonl"))
+
+
+class Scenario(NamedTuple):
+    name: str
+    latency: float  # seconds before the server answers a request
+    bandwidth: Optional[int] = None  # bytes per second and connection
+    error_rate: float = 0.0  # fraction of requests that fail with 503 or are cut off
+
+
+SCENARIOS = [
+    Scenario("local", 0.0),
+    Scenario("slow", 0.05, 2097152),
+    Scenario("flaky", 0.02, None, 0.1)
+]
+
+
+class _GooglevideoHandler(http.server.BaseHTTPRequestHandler):
+    """Serves files like googlevideo.com: the byte range is part of the URL and answered with 206 and Content-Range"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        data = self.server.files.get(query.get("id", [""])[0])
+        if data is None or "range" not in query:
+            self._send(404, b"")
+            return
+        start, end = map(int, query["range"][0].split("-"))
+        end = min(end, len(data) - 1)
+        scenario = self.server.scenario
+        time.sleep(scenario.latency)
+        if random.random() < scenario.error_rate:
+            if random.random() < 0.5:
+                self._send(503, b"")
+                return
+            # Cut the response off halfway
+            end = start + (end - start) // 2
+        self._send(206, data[start:end + 1], {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+    def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        bandwidth = self.server.scenario.bandwidth
+        piece_size = 16384
+        for offset in range(0, len(body), piece_size):
+            self.wfile.write(body[offset:offset + piece_size])
+            if bandwidth:
+                time.sleep(piece_size / bandwidth)
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+class _LocalAdapter(requests.adapters.HTTPAdapter):
+    """Sends requests for the fake googlevideo host to the local server instead"""
+
+    def __init__(self, port: int):
+        super().__init__()
+        self._port = port
+
+    def send(self, request: requests.PreparedRequest, **kwargs):
+        parts = urllib.parse.urlsplit(request.url)
+        request.url = urllib.parse.urlunsplit(("http", f"127.0.0.1:{self._port}", parts.path, parts.query, ""))
+        return super().send(request, **kwargs)
+
+
+class _FakeStream:
+    def __init__(self, video_id: str, size: int, bit_rate: int, extension: str):
+        self.url = self.url_https = f"https://{HOST}/videoplayback?id={video_id}&itag=140"
+        self.rawbitrate = bit_rate
+        self.extension = extension
+        self.itag = 140
+        self._size = size
+
+    def get_filesize(self) -> int:
+        return self._size
+
+
+class _FakeVideo:
+    def __init__(self, video_id: str, length: int, stream: _FakeStream):
+        self.videoid = video_id
+        self.title = video_id
+        self.length = length
+        self._stream = stream
+
+    def getbestaudio(self, preftype: Optional[str] = None) -> _FakeStream:
+        return self._stream
+
+
+class _FakeVoiceClient:
+    """Plays sources like discord.VoiceClient does: a thread reads a packet every 20 ms and encodes it if it is PCM"""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def play(self, source: discord.AudioSource, *, after=None):
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(source, self._stopped, after), daemon=True)
+        self._thread.start()
+
+    def is_playing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stopped.is_set()
+
+    def is_paused(self) -> bool:
+        return False
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self, source: discord.AudioSource, stopped: threading.Event, after):
+        encoder = None if source.is_opus() or not discord.opus.is_loaded() else discord.opus.Encoder()
+        next_frame = time.perf_counter()
+        while not stopped.is_set():
+            data = source.read()
+            if not data:
+                break
+            if encoder is not None:
+                encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+            next_frame += discord.opus.Encoder.FRAME_LENGTH / 1000
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+        if after is not None:
+            after(None)
+        source.cleanup()
+
+
+def _load_opus():
+    if not discord.opus.is_loaded():
+        try:
+            discord.opus._load_default()
+        except Exception:
+            pass
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _save_results(benchmark: str, results: Dict[str, Dict[str, float]]):
+    """Append the results to the results file and print how they changed since the previous run"""
+    previous = None
+    if os.path.exists(RESULTS_PATH):
+        with open(RESULTS_PATH) as file:
+            runs = [json.loads(line) for line in file if line.strip()]
+        previous = next((run for run in reversed(runs) if run["benchmark"] == benchmark), None)
+    for name, values in results.items():
+        for key, value in values.items():
+            old = previous["results"].get(name, {}).get(key) if previous else None
+            change = f" (previously {old:.2f}, {(value - old) / old * 100:+.1f}%)" if old else ""
+            print(f"{benchmark}/{name} {key}: {value:.2f}{change}")
+    os.makedirs(os.path.dirname(RESULTS_PATH) or ".", exist_ok=True)
+    with open(RESULTS_PATH, "a") as file:
+        file.write(json.dumps({"benchmark": benchmark, "time": datetime.datetime.now().isoformat(timespec="seconds"),
+                               "revision": _git_revision(), "results": results}) + "\n")
+
+
+class BenchmarkStreaming(unittest.TestCase):
+    """End-to-end benchmark of the audio path against a local server that emulates googlevideo.com (latency, limited
+    bandwidth and errors). Results are appended to RESULTS_PATH, so they can be compared over time."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _GooglevideoHandler)
+        cls.server.daemon_threads = True
+        cls.server.files = {}
+        cls.server.scenario = SCENARIOS[0]
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        httppool.get_session().mount(f"https://{HOST}/", _LocalAdapter(cls.server.server_address[1]))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_download(self):
+        """Time to first byte and sustained throughput of YouTubeEndpoint.stream_chunks feeding a read-ahead buffer
+        through the player's downloader thread"""
+        data = os.urandom(DOWNLOAD_SIZE)
+        results = {}
+        for scenario in SCENARIOS:
+            self.server.scenario = scenario
+            first_byte = 0.0
+            throughput = 0.0
+            for run in range(DOWNLOAD_RUNS):
+                video_id = f"download-{scenario.name}-{run}"
+                self.server.files[video_id] = data
+                endpoint = YouTubeEndpoint(_FakeVideo(video_id, 60, _FakeStream(video_id, len(data), 128000, "m4a")))
+                buffer = ReadAheadBuffer()
+                start = time.perf_counter()
+                threading.Thread(target=player._downloader, args=(endpoint, endpoint.stream_chunks(), buffer)).start()
+                received = 0
+                while True:
+                    chunk = buffer.get()
+                    if chunk is None:
+                        break
+                    if received == 0:
+                        first_byte += time.perf_counter() - start
+                    received += len(chunk)
+                elapsed = time.perf_counter() - start
+                self.assertEqual(received, len(data))
+                throughput += received / elapsed
+            results[scenario.name] = {"ttfb_ms": first_byte / DOWNLOAD_RUNS * 1000,
+                                      "throughput_mib_s": throughput / DOWNLOAD_RUNS / 2**20}
+        print()
+        _save_results("download", results)
+
+    @unittest.skipUnless(shutil.which("ffmpeg"), "requires ffmpeg")
+    def test_playback(self):
+        """Time to first audio, gaps between songs and CPU per stream of the player with a fake voice client"""
+        _load_opus()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tone.m4a")
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i",
+                            f"sine=frequency=440:duration={SONG_SECONDS}", "-ac", "2", "-c:a", "aac", "-b:a", "128k",
+                            "-movflags", "+faststart", path], check=True)
+            with open(path, "rb") as file:
+                data = file.read()
+        results = {}
+        for scenario in SCENARIOS:
+            self.server.scenario = scenario
+            for mode in player.PLAYBACK_MODES:
+                player.set_playback_mode(mode)
+                endpoints = []
+                for song in range(3):
+                    video_id = f"play-{scenario.name}-{mode}-{song}"
+                    self.server.files[video_id] = data
+                    endpoints.append(YouTubeEndpoint(_FakeVideo(video_id, SONG_SECONDS,
+                                                                _FakeStream(video_id, len(data), 128000, "m4a"))))
+                before = cpumeter.get_stats().get_usage(mode) or cpumeter.CpuUsage(0.0, 0.0, 0.0)
+                ttfa, gaps = asyncio.run(self._play(endpoints))
+                after = cpumeter.get_stats().get_usage(mode)
+                wall = after.get_wall_time() - before.get_wall_time()
+                cpu = (after.get_ffmpeg_time() + after.get_thread_time() - before.get_ffmpeg_time()
+                       - before.get_thread_time())
+                results[f"{scenario.name}-{mode}"] = {"ttfa_ms": ttfa * 1000,
+                                                      "gap_ms": sum(gaps) / len(gaps) * 1000 if gaps else 0.0,
+                                                      "cpu_percent": cpu / wall * 100 if wall > 0 else 0.0}
+        player.set_playback_mode("pcm")
+        print()
+        _save_results("playback", results)
+
+    async def _play(self, endpoints: List[YouTubeEndpoint]):
+        """Play the endpoints one after the other. Returns the time to first audio and the gaps between songs."""
+        voice_client = _FakeVoiceClient()
+        song_player = Player(voice_client)
+        done = asyncio.Event()
+        audio_starts: List[float] = []
+        song_stops: List[float] = []
+
+        def on_audio_start(sender: Player):
+            audio_starts.append(time.perf_counter())
+
+        def on_song_stop(sender: Player, is_last: bool):
+            song_stops.append(time.perf_counter())
+            if is_last:
+                done.set()
+
+        signal("player_audio_start").connect(on_audio_start, sender=song_player)
+        signal("player_song_stop").connect(on_song_stop, sender=song_player)
+        song_player.get_queue().enqueue(endpoints)
+        start = time.perf_counter()
+        song_player.play()
+        await asyncio.wait_for(done.wait(), timeout=SONG_SECONDS * len(endpoints) * 10)
+        signal("player_audio_start").disconnect(on_audio_start, sender=song_player)
+        signal("player_song_stop").disconnect(on_song_stop, sender=song_player)
+        self.assertEqual(len(audio_starts), len(endpoints))
+        gaps = [audio_start - song_stop for song_stop, audio_start in zip(song_stops, audio_starts[1:])]
+        return audio_starts[0] - start, gaps
+
+
+if __name__ == "__main__":
+    unittest.main()
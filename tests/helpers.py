@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from riffbot.endpoints.endpoint import Endpoint
+
+
+class FakeEndpoint(Endpoint):
+    """Streams the given chunks without any network access, records which threads asked for its codec"""
+
+    def __init__(self, name: str = "song", *, length: Optional[int] = 10, chunks: Iterable[bytes] = (b"",),
+                 bit_rate: Optional[int] = None):
+        self.name = name
+        self.length = length
+        self.chunks = list(chunks)
+        self.bit_rate = bit_rate
+        self.streams = 0
+        self.closed = False
+        self.codec_threads: List[threading.Thread] = []
+
+    def initialize(self):
+        pass
+
+    def is_initialized(self):
+        return True
+
+    def stream_chunks(self):
+        self.streams += 1
+        try:
+            yield from self.chunks
+        finally:
+            self.closed = True
+
+    def seek(self, position):
+        return position
+
+    def get_song_description(self):
+        return self.name
+
+    def get_bit_rate(self):
+        return self.bit_rate
+
+    def get_codec(self):
+        self.codec_threads.append(threading.current_thread())
+        return "opus"
+
+    def get_length(self):
+        return self.length
+
+
+class FakeVoiceClient:
+    """Plays nothing, but calls the after callback from another thread when stopped, like discord.VoiceClient"""
+
+    def __init__(self):
+        self.source = None
+        self.after = None
+        self.paused = False
+        self.plays = 0
+
+    def play(self, source, *, after=None):
+        self.source, self.after, self.paused = source, after, False
+        self.plays += 1
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        after, self.source, self.after = self.after, None, None
+        if after is not None:
+            threading.Thread(target=after, args=(None,)).start()
+
+
+def names(endpoints: Iterable[Endpoint]) -> List[str]:
+    return [endpoint.get_song_description() for endpoint in endpoints]
+
+
+async def noop():
+    pass
+
+
+async def measure_loop_lag(samples: int = 50, interval: float = 0.002) -> float:
+    """Average delay (in seconds) with which the event loop wakes up a sleeping coroutine"""
+    lag = 0.0
+    for _ in range(samples):
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag += time.perf_counter() - start - interval
+    return lag / samples
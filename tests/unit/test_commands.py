@@ -0,0 +1,47 @@
+import asyncio
+import functools
+import threading
+import unittest
+from unittest.mock import patch
+
+from i18n import t
+
+from riffbot import bot
+from riffbot.endpoints import resolver
+
+
+class FakeGuild:
+    id = 1
+    preferred_locale = "en_US"
+
+
+class FakeAuthor:
+    name = "user"
+
+
+class FakeContext:
+    def __init__(self):
+        self.guild = FakeGuild()
+        self.author = FakeAuthor()
+        self.channel = None
+        self.voice_client = None
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+
+    async def trigger_typing(self):
+        pass
+
+
+class TestPlay(unittest.TestCase):
+    def test_replies_when_resolving_times_out(self):
+        released = threading.Event()
+        # A running job cannot be interrupted, let it finish so the pool is free for other tests
+        self.addCleanup(released.set)
+        ctx = FakeContext()
+        with patch.object(resolver, "_resolve_youtube", lambda args: released.wait(5)), \
+                patch.object(resolver, "resolve_youtube", functools.partial(resolver.resolve_youtube, timeout=0.05)):
+            with self.assertLogs(resolver._logger, "WARNING"):
+                asyncio.run(asyncio.wait_for(bot.play.callback(ctx, "some", "song"), 1))
+        self.assertEqual(ctx.sent, [t("commands.play_timeout", locale="en_US")])
@@ -0,0 +1,81 @@
+import struct
+import unittest
+
+from riffbot.endpoints.containers import IncompleteIndexError, parse_mp4_index, parse_webm_index
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def sidx(timescale, earliest_time, first_offset, references):
+    payload = struct.pack(">B3xIIIIHH", 0, 1, timescale, earliest_time, first_offset, 0, len(references))
+    for size, duration in references:
+        payload += struct.pack(">III", size, duration, 0x90000000)
+    return box(b"sidx", payload)
+
+
+def element(element_id, payload, unknown_size=False):
+    size = b"\x01\xff\xff\xff\xff\xff\xff\xff" if unknown_size else b"\x01" + len(payload).to_bytes(7, "big")
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + size + payload
+
+
+def cue_point(time, cluster_position):
+    return element(0xBB, element(0xB3, time.to_bytes(2, "big"))
+                   + element(0xB7, element(0xF7, b"\x01") + element(0xF1, cluster_position.to_bytes(4, "big"))))
+
+
+class TestMp4Index(unittest.TestCase):
+    def setUp(self):
+        self.header = box(b"ftyp", b"dash" + b"\0" * 12) + box(b"moov", b"\0" * 100)
+        # Three segments of 10 seconds each at a timescale of 44100
+        self.index = sidx(44100, 0, 0, [(1000, 441000), (2000, 441000), (1500, 441000)])
+        self.data = self.header + self.index
+
+    def test_lookup(self):
+        index = parse_mp4_index(self.data)
+        media_start = len(self.header) + len(self.index)
+        self.assertEqual(index.get_header(), self.header)
+        self.assertEqual(index.lookup(0), (0.0, media_start))
+        self.assertEqual(index.lookup(9.9), (0.0, media_start))
+        self.assertEqual(index.lookup(10), (10.0, media_start + 1000))
+        self.assertEqual(index.lookup(25), (20.0, media_start + 3000))
+        self.assertEqual(index.lookup(100), (20.0, media_start + 3000))
+
+    def test_incomplete_data(self):
+        with self.assertRaises(IncompleteIndexError) as context:
+            parse_mp4_index(self.data[:len(self.header) + 20])
+        self.assertEqual(context.exception.required_size, len(self.data))
+
+    def test_no_index(self):
+        self.assertIsNone(parse_mp4_index(self.header + box(b"mdat", b"\0" * 100)))
+
+
+class TestWebmIndex(unittest.TestCase):
+    def setUp(self):
+        info = element(0x1549A966, element(0x2AD7B1, (1000000).to_bytes(3, "big")))
+        tracks = element(0x1654AE6B, b"\0" * 50)
+        # Cues in milliseconds, cluster positions relative to the segment data
+        cues = element(0x1C53BB6B, cue_point(0, 100) + cue_point(10000, 1100) + cue_point(20000, 3100))
+        ebml = element(0x1A45DFA3, b"\0" * 20)
+        segment = element(0x18538067, b"", unknown_size=True)
+        self.segment_start = len(ebml) + len(segment)
+        self.header = ebml + segment + info + tracks + cues
+        self.data = self.header + element(0x1F43B675, b"\0" * 30)
+
+    def test_lookup(self):
+        index = parse_webm_index(self.data)
+        self.assertEqual(index.get_header(), self.header)
+        self.assertEqual(index.lookup(5), (0.0, self.segment_start + 100))
+        self.assertEqual(index.lookup(10), (10.0, self.segment_start + 1100))
+        self.assertEqual(index.lookup(100), (20.0, self.segment_start + 3100))
+
+    def test_incomplete_data(self):
+        with self.assertRaises(IncompleteIndexError) as context:
+            parse_webm_index(self.data[:len(self.header) - 10])
+        self.assertEqual(context.exception.required_size, len(self.header))
+
+    def test_no_cues(self):
+        data = element(0x1A45DFA3, b"\0" * 20) + element(0x18538067, b"", unknown_size=True) + element(
+            0x1F43B675, b"\0" * 30)
+        self.assertIsNone(parse_webm_index(data))
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from riffbot.cache.diskcache import DiskCache, read_chunks
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.directory.name, 300)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def put(self, key, data, cache=None):
+        writer = (cache or self.cache).open_writer(key)
+        writer.write(data)
+        writer.commit()
+
+    def test_write_and_read(self):
+        self.assertIsNone(self.cache.get_path("a"))
+        self.put("a", b"x" * 100)
+        self.assertEqual(b"".join(read_chunks(self.cache.get_path("a"), 16)), b"x" * 100)
+        self.assertEqual(self.cache.get_hits(), 1)
+        self.assertEqual(self.cache.get_misses(), 1)
+
+    def test_aborted_write_leaves_nothing(self):
+        writer = self.cache.open_writer("a")
+        writer.write(b"x" * 100)
+        self.assertFalse(self.cache.contains("a"))
+        writer.abort()
+        self.assertFalse(self.cache.contains("a"))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_lru_eviction(self):
+        self.put("a", b"a" * 100)
+        self.put("b", b"b" * 100)
+        self.put("c", b"c" * 100)
+        self.cache.get_path("a")
+        self.put("d", b"d" * 100)
+        self.assertTrue(self.cache.contains("a"))
+        self.assertFalse(self.cache.contains("b"))
+        self.assertEqual(self.cache.get_evictions(), 1)
+        self.assertEqual(self.cache.get_size(), 300)
+        self.assertEqual((self.cache.get_hits(), self.cache.get_misses()), (1, 0))
+        self.assertTrue(str(self.cache).startswith("1 hits, 0 misses (hit ratio 1.00), 1 evicted, 3 entries"))
+
+    def test_entries_too_large_for_the_budget_are_not_stored(self):
+        self.put("a", b"a" * 400)
+        self.assertFalse(self.cache.contains("a"))
+        self.assertEqual(self.cache.get_size(), 0)
+
+    def test_entries_persist(self):
+        self.put("a", b"a" * 100)
+        self.put("b", b"b" * 100)
+        cache = DiskCache(self.directory.name, 300)
+        self.assertEqual(cache.get_size(), 200)
+        self.assertTrue(cache.contains("a"))
+        self.assertTrue(cache.contains("b"))
@@ -0,0 +1,39 @@
+import functools
+import gc
+import unittest
+import weakref
+
+from blinker import signal
+
+from riffbot.guilds import GuildRegistry
+from tests.helpers import FakeVoiceClient
+
+
+def _on_song_start(state, sender, song):
+    pass
+
+
+class TestGuildState(unittest.TestCase):
+    def test_close_disconnects_player_signals(self):
+        registry = GuildRegistry()
+        state = registry.create(1, FakeVoiceClient())
+        player = state.get_player()
+        received = []
+        state.connect_player_signal("player_song_stop", lambda sender, is_last: received.append(is_last))
+        signal("player_song_stop").send(player, is_last=True)
+        self.assertEqual(received, [True])
+
+        registry.remove(1)
+        signal("player_song_stop").send(player, is_last=False)
+        self.assertEqual(received, [True])
+
+    def test_closed_state_is_collected(self):
+        registry = GuildRegistry()
+        state = registry.create(1, FakeVoiceClient())
+        # The receiver references the state, like the handlers of the bot reference their context
+        state.connect_player_signal("player_song_start", functools.partial(_on_song_start, state))
+        reference = weakref.ref(state)
+        registry.remove(1)
+        del state
+        gc.collect()
+        self.assertIsNone(reference())
@@ -0,0 +1,65 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import requests
+
+from riffbot.endpoints import httppool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"hello"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HangingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(1)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpPool(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        stats = httppool.get_stats()
+        requests_before, connections_before = stats.get_requests(), stats.get_connections()
+        session = httppool.get_session()
+        self.assertIs(session, httppool.get_session())
+        for _ in range(10):
+            self.assertEqual(session.get(self.url).content, b"hello")
+        self.assertEqual(stats.get_requests() - requests_before, 10)
+        self.assertEqual(stats.get_connections() - connections_before, 1)
+        self.assertGreater(stats.get_handshakes_avoided(), 0)
+
+    def test_requests_time_out_by_default(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), HangingHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with patch("riffbot.endpoints.httppool.REQUEST_TIMEOUT", 0.1):
+                with self.assertRaises(requests.Timeout):
+                    httppool.get_session().get(f"http://127.0.0.1:{server.server_address[1]}/")
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,101 @@
+import tempfile
+import time
+import unittest
+import urllib.request
+
+from blinker import signal
+
+from riffbot import metrics
+from riffbot.cache.diskcache import DiskCache
+from riffbot.metrics import MetricsRegistry
+
+
+class FakePlayer:
+    def get_buffer(self):
+        return None
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter("songs_total", "Songs", ["guild"])
+        gauge = self.registry.gauge("threads", "Threads")
+        counter.inc("1")
+        counter.inc("1", amount=2)
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        lines = self.registry.render().splitlines()
+        self.assertIn("# TYPE songs_total counter", lines)
+        self.assertIn("songs_total{guild=\"1\"} 3", lines)
+        self.assertIn("threads 1", lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency", buckets=[0.1, 1.0])
+        for value in [0.05, 0.5, 0.5, 5.0]:
+            histogram.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertIn("latency_seconds_bucket{le=\"0.1\"} 1", lines)
+        self.assertIn("latency_seconds_bucket{le=\"1\"} 3", lines)
+        self.assertIn("latency_seconds_bucket{le=\"+Inf\"} 4", lines)
+        self.assertIn("latency_seconds_count 4", lines)
+        self.assertIn("latency_seconds_sum 6.05", lines)
+
+    def test_callback(self):
+        self.registry.callback("queue_depth", "Queue depth", lambda: {("1",): 5, ("2",): 0}, ["guild"])
+        lines = self.registry.render().splitlines()
+        self.assertIn("queue_depth{guild=\"1\"} 5", lines)
+        self.assertIn("queue_depth{guild=\"2\"} 0", lines)
+
+    def test_duplicate_name(self):
+        self.registry.counter("a", "A")
+        with self.assertRaises(ValueError):
+            self.registry.gauge("a", "A")
+
+
+class TestPlaybackMetrics(unittest.TestCase):
+    def test_time_to_first_audio_and_gap(self):
+        player = FakePlayer()
+        ttfa_count = metrics.time_to_first_audio.get_count("play")
+        gap_count = metrics.inter_song_gap.get_count()
+        metrics.expect_first_audio(player, "play", time.perf_counter() - 0.5)
+        signal("player_audio_start").send(player)
+        self.assertEqual(metrics.time_to_first_audio.get_count("play"), ttfa_count + 1)
+        self.assertGreaterEqual(metrics.time_to_first_audio.get_sum("play"), 0.5)
+
+        # The next song of the queue starts without a command
+        signal("player_song_stop").send(player, is_last=False)
+        signal("player_audio_start").send(player)
+        self.assertEqual(metrics.inter_song_gap.get_count(), gap_count + 1)
+
+        # Nothing was waiting for the last song
+        signal("player_song_stop").send(player, is_last=True)
+        signal("player_audio_start").send(player)
+        self.assertEqual(metrics.inter_song_gap.get_count(), gap_count + 1)
+
+
+class TestCacheMetrics(unittest.TestCase):
+    def test_disk_caches(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory, 100)
+            cache.get_path("missing")
+            metrics.register_disk_caches({"audio": cache})
+            lines = metrics.get_registry().render().splitlines()
+        self.assertIn("riffbot_disk_cache_hits_total{cache=\"audio\"} 0", lines)
+        self.assertIn("riffbot_disk_cache_misses_total{cache=\"audio\"} 1", lines)
+        self.assertIn("riffbot_disk_cache_evictions_total{cache=\"audio\"} 0", lines)
+
+
+class TestMetricsServer(unittest.TestCase):
+    def test_serves_metrics(self):
+        server = metrics.start_server("127.0.0.1", 0)
+        try:
+            port = server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn("riffbot_command_latency_seconds", response.read().decode())
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+
+from riffbot.audio.opusframes import OpusFrameSource, OpusFrameWriter, RecordingAudioSource
+from riffbot.cache.diskcache import DiskCache
+
+
+class FakeOpusSource:
+    def __init__(self, packets):
+        self.packets = list(packets)
+        self.cleaned_up = False
+
+    def read(self):
+        return self.packets.pop(0) if self.packets else b""
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class TestOpusFrames(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.directory.name, 1000000)
+        # 100 packets of varying size, 2 seconds in total
+        self.packets = [bytes([i]) * (i % 7 + 1) for i in range(100)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, packets, expected_length=None):
+        source = RecordingAudioSource(FakeOpusSource(packets), OpusFrameWriter(self.cache.open_writer("song")),
+                                      expected_length=expected_length)
+        read = []
+        while True:
+            data = source.read()
+            if not data:
+                break
+            read.append(data)
+        source.cleanup()
+        return read
+
+    def read_all(self, source):
+        packets = []
+        while True:
+            data = source.read()
+            if not data:
+                break
+            packets.append(data)
+        return packets
+
+    def test_record_and_play(self):
+        self.assertEqual(self.record(self.packets), self.packets)
+        source = OpusFrameSource(self.cache.get_path("song"))
+        self.assertTrue(source.is_opus())
+        self.assertEqual(self.read_all(source), self.packets)
+        source.cleanup()
+        self.assertEqual(source.read(), b"")
+
+    def test_seek(self):
+        self.record(self.packets)
+        source = OpusFrameSource(self.cache.get_path("song"), start=1.01)
+        self.assertEqual(self.read_all(source), self.packets[50:])
+        self.assertEqual(source.seek(0.5), 0.5)
+        self.assertEqual(source.read(), self.packets[25])
+        self.assertEqual(source.seek(10), 2.0)
+        self.assertEqual(source.read(), b"")
+        source.cleanup()
+
+    def test_interrupted_recording_is_discarded(self):
+        source = RecordingAudioSource(FakeOpusSource(self.packets), OpusFrameWriter(self.cache.open_writer("song")))
+        source.read()
+        source.cleanup()
+        self.assertFalse(self.cache.contains("song"))
+
+    def test_incomplete_recording_is_discarded(self):
+        self.record(self.packets, expected_length=10)
+        self.assertFalse(self.cache.contains("song"))
+        self.record(self.packets, expected_length=3)
+        self.assertTrue(self.cache.contains("song"))
@@ -1,12 +1,107 @@
+import asyncio
+from concurrent.futures import Future
+import threading
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import patch
 
-from audio import player
-from audio.endpoints import youtube as yt
+from riffbot import metrics
+from riffbot.audio import player
+from tests.helpers import FakeEndpoint, FakeVoiceClient
+
+
+class TestOpenAudioSource(unittest.TestCase):
+    def tearDown(self):
+        player.set_playback_mode("pcm")
+
+    def test_codec_is_resolved_off_the_calling_thread(self):
+        player.set_playback_mode("opus")
+        endpoint = FakeEndpoint()
+        processes = metrics.ffmpeg_processes.get()
+        audio_source, buffer, release = player._open_audio_source(endpoint, None, None)
+        try:
+            # ffmpeg is only started by the voice client's first read
+            self.assertTrue(audio_source.is_opus())
+            self.assertEqual(metrics.ffmpeg_processes.get(), processes)
+            self.assertEqual(audio_source._source._codec.result(timeout=1), "opus")
+            self.assertEqual(len(endpoint.codec_threads), 1)
+            self.assertIsNot(endpoint.codec_threads[0], threading.current_thread())
+        finally:
+            audio_source.cleanup()
+            release()
+        self.assertEqual(metrics.ffmpeg_processes.get(), processes)
+
+
+class FakeFFmpegOpusAudio:
+    def __init__(self, source, *, pipe, codec):
+        self.cleaned_up = False
+
+    def read(self):
+        return b"frame"
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class TestDeferredOpusAudio(unittest.TestCase):
+    @patch("discord.FFmpegOpusAudio", FakeFFmpegOpusAudio)
+    def test_process_is_counted_from_the_first_read(self):
+        codec = Future()
+        codec.set_result("opus")
+        source = player._DeferredOpusAudio(0, codec)
+        processes = metrics.ffmpeg_processes.get()
+        self.assertEqual(source.read(), b"frame")
+        self.assertEqual(source.read(), b"frame")
+        self.assertEqual(metrics.ffmpeg_processes.get(), processes + 1)
+        ffmpeg = source._source
+        source.cleanup()
+        source.cleanup()
+        self.assertTrue(ffmpeg.cleaned_up)
+        self.assertEqual(metrics.ffmpeg_processes.get(), processes)
 
 
 class TestPlayer(unittest.TestCase):
     def setUp(self):
-        endpoint = yt.YouTubeEndpoint("https://www.youtube.com/watch?v=pm105KodBsg")
-        voice_client = MagicMock()
-        self.player = player.Player(endpoint, voice_client)
+        # Opus mode only starts ffmpeg once the voice client reads from the source
+        player.set_playback_mode("opus")
+        self.voice_client = FakeVoiceClient()
+        self.player = player.Player(self.voice_client, prefetch_seconds=0)
+
+    def tearDown(self):
+        player.set_playback_mode("pcm")
+
+    def _run(self, test):
+        async def run():
+            self.player.get_queue().enqueue(FakeEndpoint())
+            self.player.play()
+            try:
+                await test()
+            finally:
+                # Wait for the song to be over while the event loop is still running
+                self.player.stop()
+                await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+
+    async def _seek(self, position):
+        plays = self.voice_client.plays
+        await self.player.seek(position)
+        while self.voice_client.plays == plays:
+            await asyncio.sleep(0.01)
+
+    def test_seek_while_playing(self):
+        async def test():
+            await self._seek(5.0)
+            self.assertTrue(self.player.is_playing())
+            self.assertGreaterEqual(self.player.get_playtime(), 5.0)
+
+        self._run(test)
+
+    def test_seek_while_paused(self):
+        async def test():
+            self.player.pause()
+            await self._seek(5.0)
+            self.assertTrue(self.player.is_paused())
+            self.assertFalse(self.player.is_playing())
+            self.assertEqual(self.player.get_playtime(), 5.0)
+
+        self._run(test)
@@ -0,0 +1,21 @@
+import unittest
+
+from riffbot.audio.prefetcher import PrefetchedStream
+from tests.helpers import FakeEndpoint
+
+
+class TestPrefetchedStream(unittest.TestCase):
+    def test_take_yields_whole_stream_in_order(self):
+        chunks = [bytes([i]) * 1000 for i in range(100)]
+        endpoint = FakeEndpoint(chunks=chunks, bit_rate=8000)  # 1 second = 1000 bytes
+        prefetched = PrefetchedStream(endpoint, 5)
+        self.assertEqual(list(prefetched.take()), chunks)
+        self.assertEqual(endpoint.streams, 1)
+
+    def test_discard_closes_stream(self):
+        endpoint = FakeEndpoint(chunks=[b"x" * 1000] * 100, bit_rate=8000)
+        prefetched = PrefetchedStream(endpoint, 5)
+        prefetched._thread.join()
+        self.assertFalse(endpoint.closed)
+        prefetched.discard()
+        self.assertTrue(endpoint.closed)
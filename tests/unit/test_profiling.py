@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+import unittest
+from unittest.mock import patch
+
+from riffbot.utils import profiling
+from riffbot.utils.profiling import CommandProfile, SlowestCommands
+
+_logger = logging.getLogger(__name__)
+
+
+async def _command(busy: float, wait: float):
+    with profiling.phase("resolve"):
+        await asyncio.sleep(wait)
+    with profiling.phase("enqueue"):
+        # Blocks the event loop
+        time.sleep(busy)
+    return "done"
+
+
+class TestRunProfiled(unittest.TestCase):
+    def tearDown(self):
+        profiling.set_profile_threshold(None)
+
+    def test_blocked_time_and_phases(self):
+        calls = []
+        result = asyncio.run(profiling.run_profiled("play", _command(0.05, 0.1), lambda: calls.append(1) or "play",
+                                                    _logger))
+        self.assertEqual(result, "done")
+        self.assertEqual(calls, [1])  # Only described for the list of slowest commands
+        _, profile = profiling.get_slowest_commands().get_slowest()[0]
+        self.assertGreaterEqual(profile.get_wall_time(), 0.15)
+        self.assertGreaterEqual(profile.get_blocked_time(), 0.05)
+        self.assertLess(profile.get_blocked_time(), 0.1)
+        self.assertGreaterEqual(profile.get_phases()["resolve"], 0.1)
+        self.assertGreaterEqual(profile.get_phases()["enqueue"], 0.05)
+
+    def test_slow_command_is_logged(self):
+        profiling.set_profile_threshold(0.01)
+        with self.assertLogs(_logger, logging.WARNING) as logs:
+            asyncio.run(profiling.run_profiled("play", _command(0.02, 0.0), lambda: "play something", _logger))
+        self.assertIn("Slow command \"play something\"", logs.output[0])
+
+    def test_profile_excludes_other_tasks(self):
+        def other_guild_work():
+            time.sleep(0.02)
+
+        async def other_guild():
+            other_guild_work()
+
+        async def command():
+            other = asyncio.ensure_future(other_guild())
+            await asyncio.sleep(0.05)
+            await other
+
+        profiling.set_profile_threshold(0.0)
+        with patch("riffbot.utils.profiling.PROFILE_SAMPLE_RATE", 1.0):
+            with self.assertLogs(_logger, logging.WARNING) as logs:
+                asyncio.run(profiling.run_profiled("play", command(), lambda: "play", _logger))
+        self.assertIn("command", logs.output[0])
+        self.assertNotIn("other_guild_work", logs.output[0])
+
+    def test_exceptions_are_passed_on(self):
+        async def failing():
+            await asyncio.sleep(0)
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(profiling.run_profiled("play", failing(), lambda: "play", _logger))
+
+
+class TestSlowestCommands(unittest.TestCase):
+    def test_keeps_slowest(self):
+        slowest = SlowestCommands(size=2)
+        for name, seconds in [("a", 3.0), ("b", 1.0), ("c", 5.0), ("d", 2.0)]:
+            profile = CommandProfile(name)
+            profile.finish(0.0)
+            profile._wall_time = seconds
+            slowest.record(profile, lambda: name)
+        self.assertEqual([description for description, _ in slowest.get_slowest()], ["c", "a"])
+        self.assertIn("Slowest of 4 commands", slowest.take_summary())
+        self.assertEqual(slowest.get_slowest(), [])
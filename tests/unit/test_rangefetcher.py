@@ -0,0 +1,185 @@
+import random
+import re
+import threading
+import time
+import unittest
+
+import requests
+
+from riffbot.endpoints import rangefetcher
+from riffbot.endpoints.rangefetcher import DownloadStats, RangeFetcher
+
+_range_regex = re.compile("&range=(?P<start>\\d+)-(?P<end>\\d+)$")
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+    def __init__(self, data, latency=0.005):
+        self.data = data
+        self.latency = latency
+        self.sizes = []
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        if "expired" in url:
+            return FakeResponse(b"", 403)
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # Random latency, so responses arrive out of order
+        time.sleep(random.uniform(0, self.latency))
+        match = _range_regex.search(url)
+        start, end = int(match.group("start")), int(match.group("end"))
+        with self._lock:
+            self.in_flight -= 1
+            self.sizes.append(end - start + 1)
+        return FakeResponse(self.data[start:end + 1])
+
+
+class FlakySession:
+    """Answers with the given failures first, then correctly. With truncate, every first response to a range only
+    contains half of it."""
+
+    def __init__(self, data, failures, truncate=False):
+        self.data = data
+        self.failures = list(failures)
+        self.truncate = truncate
+        self.urls = []
+        self._truncated = set()
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        match = _range_regex.search(url)
+        start, end = int(match.group("start")), int(match.group("end"))
+        with self._lock:
+            self.urls.append(match.group(0))
+            failure = self.failures.pop(0) if self.failures else None
+            truncate = self.truncate and end not in self._truncated and end > start
+            self._truncated.add(end)
+        if isinstance(failure, Exception):
+            raise failure
+        if failure is not None:
+            return failure
+        if truncate:
+            end = start + (end - start + 1) // 2 - 1
+        return FakeResponse(self.data[start:end + 1])
+
+
+class TestRangeFetcher(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(random.getrandbits(8) for _ in range(100000))
+        self.session = FakeSession(self.data)
+
+    def test_chunks_in_order(self):
+        fetcher = RangeFetcher(self.session, "https://example.com/?a=b", "&range={}-{}", len(self.data),
+                               window=4, min_chunk_size=1000, max_chunk_size=1000)
+        self.assertEqual(b"".join(fetcher.stream_chunks()), self.data)
+        self.assertEqual(self.session.requests, 100)
+        self.assertLessEqual(self.session.max_in_flight, 4)
+        self.assertEqual(fetcher.get_stats().get_requests(), 100)
+        self.assertEqual(fetcher.get_stats().get_bytes_per_request(), 1000)
+
+    def test_single_request_window(self):
+        fetcher = RangeFetcher(self.session, "https://example.com/?a=b", "&range={}-{}", len(self.data),
+                               window=1, min_chunk_size=30000, max_chunk_size=30000)
+        self.assertEqual(b"".join(fetcher.stream_chunks()), self.data)
+        self.assertEqual(self.session.max_in_flight, 1)
+
+    def test_chunk_size_grows_on_fast_responses(self):
+        fetcher = RangeFetcher(self.session, "https://example.com/?a=b", "&range={}-{}", len(self.data),
+                               window=1, min_chunk_size=1000, max_chunk_size=16000)
+        self.assertEqual(b"".join(fetcher.stream_chunks()), self.data)
+        self.assertEqual(self.session.sizes[:5], [1000, 2000, 4000, 8000, 16000])
+        self.assertLess(fetcher.get_stats().get_requests(), 100)
+
+    def test_chunk_size_shrinks_on_slow_responses(self):
+        session = FakeSession(self.data, latency=0)
+        original_target = rangefetcher.TARGET_REQUEST_TIME
+        rangefetcher.TARGET_REQUEST_TIME = -1.0  # Every request counts as slow
+        try:
+            fetcher = RangeFetcher(session, "https://example.com/?a=b", "&range={}-{}", len(self.data),
+                                   window=1, min_chunk_size=1000, max_chunk_size=16000)
+            fetcher._chunk_size = 16000
+            self.assertEqual(b"".join(fetcher.stream_chunks()), self.data)
+        finally:
+            rangefetcher.TARGET_REQUEST_TIME = original_target
+        self.assertEqual(session.sizes[:6], [16000, 8000, 4000, 2000, 1000, 1000])
+
+    def test_expired_url_is_refreshed(self):
+        refreshes = []
+
+        def refresh():
+            refreshes.append(None)
+            return "https://example.com/?a=c", "&range={}-{}"
+
+        fetcher = RangeFetcher(self.session, "https://example.com/?expired=1", "&range={}-{}", len(self.data),
+                               window=4, min_chunk_size=1000, max_chunk_size=1000, refresh=refresh)
+        self.assertEqual(b"".join(fetcher.stream_chunks()), self.data)
+        self.assertEqual(len(refreshes), 1)
+        self.assertEqual(fetcher.get_stats().get_refreshes(), 1)
+
+    def test_expired_url_without_refresh(self):
+        fetcher = RangeFetcher(self.session, "https://example.com/?expired=1", "&range={}-{}", len(self.data))
+        with self.assertRaises(rangefetcher.StreamExpiredError):
+            b"".join(fetcher.stream_chunks())
+
+    def test_failures_are_retried(self):
+        session = FlakySession(self.data, [FakeResponse(b"", 503), requests.ConnectionError("reset")])
+        fetcher = RangeFetcher(session, "https://example.com/?a=b", "&range={}-{}", len(self.data),
+                               window=1, min_chunk_size=1000, max_chunk_size=1000, retry_delay=0)
+        self.assertEqual(b"".join(fetcher.stream_chunks()), self.data)
+        self.assertEqual(fetcher.get_stats().get_retries(), 2)
+
+    def test_truncated_response_is_resumed(self):
+        session = FlakySession(self.data, [], truncate=True)
+        fetcher = RangeFetcher(session, "https://example.com/?a=b", "&range={}-{}", len(self.data),
+                               window=2, min_chunk_size=1000, max_chunk_size=1000, retry_delay=0)
+        self.assertEqual(b"".join(fetcher.stream_chunks()), self.data)
+        self.assertEqual(fetcher.get_stats().get_retries(), 100)
+        # The second request of every range starts where the first one ended
+        self.assertIn("&range=500-999", session.urls)
+
+    def test_mismatching_content_range_is_retried(self):
+        session = FlakySession(self.data, [FakeResponse(self.data[:1000], 206, {"Content-Range": "bytes 0-999/*"})])
+        fetcher = RangeFetcher(session, "https://example.com/?a=b", "&range={}-{}", len(self.data), start=1000,
+                               window=1, min_chunk_size=1000, max_chunk_size=1000, retry_delay=0)
+        self.assertEqual(b"".join(fetcher.stream_chunks()), self.data[1000:])
+        self.assertEqual(fetcher.get_stats().get_retries(), 1)
+
+    def test_gives_up_after_max_retries(self):
+        session = FlakySession(self.data, [FakeResponse(b"", 500)] * 3)
+        fetcher = RangeFetcher(session, "https://example.com/?a=b", "&range={}-{}", len(self.data),
+                               window=1, max_retries=2, retry_delay=0)
+        with self.assertRaises(rangefetcher.InvalidRangeError):
+            b"".join(fetcher.stream_chunks())
+
+    def test_permanent_errors_are_not_retried(self):
+        session = FlakySession(self.data, [FakeResponse(b"", 404)])
+        fetcher = RangeFetcher(session, "https://example.com/?a=b", "&range={}-{}", len(self.data), retry_delay=0)
+        with self.assertRaises(rangefetcher.RangeRequestError):
+            b"".join(fetcher.stream_chunks())
+        self.assertEqual(fetcher.get_stats().get_retries(), 0)
+
+
+class TestDownloadStats(unittest.TestCase):
+    def test_throughput_of_concurrent_requests(self):
+        stats = DownloadStats()
+        # Four overlapping requests of one second each, the stream is done after 1.5 seconds
+        for start_time in [10.0, 10.0, 10.5, 10.5]:
+            stats.record(1000, start_time, start_time + 1.0)
+        self.assertEqual(stats.get_seconds(), 4.0)
+        self.assertEqual(stats.get_wall_time(), 1.5)
+        self.assertAlmostEqual(stats.get_throughput(), 4000 / 1.5)
+
+    def test_no_requests(self):
+        self.assertEqual(DownloadStats().get_throughput(), 0.0)
@@ -0,0 +1,74 @@
+import threading
+import time
+import unittest
+
+from riffbot.audio.readahead import ReadAheadBuffer
+
+
+class TestReadAheadBuffer(unittest.TestCase):
+    def test_chunks_in_order(self):
+        buffer = ReadAheadBuffer(100)
+        chunks = [bytes([i]) * 10 for i in range(50)]
+
+        def produce():
+            for chunk in chunks:
+                buffer.put(chunk)
+            buffer.finish()
+
+        threading.Thread(target=produce).start()
+        received = []
+        while True:
+            chunk = buffer.get()
+            if chunk is None:
+                break
+            received.append(chunk)
+        self.assertEqual(received, chunks)
+        self.assertLessEqual(buffer.get_max_fill_level(), 100)
+
+    def test_backpressure(self):
+        buffer = ReadAheadBuffer(100)
+        buffer.put(b"x" * 60)
+        done = threading.Event()
+
+        def produce():
+            buffer.put(b"y" * 60)
+            done.set()
+
+        threading.Thread(target=produce).start()
+        self.assertFalse(done.wait(0.05))
+        self.assertEqual(buffer.get_fill_level(), 60)
+        buffer.get()
+        self.assertTrue(done.wait(1))
+        self.assertGreater(buffer.get_stats().get_full_time(), 0.04)
+
+    def test_oversized_chunk_is_accepted_by_empty_buffer(self):
+        buffer = ReadAheadBuffer(100)
+        self.assertTrue(buffer.put(b"x" * 200))
+        self.assertEqual(buffer.get_fill_level(), 200)
+
+    def test_underruns(self):
+        buffer = ReadAheadBuffer(100)
+
+        def produce():
+            buffer.put(b"a")
+            time.sleep(0.05)
+            buffer.put(b"b")
+            buffer.finish()
+
+        threading.Thread(target=produce).start()
+        self.assertEqual(buffer.get(), b"a")
+        self.assertEqual(buffer.get(), b"b")
+        self.assertIsNone(buffer.get())
+        self.assertEqual(buffer.get_stats().get_underruns(), 1)
+        self.assertGreater(buffer.get_stats().get_longest_underrun(), 0.02)
+
+    def test_close_releases_producer(self):
+        buffer = ReadAheadBuffer(10)
+        buffer.put(b"x" * 10)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(buffer.put(b"y")))
+        thread.start()
+        buffer.close()
+        thread.join(1)
+        self.assertEqual(results, [False])
+        self.assertIsNone(buffer.get())
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+from riffbot.audio.songqueue import SongQueue
+from riffbot.endpoints import resolver
+from riffbot.utils import converters
+from tests.helpers import FakeEndpoint, names
+
+
+class FakePlaylist(resolver.PlaylistResolution):
+    """Returns the given batches one after another. Exceptions among them are raised instead."""
+
+    def __init__(self, batches):
+        self._batches = list(batches)
+        self._exhausted = False
+
+    async def next_batch(self, size=resolver.BATCH_SIZE, *, timeout=resolver.RESOLVE_TIMEOUT):
+        await asyncio.sleep(0)
+        batch = self._batches.pop(0)
+        self._exhausted = len(self._batches) == 0
+        if isinstance(batch, BaseException):
+            raise batch
+        return [FakeEndpoint(name) for name in batch]
+
+
+class TestEnqueueRemaining(unittest.TestCase):
+    def setUp(self):
+        self.queue = SongQueue()
+        self.first = FakeEndpoint("a")
+        self.queue.enqueue([self.first])
+
+    def test_enqueues_all_batches(self):
+        endpoints = [self.first]
+        asyncio.run(FakePlaylist(["bc", "d"]).enqueue_remaining(self.queue, endpoints))
+        self.assertEqual(names(endpoints), list("abcd"))
+        self.assertEqual(names(self.queue.list()), list("abcd"))
+
+    def test_at_front(self):
+        self.queue.enqueue([FakeEndpoint("x")])
+        endpoints = [self.first]
+        asyncio.run(FakePlaylist(["bc", "d"]).enqueue_remaining(self.queue, endpoints, at_front=True))
+        self.assertEqual(names(self.queue.list()), list("abcdx"))
+
+    def test_error_partway_through(self):
+        endpoints = [self.first]
+        playlist = FakePlaylist(["bc", OSError("connection reset"), "d"])
+        with self.assertRaises(OSError):
+            asyncio.run(playlist.enqueue_remaining(self.queue, endpoints))
+        # The entries loaded before the error stay enqueued and are counted
+        self.assertEqual(names(endpoints), list("abc"))
+        self.assertEqual(names(self.queue.list()), list("abc"))
+
+
+class StalledResolve:
+    """Stands in for the blocking resolution, every call waits until it is released"""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.running = 0
+        self.max_running = 0
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, args):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.threads.add(threading.current_thread())
+        self.released.wait(5)
+        with self._lock:
+            self.running -= 1
+        return [args[0]]
+
+
+class TestResolveYoutube(unittest.TestCase):
+    def setUp(self):
+        self.resolve = StalledResolve()
+        patcher = patch.object(resolver, "_resolve_youtube", self.resolve)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # A running job cannot be interrupted, let it finish so the pool is free for the next test
+        self.addCleanup(self.resolve.released.set)
+
+    def test_resolves_beyond_the_pool_size_queue_up(self):
+        async def run():
+            resolves = [asyncio.ensure_future(resolver.resolve_youtube([str(i)]))
+                        for i in range(2 * resolver.MAX_WORKERS)]
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.resolve.running, resolver.MAX_WORKERS)
+            self.resolve.released.set()
+            return await asyncio.gather(*resolves)
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [[str(i)] for i in range(2 * resolver.MAX_WORKERS)])
+        self.assertEqual(self.resolve.max_running, resolver.MAX_WORKERS)
+        self.assertLessEqual(len(self.resolve.threads), resolver.MAX_WORKERS)
+
+    def test_stalled_resolve_times_out(self):
+        with self.assertLogs(resolver._logger, "WARNING"):
+            with self.assertRaises(resolver.ResolutionTimeoutError):
+                asyncio.run(resolver.resolve_youtube(["stalled"], timeout=0.05))
+
+    def test_timeout_of_a_queued_resolve(self):
+        async def run():
+            busy = [asyncio.ensure_future(resolver.resolve_youtube([str(i)])) for i in range(resolver.MAX_WORKERS)]
+            with self.assertRaises(resolver.ResolutionTimeoutError):
+                await resolver.resolve_youtube(["queued"], timeout=0.05)
+            self.resolve.released.set()
+            await asyncio.gather(*busy)
+
+        with self.assertLogs(resolver._logger, "WARNING"):
+            asyncio.run(run())
+
+
+class FakeYoutubeDL:
+    """Returns the info of the URLs in results, like YoutubeDL.extract_info with extract_flat and process=False"""
+
+    results = {}
+
+    def __init__(self, options):
+        self.options = options
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, url, download=True, ie_key=None, process=True):
+        return self.results[url]
+
+
+def playlist_url(playlist_id):
+    return f"https://www.youtube.com/playlist?list={playlist_id}"
+
+
+def playlist_info(video_ids):
+    return {"_type": "playlist", "entries": [{"_type": "url", "id": video_id, "title": video_id, "duration": 60}
+                                             for video_id in video_ids]}
+
+
+class TestPlaylistResolution(unittest.TestCase):
+    def setUp(self):
+        patcher = patch("youtube_dl.YoutubeDL", FakeYoutubeDL)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.video_ids = [f"video{i:06d}" for i in range(5)]
+
+    def _resolve(self, playlist_id, **kwargs):
+        async def run():
+            playlist = resolver.open_youtube_playlist([playlist_url(playlist_id)], **kwargs)
+            batches = []
+            while not playlist.is_exhausted():
+                batches.append(await playlist.next_batch(2))
+            return batches
+
+        return asyncio.run(run())
+
+    def test_batches(self):
+        FakeYoutubeDL.results = {playlist_url("PLplaylist123"): playlist_info(self.video_ids)}
+        batches = self._resolve("PLplaylist123", exclude_id=self.video_ids[1])
+        self.assertEqual([[endpoint.get_youtube_id() for endpoint in batch] for batch in batches],
+                         [self.video_ids[:1], self.video_ids[2:4], self.video_ids[4:]])
+        self.assertEqual(batches[0][0].get_song_description(), self.video_ids[0])
+        self.assertEqual(batches[0][0].get_length(), 60)
+
+    def test_url_result_is_followed(self):
+        FakeYoutubeDL.results = {playlist_url("RDmix12345678"): {"_type": "url", "url": "https://mix", "ie_key": "Tab"},
+                                 "https://mix": playlist_info(self.video_ids)}
+        batches = self._resolve("RDmix12345678")
+        self.assertEqual([endpoint.get_youtube_id() for batch in batches for endpoint in batch], self.video_ids)
+
+    def test_url_result_without_playlist(self):
+        FakeYoutubeDL.results = {playlist_url("RDmix12345678"): {"_type": "url", "url": "https://video"},
+                                 "https://video": {"_type": "video", "id": self.video_ids[0]}}
+        with self.assertRaises(converters.PlaylistNotFoundError):
+            self._resolve("RDmix12345678")
+
+    def test_endless_redirects(self):
+        FakeYoutubeDL.results = {playlist_url("RDmix12345678"): {"_type": "url", "url": playlist_url("RDmix12345678")}}
+        with self.assertRaises(converters.PlaylistNotFoundError):
+            self._resolve("RDmix12345678")
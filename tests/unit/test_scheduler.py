@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+
+from riffbot.utils.scheduler import DeadlineScheduler
+
+
+class TestDeadlineScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = DeadlineScheduler()
+        self.fired = []
+
+    async def _record(self, name: str):
+        self.fired.append(name)
+
+    def test_fires_in_order(self):
+        async def run():
+            self.scheduler.create(0.04, self._record, "b")
+            self.scheduler.create(0.02, self._record, "a")
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(self.fired, ["a", "b"])
+        self.assertEqual(self.scheduler.get_fired(), 2)
+        self.assertEqual(self.scheduler.get_pending(), 0)
+
+    def test_reset_postpones(self):
+        async def run():
+            deadline = self.scheduler.create(0.05, self._record, "a")
+            for _ in range(3):
+                await asyncio.sleep(0.03)
+                deadline.reset()
+            self.assertEqual(self.fired, [])
+            self.assertTrue(deadline.is_pending())
+            await asyncio.sleep(0.1)
+            self.assertFalse(deadline.is_pending())
+
+        asyncio.run(run())
+        self.assertEqual(self.fired, ["a"])
+
+    def test_reset_does_not_add_heap_entries(self):
+        async def run():
+            deadline = self.scheduler.create(10.0, self._record, "a")
+            for _ in range(1000):
+                deadline.reset()
+            self.assertEqual(len(self.scheduler._heap), 1)
+            deadline.reset(0.01)  # Earlier than its entry
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(self.fired, ["a"])
+        self.assertEqual(self.scheduler.get_pending(), 0)
+
+    def test_cancel(self):
+        async def run():
+            deadline = self.scheduler.create(0.02, self._record, "a")
+            self.scheduler.create(0.02, self._record, "b")
+            deadline.cancel()
+            self.assertIsNone(deadline.get_remaining())
+            await asyncio.sleep(0.05)
+
+            # A cancelled deadline can be started again
+            deadline.reset()
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(self.fired, ["b", "a"])
+
+    def test_failing_job_does_not_stop_others(self):
+        async def fail():
+            raise ValueError("failed")
+
+        async def run():
+            self.scheduler.create(0.01, fail)
+            self.scheduler.create(0.02, self._record, "a")
+            await asyncio.sleep(0.05)
+
+        with self.assertLogs("riffbot.utils.scheduler"):
+            asyncio.run(run())
+        self.assertEqual(self.fired, ["a"])
+
+    def test_new_event_loop(self):
+        async def run(name: str, timeout: float, wait: float):
+            self.scheduler.create(timeout, self._record, name)
+            await asyncio.sleep(wait)
+
+        # The first deadline is still pending when its event loop is closed, it runs on the next one
+        asyncio.run(run("a", 0.1, 0.01))
+        asyncio.run(run("b", 0.15, 0.3))
+        self.assertEqual(self.fired, ["a", "b"])
@@ -0,0 +1,185 @@
+import asyncio
+import gc
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from riffbot.audio.songqueue import SongQueue
+from riffbot.endpoints import youtube
+from riffbot.snapshots import (InvalidSnapshotError, SnapshotEntry, SnapshotManager, SnapshotStore, decode_snapshot,
+                               encode_entry, encode_snapshot)
+
+ENTRIES = [SnapshotEntry("dQw4w9WgXcQ", "Never Gonna Give You Up", 213),
+           SnapshotEntry("9bZkp7q19f0", "강남스타일", 252),
+           SnapshotEntry("jfKfPfyJRdk", "lofi hip hop radio", 3600)]
+
+
+class FakePlayer:
+    def __init__(self):
+        self.queue = SongQueue()
+        self.current = None
+        self.playtime = 0.0
+
+    def get_queue(self):
+        return self.queue
+
+    def get_current(self):
+        return self.current
+
+    def get_playtime(self):
+        return self.playtime
+
+
+class FakeState:
+    def __init__(self, guild_id):
+        self._guild_id = guild_id
+        self.player = FakePlayer()
+
+    def get_guild_id(self):
+        return self._guild_id
+
+    def get_player(self):
+        return self.player
+
+
+class FakeRegistry:
+    def __init__(self, states):
+        self._states = states
+
+    def list(self):
+        return list(self._states)
+
+    def get(self, guild_id):
+        return next((state for state in self._states if state.get_guild_id() == guild_id), None)
+
+    def remove(self, guild_id):
+        self._states = [state for state in self._states if state.get_guild_id() != guild_id]
+
+
+class TestSnapshotFormat(unittest.TestCase):
+    def test_round_trip(self):
+        snapshot = decode_snapshot(encode_snapshot([encode_entry(entry) for entry in ENTRIES], 42.5))
+        self.assertEqual(snapshot.entries, ENTRIES)
+        self.assertEqual(snapshot.position, 42.5)
+
+    def test_without_current_song(self):
+        snapshot = decode_snapshot(encode_snapshot([encode_entry(ENTRIES[0])]))
+        self.assertEqual(snapshot.entries, ENTRIES[:1])
+        self.assertIsNone(snapshot.position)
+
+    def test_unknown_length(self):
+        entry = SnapshotEntry("jfKfPfyJRdk", "lofi hip hop radio", None)
+        self.assertEqual(decode_snapshot(encode_snapshot([encode_entry(entry)])).entries, [entry])
+
+    def test_truncated(self):
+        data = encode_snapshot([encode_entry(entry) for entry in ENTRIES])
+        with self.assertRaises(InvalidSnapshotError):
+            decode_snapshot(data[:-5])
+        with self.assertRaises(InvalidSnapshotError):
+            decode_snapshot(b"RBQS")
+
+
+class TestSnapshotManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SnapshotStore(self.directory.name)
+        self.state = FakeState(1234)
+        self.manager = SnapshotManager(self.store, FakeRegistry([self.state]))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_and_restore(self):
+        player = self.state.player
+        player.current = youtube.restore_endpoint(*ENTRIES[0])
+        player.playtime = 30.0
+        player.queue.enqueue([youtube.restore_endpoint(*entry) for entry in ENTRIES[1:]])
+        asyncio.run(self.manager.save_changes())
+
+        # A new store only knows which guilds have a snapshot until one is read
+        store = SnapshotStore(self.directory.name)
+        self.assertEqual(store.get_guild_ids(), [1234])
+        endpoints, position = asyncio.run(SnapshotManager(store, FakeRegistry([])).restore(1234))
+        self.assertEqual([endpoint.get_youtube_id() for endpoint in endpoints], [entry.video_id for entry in ENTRIES])
+        self.assertEqual(endpoints[1].get_song_description(), ENTRIES[1].title)
+        self.assertEqual(endpoints[0].get_length(), ENTRIES[0].length)
+        self.assertEqual(position, 30.0)
+
+    def test_endpoints_are_restored_off_the_event_loop(self):
+        self.state.player.queue.enqueue(youtube.restore_endpoint(*ENTRIES[0]))
+        asyncio.run(self.manager.save_changes())
+        threads = []
+        original = youtube.restore_endpoint
+
+        def restore_endpoint(*entry):
+            threads.append(threading.current_thread())
+            return original(*entry)
+
+        with patch("riffbot.endpoints.youtube.restore_endpoint", restore_endpoint):
+            endpoints, _ = asyncio.run(self.manager.restore(1234))
+        self.assertEqual(len(endpoints), 1)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_position_is_updated_in_place(self):
+        player = self.state.player
+        player.current = youtube.restore_endpoint(*ENTRIES[0])
+        asyncio.run(self.manager.save_changes())
+        path = os.path.join(self.directory.name, "1234.queue")
+        inode = os.stat(path).st_ino
+        player.playtime = 100.0
+        asyncio.run(self.manager.save_changes())
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(self.store.read(1234).position, 100.0)
+
+        # Changing the queue rewrites the whole snapshot
+        player.queue.enqueue(youtube.restore_endpoint(*ENTRIES[1]))
+        asyncio.run(self.manager.save_changes())
+        self.assertEqual(len(self.store.read(1234).entries), 2)
+
+    def test_empty_queue_removes_snapshot(self):
+        self.state.player.queue.enqueue(youtube.restore_endpoint(*ENTRIES[0]))
+        asyncio.run(self.manager.save_changes())
+        self.assertTrue(self.store.has(1234))
+        self.state.player.queue.clear()
+        asyncio.run(self.manager.save_changes())
+        self.assertFalse(self.store.has(1234))
+        self.assertIsNone(asyncio.run(self.manager.restore(1234)))
+
+    def test_discard_waits_for_running_write(self):
+        self.state.player.queue.enqueue(youtube.restore_endpoint(*ENTRIES[0]))
+        started = threading.Event()
+        release = threading.Event()
+        write = self.store.write
+
+        def slow_write(guild_id, data):
+            started.set()
+            release.wait(1)
+            write(guild_id, data)
+
+        self.store.write = slow_write
+
+        async def run():
+            saving = asyncio.ensure_future(self.manager.save_changes())
+            await asyncio.get_event_loop().run_in_executor(None, started.wait)
+            # The guild leaves while its snapshot is being written
+            self.manager._guilds.remove(1234)
+            discarding = asyncio.ensure_future(self.manager.discard(1234))
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.gather(saving, discarding)
+
+        asyncio.run(run())
+        self.assertFalse(self.store.has(1234))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "1234.queue")))
+
+    def test_left_guilds_are_not_kept_alive(self):
+        self.state.player.queue.enqueue(youtube.restore_endpoint(*ENTRIES[0]))
+        asyncio.run(self.manager.save_changes())
+        self.assertEqual(len(self.manager._written), 1)
+        self.manager._guilds.remove(1234)
+        self.state = None
+        gc.collect()
+        self.assertEqual(len(self.manager._written), 0)
@@ -0,0 +1,58 @@
+import unittest
+
+from riffbot.audio import songqueue
+from riffbot.audio.songqueue import InvalidPositionError, SongQueue
+from tests.helpers import FakeEndpoint, names
+
+
+class TestSongQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = SongQueue()
+        self.queue.enqueue([FakeEndpoint(name) for name in "abcde"])
+
+    def test_bulk_insert(self):
+        self.queue.enqueue([FakeEndpoint("x"), FakeEndpoint("y")], pos=2)
+        self.assertEqual(names(self.queue.list()), ["a", "b", "x", "y", "c", "d", "e"])
+        with self.assertRaises(InvalidPositionError):
+            self.queue.enqueue(FakeEndpoint("z"), pos=8)
+
+    def test_remove_and_move(self):
+        self.assertEqual(self.queue.remove(1).get_song_description(), "b")
+        self.queue.move(0, 3)
+        self.assertEqual(names(self.queue.list()), ["c", "d", "e", "a"])
+        self.queue.move(3, 1)
+        self.assertEqual(names(self.queue.list()), ["c", "a", "d", "e"])
+        with self.assertRaises(InvalidPositionError):
+            self.queue.remove(4)
+
+    def test_total_length(self):
+        self.queue.enqueue([FakeEndpoint("x", length=None), FakeEndpoint("y", length=5)], pos=0)
+        self.assertEqual(self.queue.get_total_length(), 55)
+        self.assertEqual(self.queue.get_unknown_lengths(), 1)
+        self.queue.get_next()
+        self.queue.remove(0)
+        self.assertEqual(self.queue.get_total_length(), 50)
+        self.assertEqual(self.queue.get_unknown_lengths(), 0)
+        self.queue.clear()
+        self.assertEqual(self.queue.get_total_length(), 0)
+
+    def test_positions_after_taking_songs(self):
+        original_threshold = songqueue._COMPACT_THRESHOLD
+        songqueue._COMPACT_THRESHOLD = 2
+        try:
+            self.assertEqual(self.queue.get_next().get_song_description(), "a")
+            self.assertEqual(self.queue.get_next().get_song_description(), "b")
+            self.assertEqual(self.queue.get_next().get_song_description(), "c")
+        finally:
+            songqueue._COMPACT_THRESHOLD = original_threshold
+        self.queue.enqueue(FakeEndpoint("x"), pos=1)
+        self.assertEqual(names(self.queue.list()), ["d", "x", "e"])
+        self.assertEqual(names(self.queue.list(1, 2)), ["x"])
+        self.assertEqual(self.queue.peek().get_song_description(), "d")
+        self.assertEqual(self.queue.size(), 3)
+
+    def test_shuffle_keeps_songs(self):
+        self.queue.get_next()
+        self.queue.shuffle()
+        self.assertEqual(sorted(names(self.queue.list())), ["b", "c", "d", "e"])
+        self.assertEqual(self.queue.get_total_length(), 40)
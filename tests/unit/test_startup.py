@@ -0,0 +1,30 @@
+import json
+import subprocess
+import sys
+import unittest
+
+# Libraries that are needed anyway before the bot can connect, they are not counted against the budget
+REQUIRED_MODULES = ["blinker", "discord", "discord.ext.commands", "dotenv", "i18n"]
+# Libraries that are only imported once they are used
+LAZY_MODULES = ["gtts", "pafy", "requests", "youtube_dl", "youtube_search"]
+
+_script = f"""
+import json, sys, time
+import {", ".join(REQUIRED_MODULES)}
+start = time.perf_counter()
+import riffbot.__main__
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def measure_startup() -> dict:
+    """Import riffbot in a fresh interpreter, so nothing is imported yet. Returns the seconds it took and which of the
+    lazily imported libraries were loaded. The time is checked by the startup benchmark."""
+    output = subprocess.run([sys.executable, "-c", _script], capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+class TestStartup(unittest.TestCase):
+    def test_heavy_libraries_are_not_imported(self):
+        self.assertEqual(measure_startup()["modules"], [])
@@ -0,0 +1,66 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from riffbot.endpoints import texttospeech
+from riffbot.endpoints.texttospeech import TextToSpeechEndpoint
+
+
+class FakeSession:
+    def __init__(self, delays=None):
+        self.requests = []
+        self.timeouts = []
+        self.delays = delays or {}
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def get(self, url, timeout=None):
+        with self.lock:
+            self.requests.append(url)
+            self.timeouts.append(timeout)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delays.get(url, 0.0))
+        with self.lock:
+            self.active -= 1
+        return MagicMock(content=url.encode())
+
+
+@patch("gtts.gTTS")
+class TestTextToSpeechEndpoint(unittest.TestCase):
+    def setUp(self):
+        texttospeech.get_speech_cache().clear()
+        self.session = FakeSession({"a": 0.05, "c": 0.02})
+        patcher = patch("riffbot.endpoints.httppool.get_session", return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_same_text_is_fetched_once(self, gtts):
+        gtts.return_value.get_urls.return_value = ["a", "b"]
+        self.assertEqual(b"".join(TextToSpeechEndpoint("Good  morning!").stream_chunks()), b"ab")
+        self.assertEqual(b"".join(TextToSpeechEndpoint(" Good morning! ").stream_chunks()), b"ab")
+        self.assertEqual(self.session.requests, ["a", "b"])
+        self.assertNotIn(None, self.session.timeouts)
+        self.assertEqual(gtts.call_count, 1)
+
+    def test_languages_are_cached_separately(self, gtts):
+        gtts.return_value.get_urls.return_value = ["a"]
+        list(TextToSpeechEndpoint("Hallo").stream_chunks())
+        list(TextToSpeechEndpoint("Hallo", lang="de").stream_chunks())
+        self.assertEqual(len(self.session.requests), 2)
+
+    def test_incomplete_stream_is_not_cached(self, gtts):
+        gtts.return_value.get_urls.return_value = ["a", "b"]
+        chunks = TextToSpeechEndpoint("Hello").stream_chunks()
+        next(chunks)
+        chunks.close()
+        self.assertEqual(texttospeech.get_speech_cache().size(), 0)
+
+    def test_segments_are_fetched_concurrently_in_order(self, gtts):
+        urls = [*"abcdefgh"]
+        gtts.return_value.get_urls.return_value = urls
+        self.assertEqual(b"".join(TextToSpeechEndpoint("A long text").stream_chunks()), "".join(urls).encode())
+        self.assertGreater(self.session.max_active, 1)
+        self.assertLessEqual(self.session.max_active, texttospeech.FETCH_WINDOW)
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from riffbot.utils.topics import TopicUpdater
+
+
+class FakeChannel:
+    def __init__(self, channel_id=1, topic=None):
+        self.id = channel_id
+        self.topic = topic
+        self.edits = []
+
+    async def edit(self, *, topic):
+        self.edits.append(topic)
+
+
+class TestTopicUpdater(unittest.TestCase):
+    def run_updates(self, updater, *steps, wait=0.1):
+        async def run():
+            for channel, topic in steps:
+                updater.set_topic(channel, topic)
+            await asyncio.sleep(wait)
+        asyncio.run(run())
+
+    def test_only_latest_topic_is_sent(self):
+        updater = TopicUpdater(delay=0.01)
+        channel = FakeChannel()
+        self.run_updates(updater, (channel, "a"), (channel, "b"), (channel, "c"))
+        self.assertEqual(channel.edits, ["c"])
+        self.assertEqual(updater.get_sent(), 1)
+        self.assertEqual(updater.get_merged(), 2)
+
+    def test_unchanged_topic_is_dropped(self):
+        updater = TopicUpdater(delay=0.01)
+        channel = FakeChannel(topic="a")
+        self.run_updates(updater, (channel, "a"), (channel, "b"), (channel, "a"))
+        self.assertEqual(channel.edits, [])
+        self.assertEqual(updater.get_dropped(), 2)
+
+    def test_channels_are_independent(self):
+        updater = TopicUpdater(delay=0.01)
+        first, second = FakeChannel(1), FakeChannel(2)
+        self.run_updates(updater, (first, "a"), (second, "b"))
+        self.assertEqual(first.edits, ["a"])
+        self.assertEqual(second.edits, ["b"])
+
+    def test_rate_limit_window(self):
+        updater = TopicUpdater(delay=0.01, edits_per_window=1, window=0.3)
+        channel = FakeChannel()
+
+        async def run():
+            updater.set_topic(channel, "a")
+            await asyncio.sleep(0.1)
+            updater.set_topic(channel, "b")
+            await asyncio.sleep(0.1)
+            # The second edit has to wait for the window
+            self.assertEqual(channel.edits, ["a"])
+            updater.set_topic(channel, None)
+            await asyncio.sleep(0.3)
+        asyncio.run(run())
+        self.assertEqual(channel.edits, ["a", None])
+        self.assertEqual(updater.get_merged(), 1)
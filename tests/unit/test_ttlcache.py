@@ -0,0 +1,69 @@
+import unittest
+
+from riffbot.cache.ttlcache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache("test", 3, 10.0, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", 1, cost=0.5)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get_hits(), 2)
+        self.assertEqual(self.cache.get_misses(), 1)
+        self.assertAlmostEqual(self.cache.get_time_saved(), 1.0)
+
+    def test_entries_expire(self):
+        self.cache.put("a", 1)
+        self.cache.put("b", 2, ttl=20.0)
+        self.clock.now = 10.0
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
+        self.assertEqual(self.cache.get_expirations(), 1)
+        self.assertEqual(self.cache.size(), 1)
+
+    def test_lru_eviction(self):
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.put("c", 3)
+        self.cache.get("a")
+        self.cache.put("d", 4)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get_evictions(), 1)
+
+    def test_get_or_load(self):
+        calls = []
+
+        def load():
+            calls.append(None)
+            return "value"
+
+        self.assertEqual(self.cache.get_or_load("a", load), "value")
+        self.assertEqual(self.cache.get_or_load("a", load), "value")
+        self.assertEqual(len(calls), 1)
+
+    def test_none_is_not_cached(self):
+        self.assertIsNone(self.cache.get_or_load("a", lambda: None))
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_replace_keeps_expiry(self):
+        self.cache.put("a", 1)
+        self.clock.now = 5.0
+        self.assertTrue(self.cache.replace("a", 2))
+        self.assertFalse(self.cache.replace("b", 2))
+        self.assertEqual(self.cache.get("a"), 2)
+        self.clock.now = 10.0
+        self.assertIsNone(self.cache.get("a"))